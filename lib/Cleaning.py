@@ -0,0 +1,379 @@
+# Cleaning.py - the match cleaning and grouping steps shared by the
+# 4b/4d/5c scripts and the in-memory pipeline (5b-clean-pipeline.py.)
+#
+# These work on an already loaded project and match lists and return
+# new match lists or boolean masks over the packed observations (see
+# Tracks.py and match_culling.delete_masked_matches()), they never
+# touch the project files.
+
+import warnings
+
+import numpy as np
+
+from props import getNode
+
+import Reprojection
+import SRTM
+
+# Reset all match point locations to their original direct
+# georeferenced locations based on estimated camera pose and
+# projection onto DEM earth surface (4b.)  Needs the features (and
+# undistorted keypoints) and match pairs loaded.  Returns the pair wise
+# matches_direct list.
+def reset_matches(proj, ground=None):
+    # compute keypoint usage map
+    proj.compute_kp_usage()
+
+    if ground:
+        proj.fastProjectKeypointsToGround(ground)
+    else:
+        # lookup ned reference
+        ref_node = getNode("/config/ned_reference", True)
+        ref = [ ref_node.getFloat('lat_deg'),
+                ref_node.getFloat('lon_deg'),
+                ref_node.getFloat('alt_m') ]
+
+        # setup SRTM ground interpolator
+        sss = SRTM.NEDGround( ref, 2000, 2000, 30 )
+        proj.fastProjectKeypointsTo3d(sss)
+
+    # For some features detection algorithms we expect duplicated
+    # feature uv coordinates.  These duplicates may have different
+    # scaling or other attributes important during feature matching,
+    # yet ultimately resolve to the same uv coordinate in an image.
+    print("Indexing features by unique uv coordinates...")
+    for image in proj.image_list:
+        print(image.name)
+        # pass one, build a tmp structure of unique keypoints (by uv)
+        # and the index of the first instance.
+        image.kp_remap = {}
+        used = 0
+        for i, kp in enumerate(image.kp_list):
+            if image.kp_used[i]:
+                used += 1
+                key = "%.2f-%.2f" % (kp.pt[0], kp.pt[1])
+                if not key in image.kp_remap:
+                    image.kp_remap[key] = i
+        print(" features used:", used)
+        print(" unique by uv and used:", len(image.kp_remap))
+
+    # after feature matching we don't care about other attributes,
+    # just the uv coordinate.  Different pairs could reference the same
+    # keypoint at different scales, so collapse all the duplicates
+    # within the entire match set.
+    print("Collapsing keypoints with duplicate uv coordinates...")
+    for i, i1 in enumerate(proj.image_list):
+        for j, matches in enumerate(i1.match_list):
+            count = 0
+            i2 = proj.image_list[j]
+            for k, pair in enumerate(matches):
+                idx1 = pair[0]
+                idx2 = pair[1]
+                kp1 = i1.kp_list[idx1]
+                kp2 = i2.kp_list[idx2]
+                key1 = "%.2f-%.2f" % (kp1.pt[0], kp1.pt[1])
+                key2 = "%.2f-%.2f" % (kp2.pt[0], kp2.pt[1])
+                new_idx1 = i1.kp_remap[key1]
+                new_idx2 = i2.kp_remap[key2]
+                # count the number of match rewrites
+                if idx1 != new_idx1 or idx2 != new_idx2:
+                    count += 1
+                if idx1 != new_idx1:
+                    # sanity check
+                    uv1 = list(i1.kp_list[idx1].pt)
+                    new_uv1 = list(i1.kp_list[new_idx1].pt)
+                    if not np.allclose(uv1, new_uv1):
+                        print("OOPS!!!")
+                        print("  index 1: %d -> %d" % (idx1, new_idx1))
+                        print("  [%.2f, %.2f] -> [%.2f, %.2f]" % (uv1[0], uv1[1],
+                                                                  new_uv1[0],
+                                                                  new_uv1[1]))
+                if idx2 != new_idx2:
+                    # sanity check
+                    uv2 = list(i2.kp_list[idx2].pt)
+                    new_uv2 = list(i2.kp_list[new_idx2].pt)
+                    if not np.allclose(uv2, new_uv2):
+                        print("OOPS!")
+                        print("  index 2: %d -> %d" % (idx2, new_idx2))
+                        print("  [%.2f, %.2f] -> [%.2f, %.2f]" % (uv2[0], uv2[1],
+                                                                  new_uv2[0],
+                                                                  new_uv2[1]))
+                # rewrite matches
+                matches[k] = [new_idx1, new_idx2]
+            if count > 0:
+                print('Match:', i, 'vs', j, 'matches:', len(matches), 'rewrites:', count)
+
+    # after collapsing by uv coordinate, we could be left with duplicate
+    # matches (matched at different scales or other attributes, but
+    # same exact point.)
+    print("Checking for pair duplicates...")
+    for i, i1 in enumerate(proj.image_list):
+        for j, matches in enumerate(i1.match_list):
+            count = 0
+            pair_dict = {}
+            new_matches = []
+            for k, pair in enumerate(matches):
+                key = "%d-%d" % (pair[0], pair[1])
+                if not key in pair_dict:
+                    pair_dict[key] = True
+                    new_matches.append(pair)
+                else:
+                    count += 1
+            if count > 0:
+                print('Match:', i, 'vs', j, 'matches:', len(matches), 'dups:', count)
+            i1.match_list[j] = new_matches
+
+    # Do we have a keypoint in i1 matching multiple keypoints in i2?
+    # (these shouldn't exist here, but let's check anyway.)
+    print("Testing for 1 vs. n keypoint duplicates...")
+    for i, i1 in enumerate(proj.image_list):
+        for j, matches in enumerate(i1.match_list):
+            i2 = proj.image_list[j]
+            count = 0
+            kp_dict = {}
+            for k, pair in enumerate(matches):
+                if not pair[0] in kp_dict:
+                    kp_dict[pair[0]] = pair[1]
+                else:
+                    print("Warning keypoint idx", pair[0], "already used in another match.")
+                    uv2a = list(i2.kp_list[ kp_dict[pair[0]] ].pt)
+                    uv2b = list(i2.kp_list[ pair[1] ].pt)
+                    if not np.allclose(uv2a, uv2b):
+                        print("  [%.2f, %.2f] -> [%.2f, %.2f]" % (uv2a[0], uv2a[1],
+                                                                  uv2b[0], uv2b[1]))
+                    count += 1
+            if count > 0:
+                print('Match:', i, 'vs', j, 'matches:', len(matches), 'dups:', count)
+
+    print("Constructing unified match structure...")
+    # create an initial pair-wise match list
+    matches_direct = []
+    for i, img in enumerate(proj.image_list):
+        for j, matches in enumerate(img.match_list):
+            if j > i:
+                for pair in matches:
+                    # ned place holder
+                    matches_direct.append( [ [0.0, 0.0, 0.0],
+                                             [i, pair[0]], [j, pair[1]] ] )
+
+    if len(matches_direct):
+        print("Total unique features in image set = %d" % len(matches_direct))
+
+    # compute an initial guess at the 3d location of each unique
+    # feature by averaging the locations of each projection
+    print("Estimating world coordinates of each keypoint...")
+    for match in matches_direct:
+        sum = np.array( [0.0, 0.0, 0.0] )
+        for p in match[1:]:
+            sum += proj.image_list[ p[0] ].coord_list[ p[1] ]
+        ned = sum / len(match[1:])
+        match[0] = ned.tolist()
+    return matches_direct
+
+# Maximally group all the pair wise match chains that refer to the same
+# keypoint (4d.)  Needs the features loaded.  Returns the grouped match
+# list with the keypoint indices replaced by their uv coordinates.
+def group_chains(proj, matches_direct):
+    count = 0
+    done = False
+    while not done:
+        print("Iteration:", count)
+        count += 1
+        matches_new = []
+        matches_lookup = {}
+        for i, match in enumerate(matches_direct):
+            # scan if any of these match points have been previously
+            # seen and record the match index
+            index = -1
+            for p in match[1:]:
+                key = "%d-%d" % (p[0], p[1])
+                if key in matches_lookup:
+                    index = matches_lookup[key]
+                    break
+            if index < 0:
+                # not found, append to the new list
+                for p in match[1:]:
+                    key = "%d-%d" % (p[0], p[1])
+                    matches_lookup[key] = len(matches_new)
+                matches_new.append(list(match)) # shallow copy
+            else:
+                # found a previous reference, append these match items
+                existing = matches_new[index]
+                for p in match[1:]:
+                    key = "%d-%d" % (p[0], p[1])
+                    found = False
+                    for e in existing[1:]:
+                        if p[0] == e[0]:
+                            found = True
+                            break
+                    if not found:
+                        # add
+                        existing.append(list(p)) # shallow copy
+                        matches_lookup[key] = index
+                # attempt to combine location equitably
+                size1 = len(match[1:])
+                size2 = len(existing[1:])
+                ned1 = np.array(match[0])
+                ned2 = np.array(existing[0])
+                avg = (ned1 * size1 + ned2 * size2) / (size1 + size2)
+                existing[0] = avg.tolist()
+        if len(matches_new) == len(matches_direct):
+            done = True
+        else:
+            matches_direct = list(matches_new) # shallow copy
+
+    # replace the keypoint index with the actual kp values (new lists,
+    # the pair wise elements are shared with the input.)
+    matches_grouped = []
+    for match in matches_direct:
+        new_match = [ match[0] ]
+        for m in match[1:]:
+            kp = proj.image_list[m[0]].kp_list[m[1]].pt
+            new_match.append( [m[0], list(kp)] )
+        matches_grouped.append(new_match)
+
+    if len(matches_grouped):
+        lengths = [ len(match) - 1 for match in matches_grouped ]
+        print("Total unique features in image set = %d" % len(matches_grouped))
+        print("Keypoint average instances = %.2f" % np.mean(lengths))
+        print("Max chain length =", np.amax(lengths), ' @ index =', np.argmax(lengths))
+    return matches_grouped
+
+# recreate the per image pair-wise match structure (image.match_list)
+# from the pair wise matches_direct, needed by
+# Groups.groupByFeatureConnections() (4e)
+def pair_match_lists(proj, matches_direct):
+    for i1 in proj.image_list:
+        i1.match_list = []
+        for i2 in proj.image_list:
+            i1.match_list.append([])
+    for match in matches_direct:
+        for p1 in match[1:]:
+            for p2 in match[1:]:
+                if p1 != p2:
+                    image = proj.image_list[p1[0]]
+                    image.match_list[p2[0]].append( [p1[1], p2[1]] )
+
+# mask of the observations (of packed tracks) in images outside of
+# group (4g)
+def ungrouped_mask(tracks, group, n_images):
+    in_group = np.zeros(n_images, dtype=bool)
+    in_group[list(group)] = True
+    return ~in_group[tracks.obs_image]
+
+# mask of the optimized observations (packed matches_opt tracks within
+# the placed group) with a reprojection error more than stddev standard
+# deviations above the mean (5c-mre-by-feature3 auto mode.)
+def reprojection_outliers(proj, tracks, group, stddev):
+    rvecs, tvecs = Reprojection.camera_params(proj, opt=True)
+    K = proj.cam.get_K(optimized=True)
+    distCoeffs = proj.cam.get_dist_coeffs(optimized=True)
+    residuals = Reprojection.residuals(tracks, rvecs, tvecs, K, distCoeffs)
+    obs_mask = Reprojection.placed_mask(tracks, group, len(proj.image_list))
+    obs_error = np.linalg.norm(residuals, axis=1)
+    errors = obs_error[obs_mask]
+    mre = np.mean(errors)
+    std = np.std(errors)
+    print("mre = %.4f stddev = %.4f" % (mre, std))
+    return obs_mask & (obs_error > mre + std * stddev)
+
+# surface consistency outliers (5c-surface-outliers3): neighbors are
+# found in pixel space and the 3d distance to each neighbor is compared
+# against a local line fit of 3d distance vs. 2d distance.  All the
+# observations go into a single kd tree (image index scaled far apart
+# as a 3rd coordinate so neighbors never cross images) and are queried
+# in one batch.
+
+# neighbors to query and how many of them (with a non-zero pixel
+# distance) take part in each fit
+surface_query = 30
+surface_fit = 10
+
+# image separation in the kd tree (larger than any pixel distance)
+surface_image_spacing = 1.0e7
+
+# least squares line fit (y = a*x + b) of each row of x, y using the
+# selected (sel) entries, solved as stacked 2x2 normal equations.
+# Returns the (n, 2) coefficients [a, b]
+def fit_lines(x, y, sel):
+    w = sel.astype(np.float64)
+    sx = np.sum(w * x, axis=1)
+    sxx = np.sum(w * x * x, axis=1)
+    sy = np.sum(w * y, axis=1)
+    sxy = np.sum(w * x * y, axis=1)
+    n = np.sum(w, axis=1)
+    A = np.empty((len(x), 2, 2))
+    A[:,0,0] = sxx
+    A[:,0,1] = sx
+    A[:,1,0] = sx
+    A[:,1,1] = n
+    b = np.column_stack((sxy, sy))
+    det = sxx * n - sx * sx
+    ok = det > 1e-9 * np.maximum(sxx * n, 1e-300)
+    coeffs = np.zeros((len(x), 2))
+    coeffs[ok] = np.linalg.solve(A[ok], b[ok][:,:,np.newaxis])[:,:,0]
+    # degenerate neighborhoods (no spread in pixel distance) fall back
+    # to polyfit's own minimum norm solution
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for i in np.nonzero(~ok)[0]:
+            if n[i] > 0:
+                coeffs[i] = np.polyfit(x[i][sel[i]], y[i][sel[i]], 1)
+    return coeffs
+
+# per track surface metric and outlier flags (metric more than stddev
+# standard deviations from the average) of the packed matches_opt
+# tracks
+def surface_outliers(tracks, n_images, stddev):
+    obs_track = tracks.obs_track()
+    n_obs = tracks.num_obs()
+
+    # images with > 0, but < 3 features are skipped
+    image_count = np.bincount(tracks.obs_image, minlength=n_images)
+    center = np.nonzero(image_count[tracks.obs_image] >= 3)[0]
+
+    print('Constructing kd tree...')
+    coords = np.column_stack((tracks.obs_uv,
+                              tracks.obs_image * surface_image_spacing))
+    import scipy.spatial
+    kdtree = scipy.spatial.cKDTree(coords)
+
+    print('Querying neighbors...')
+    k = min(surface_query, n_obs)
+    dist_uv, index = kdtree.query(coords[center], k=k,
+                                  distance_upper_bound=surface_image_spacing * 0.5,
+                                  workers=-1)
+    dist_uv = dist_uv.reshape(len(center), k)
+    index = index.reshape(len(center), k)
+
+    # the neighbors up to (not including) the 11th one with a non-zero
+    # distance (all the duplicate uv's of the feature itself are used.)
+    found = index < n_obs
+    sel = found & (np.cumsum(dist_uv > 0, axis=1) <= surface_fit)
+    index = np.where(found, index, 0)
+    dist_2d = np.where(sel, dist_uv, 0.0)
+    dist_3d = np.linalg.norm(tracks.points[obs_track[center]][:,np.newaxis,:]
+                             - tracks.points[obs_track[index]], axis=2)
+    dist_3d = np.where(sel, dist_3d, 0.0)
+
+    print('Fitting local surfaces...')
+    coeffs = fit_lines(dist_2d, dist_3d, sel)
+    est_d3d = coeffs[:,0,np.newaxis] * dist_2d + coeffs[:,1,np.newaxis]
+    diff = np.abs(est_d3d - dist_3d)
+
+    # the fit error is credited to each neighbor's match
+    neighbor = obs_track[index[sel]]
+    fit_sum = np.bincount(neighbor, weights=diff[sel], minlength=len(tracks))
+    fit_count = np.bincount(neighbor, minlength=len(tracks))
+
+    print('Evaluating surface consistency results...')
+    zero = np.nonzero(fit_count < 1)[0]
+    if len(zero):
+        print("Match indices with a zero count:", len(zero))
+    metric = np.divide(fit_sum, fit_count, out=np.zeros(len(tracks)),
+                       where=fit_count >= 1)
+    average = np.mean(metric)
+    std = np.std(metric)
+    print("average value = %.2f" % (average))
+    print("standard deviation = %.2f" % (std))
+    return np.abs(average - metric) >= stddev * std, metric
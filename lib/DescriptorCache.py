@@ -0,0 +1,121 @@
+# DescriptorCache.py - serve the per image feature descriptors
+# (image.des_file + '.npy') on demand instead of loading them all up
+# front.
+#
+# Loaded descriptor arrays are kept in a least recently used cache
+# limited to a memory budget.  Optionally the files are memory mapped
+# (read only) so the os page cache holds the data instead of the
+# process heap.  Callers that know which images come next (the match
+# scheduler) can prefetch() them, the loads then run on a background
+# thread while the current pair is processed.
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import resource
+import sys
+import threading
+
+class DescriptorCache():
+    def __init__(self, budget_mb=2048, mmap=False):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.mmap = mmap
+        self.store = None       # project DescriptorStore (if it has one)
+        self.entries = collections.OrderedDict() # name -> descriptors
+        self.size = 0           # bytes currently cached
+        self.peak_size = 0
+        self.pending = {}       # name -> prefetch future
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def read(self, image):
+        if self.store is not None and self.store.has(image.name):
+            return self.store.get(image.name)
+        filename = image.des_file + ".npy"
+        if not os.path.exists(filename):
+            print("no file:", filename)
+            return np.array(None)
+        try:
+            if self.mmap:
+                des = np.load(filename, mmap_mode='r')
+            else:
+                des = np.load(filename)
+            if self.store is not None:
+                # (an image not in the store yet)
+                des = self.store.encode(des)
+            return des
+        except:
+            print(filename + ":\n" + "  desc load error: " \
+                + str(sys.exc_info()[1]))
+            return np.array(None)
+
+    # add a loaded array and evict the least recently used ones until
+    # the cache fits the budget (the newest entry is always kept.)  A
+    # prefetch of the image is done at this point, from here on the
+    # cache alone decides how long the array is kept.
+    def insert(self, name, des):
+        with self.lock:
+            self.loads += 1
+            self.pending.pop(name, None)
+            if name in self.entries:
+                return self.entries[name]
+            self.entries[name] = des
+            self.size += des.nbytes
+            self.peak_size = max(self.peak_size, self.size)
+            while self.size > self.budget and len(self.entries) > 1:
+                old_name, old = self.entries.popitem(last=False)
+                self.size -= old.nbytes
+                self.evictions += 1
+            return des
+
+    def load(self, image):
+        return self.insert(image.name, self.read(image))
+
+    # descriptors of an image (loaded if needed.)  A pending prefetch
+    # stays in pending until its load inserts the array, so a prefetch()
+    # in the meantime doesn't submit a second load.
+    def get(self, image):
+        with self.lock:
+            future = self.pending.get(image.name)
+            if image.name in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(image.name)
+                return self.entries[image.name]
+            if future is not None:
+                # prefetched (or still in flight)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if future is not None:
+            return future.result()
+        return self.load(image)
+
+    # hint that these images will be needed soon
+    def prefetch(self, images):
+        with self.lock:
+            for image in images:
+                if image.name in self.entries or image.name in self.pending:
+                    continue
+                self.pending[image.name] = self.executor.submit(self.load, image)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def report(self):
+        # ru_maxrss is in KB on linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        print('Descriptor cache: %d hits, %d misses (hit ratio %.1f%%), %d loads, %d evictions' %
+              (self.hits, self.misses, self.hit_ratio() * 100.0, self.loads,
+               self.evictions))
+        print('  cache peak: %.1f MB (budget %.1f MB%s), process peak rss: %.1f MB' %
+              (self.peak_size / (1024.0 * 1024.0),
+               self.budget / (1024.0 * 1024.0),
+               ', memory mapped' if self.mmap else '', peak_rss))
@@ -0,0 +1,72 @@
+# DescriptorEncoding.py - compact encodings of the float (SIFT/SURF)
+# descriptors.
+#
+#   native:  as computed (float32 for SIFT/SURF, uint8 for ORB)
+#   uint8:   rounded and clipped to 0..255.  OpenCV's SIFT descriptor
+#            values are already whole numbers in that range, so this
+#            is lossless for SIFT and 4x smaller.  SIFT only: SURF
+#            values are small floats (about -1..1) that this would
+#            round to 0/1.
+#   float16: half precision, 2x smaller
+#   pca:     project onto the leading principal components of a sample
+#            of the project's descriptors (e.g. 128 -> 64 dims), stored
+#            as float32.  The model (mean + components) is project wide
+#            so all the images live in the same reduced space.
+#
+# The encodings are for the float descriptors, binary (ORB) ones are
+# always kept as is.  float32 (and pca) descriptors are matched
+# directly, the others are converted to float32 per image pair right
+# before matching (for_matcher().)  The FLANN kd-tree only takes
+# float32, and the brute force matcher does accept uint8 with the L2
+# norm, but measured ~5x slower than converting the pair (opencv 4.x/5.x,
+# 8000 SIFT features) so it gets converted too.
+
+import numpy as np
+
+encodings = [ 'native', 'uint8', 'float16', 'pca' ]
+
+# the (non native) encodings that make sense for each detector's
+# descriptors
+detector_encodings = { 'SIFT': [ 'uint8', 'float16', 'pca' ],
+                       'SURF': [ 'float16', 'pca' ] }
+
+def supported(encoding, detector):
+    return encoding == 'native' or encoding in detector_encodings.get(detector, [])
+
+# fit a pca model to a (n, dim) sample of descriptors, returns
+# (mean, components) with components (dims, dim)
+def fit_pca(sample, dims):
+    sample = np.asarray(sample, dtype=np.float64)
+    mean = np.mean(sample, axis=0)
+    u, s, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return mean, vt[:dims]
+
+# fraction of the sample variance kept by a pca model
+def pca_variance(sample, mean, components):
+    centered = np.asarray(sample, dtype=np.float64) - mean
+    total = np.sum(centered**2)
+    if total == 0:
+        return 1.0
+    return np.sum((centered @ components.T)**2) / total
+
+# encode a (n, dim) descriptor array (a zero dimension / None array for
+# an image without features is passed through)
+def encode(des, encoding, pca=None):
+    if des is None or len(np.shape(des)) != 2 or encoding == 'native':
+        return des
+    if encoding == 'uint8':
+        return np.clip(np.rint(des), 0, 255).astype(np.uint8)
+    elif encoding == 'float16':
+        return np.asarray(des).astype(np.float16)
+    elif encoding == 'pca':
+        mean, components = pca
+        return ((np.asarray(des, dtype=np.float64) - mean) @ components.T).astype(np.float32)
+    else:
+        raise ValueError('unknown descriptor encoding: ' + str(encoding))
+
+# descriptors in a form the matcher takes (a contiguous in memory
+# array), binary is True for hamming distance (ORB) descriptors
+def for_matcher(des, binary=False):
+    if des.dtype == np.float32 or binary:
+        return np.ascontiguousarray(des)
+    return np.ascontiguousarray(des, dtype=np.float32)
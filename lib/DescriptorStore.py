@@ -0,0 +1,168 @@
+# DescriptorStore.py - optional project wide descriptor store.
+#
+# All the image descriptors concatenated into one contiguous row major
+# matrix (descriptors.bin, raw rows of the store dtype) plus an index
+# (descriptors.json) of the [start row, row count] of each image.  The
+# matrix is memory mapped read only, so any number of matcher
+# processes share one copy in the os page cache and loading an image's
+# descriptors is just a slice.
+#
+# The rows can be stored in a compact encoding (see
+# DescriptorEncoding), the encoding is recorded in the index and a pca
+# model is kept next to the store (descriptors-pca.npz.)  Descriptors
+# added later are encoded the same way.
+#
+# Images are appended at the end (detecting features for new images
+# doesn't rewrite the store.)  Appending an image that is already in
+# the store points the index at the new rows, the old rows stay in the
+# file as garbage until the store is rebuilt (convert().)
+
+import json
+import numpy as np
+import os
+
+import DescriptorEncoding
+
+store_file = 'descriptors.bin'
+index_file = 'descriptors.json'
+pca_file = 'descriptors-pca.npz'
+
+def exists(project_dir):
+    return os.path.isfile(os.path.join(project_dir, index_file))
+
+class DescriptorStore():
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.path = os.path.join(project_dir, store_file)
+        self.index_path = os.path.join(project_dir, index_file)
+        self.index = { 'dtype': None, 'dim': 0, 'rows': 0,
+                       'encoding': 'native', 'images': {} }
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index.update(json.load(f))
+        self.matrix = None
+        self.pca = None
+        pca_path = os.path.join(project_dir, pca_file)
+        if self.index['encoding'] == 'pca' and os.path.isfile(pca_path):
+            model = np.load(pca_path)
+            self.pca = (model['mean'], model['components'])
+
+    # encode descriptors (e.g. loaded from a per image file) the way
+    # the store does
+    def encode(self, des):
+        return DescriptorEncoding.encode(des, self.index['encoding'], self.pca)
+
+    def __len__(self):
+        return len(self.index['images'])
+
+    def has(self, name):
+        return name in self.index['images']
+
+    # the memory mapped matrix (mapped on first use and after appends)
+    def get_matrix(self):
+        if self.matrix is None and self.index['rows'] > 0:
+            self.matrix = np.memmap(self.path, mode='r',
+                                    dtype=self.index['dtype'],
+                                    shape=(self.index['rows'],
+                                           self.index['dim']))
+        return self.matrix
+
+    # descriptors of an image (a read only view into the matrix, or a
+    # zero dimension array like an image without features saves)
+    def get(self, name):
+        start, count = self.index['images'][name]
+        if count == 0:
+            return np.array(None)
+        return self.get_matrix()[start:start+count]
+
+    def save_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    # append the descriptors of some images, des_dict: name -> array
+    # (zero dimension / zero rows for an image without features.)  None
+    # means not loaded, those images keep their current rows.
+    def append(self, des_dict, write_index=True):
+        # write after the last indexed row (drops anything left behind
+        # by an append that didn't get to update the index)
+        end = 0
+        if self.index['rows'] > 0:
+            end = self.index['rows'] * self.index['dim'] \
+                * np.dtype(self.index['dtype']).itemsize
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as f:
+            f.seek(end)
+            f.truncate()
+            for name in sorted(des_dict):
+                des = des_dict[name]
+                if des is None:
+                    continue
+                if len(np.shape(des)) != 2 or len(des) == 0:
+                    self.index['images'][name] = [ self.index['rows'], 0 ]
+                    continue
+                des = self.encode(des)
+                if self.index['dtype'] is None:
+                    self.index['dtype'] = np.dtype(des.dtype).name
+                    self.index['dim'] = des.shape[1]
+                if des.shape[1] != self.index['dim']:
+                    raise ValueError('%s: descriptor size %d (store has %d)'
+                                     % (name, des.shape[1], self.index['dim']))
+                rows = np.ascontiguousarray(des, dtype=self.index['dtype'])
+                f.write(rows.tobytes())
+                self.index['images'][name] = [ self.index['rows'], len(rows) ]
+                self.index['rows'] += len(rows)
+        if write_index:
+            self.save_index()
+        self.matrix = None
+
+    # rows no longer referenced by the index
+    def garbage(self):
+        used = sum([ count for [start, count] in self.index['images'].values() ])
+        return self.index['rows'] - used
+
+def load_file(image):
+    filename = image.des_file + '.npy'
+    if os.path.exists(filename):
+        return np.load(filename)
+    print('no file:', filename)
+    return None
+
+# fit a pca model to up to sample_rows descriptors drawn evenly from
+# the images
+def sample_pca(image_list, dims, sample_rows=100000):
+    per_image = max(1, sample_rows // max(1, len(image_list)))
+    sample = []
+    for image in image_list:
+        des = load_file(image)
+        if des is None or len(np.shape(des)) != 2 or len(des) == 0:
+            continue
+        step = max(1, len(des) // per_image)
+        sample.append(np.asarray(des[::step][:per_image], dtype=np.float64))
+    sample = np.concatenate(sample)
+    mean, components = DescriptorEncoding.fit_pca(sample, dims)
+    print('pca: %d -> %d dims, %.1f%% of the sample variance kept' %
+          (sample.shape[1], dims,
+           100.0 * DescriptorEncoding.pca_variance(sample, mean, components)))
+    return mean, components
+
+# (re)build the store of a project from the per image descriptor files
+# (image.des_file + '.npy') in the given encoding, return the store
+def convert(project_dir, image_list, encoding='native', pca_dims=64):
+    for name in [ store_file, index_file, pca_file ]:
+        path = os.path.join(project_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    store = DescriptorStore(project_dir)
+    store.index['encoding'] = encoding
+    if encoding == 'pca':
+        mean, components = sample_pca(image_list, pca_dims)
+        np.savez(os.path.join(project_dir, pca_file), mean=mean,
+                 components=components)
+        store.pca = (mean, components)
+    for image in image_list:
+        # one image at a time keeps the memory use down
+        store.append( { image.name: load_file(image) }, write_index=False )
+    store.save_index()
+    return store
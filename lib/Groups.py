@@ -2,10 +2,14 @@
 # images with the most connections (features matches) to neighbors.
 
 import cv2
+import heapq
 import json
 import numpy as np
 import os
 import sys
+import time
+
+import Tracks
 
 # this builds a simple set structure that records if any image has any
 # connection to any other image
@@ -37,15 +41,59 @@ def updatePlacedFeatures(placed_images, matches, placed_features):
                     count += 1
         placed_features[i] = count
 
+# image -> tracks index (one entry per observation)
+def imageTracks(image_list, matches):
+    image_tracks = [ [] for i in range(len(image_list)) ]
+    for i, match in enumerate(matches):
+        for m in match[1:]:
+            image_tracks[m[0]].append(i)
+    return image_tracks
+
 # This is the current, best grouping function to use
+#
+# Images are added to a group one at a time, always picking the
+# unplaced image with the most observations of 'placed' features (a
+# feature is placed when it is seen by 2 or more placed images.)
+# Rather than rescanning all the matches for every added image, the
+# per image counts are updated incrementally through an image -> track
+# index and the best image is taken from a lazy deletion heap (stale
+# entries are skipped when popped.)
 def groupByFeatureConnections(image_list, matches):
     countFeatureConnections(image_list, matches)
     print("Start of top level grouping algorithm...")
 
-    # start with no placed images or features
+    image_tracks = imageTracks(image_list, matches)
+
+    # start with no placed images or features.  Only features with
+    # more than 2 observations are counted (same as
+    # updatePlacedFeatures())
     placed_images = set()
     groups = []
     placed_features = [0] * len(matches)
+    image_counter = [0] * len(image_list)
+    image_heap = []
+
+    # unplaced seed features, longest first (ties by index)
+    feature_heap = []
+    for i, match in enumerate(matches):
+        if len(match[1:]) > 2:
+            feature_heap.append( (-len(match[1:]), i) )
+    heapq.heapify(feature_heap)
+
+    # account for a newly placed image: update the placed feature
+    # counts and, for features that just became placed, count their
+    # observations in unplaced images.
+    def place_image(index):
+        for i in image_tracks[index]:
+            match = matches[i]
+            if len(match[1:]) <= 2:
+                continue
+            placed_features[i] += 1
+            if placed_features[i] == 2:
+                for m in match[1:]:
+                    if not m[0] in placed_images:
+                        image_counter[m[0]] += 1
+                        heapq.heappush(image_heap, (-image_counter[m[0]], m[0]))
 
     # wipe connection order for all images
     for image in image_list:
@@ -59,45 +107,38 @@ def groupByFeatureConnections(image_list, matches):
         
         # find the unplaced feature with the most connections to other
         # images
-        max_connections = 2
-        max_index = -1
-        for i, match in enumerate(matches):
-            if placed_features[i] == 0 and len(match[1:]) > max_connections:
-                max_connections = len(match[1:])
-                max_index = i
-        if max_index == -1:
+        while len(feature_heap) and placed_features[feature_heap[0][1]] > 0:
+            heapq.heappop(feature_heap)
+        if not len(feature_heap):
             break
+        max_index = feature_heap[0][1]
+        max_connections = len(matches[max_index][1:])
         print('Feature with max connections (%d) = %d' % (max_connections, max_index))
         print('Starting group with:')
         match = matches[max_index]
+        new_images = []
         for m in match[1:]:
             group_images.add(m[0])
-            placed_images.add(m[0])
+            if not m[0] in placed_images:
+                placed_images.add(m[0])
+                new_images.append(m[0])
             print(' ', image_list[m[0]].name)
-        updatePlacedFeatures(placed_images, matches, placed_features)
+        for index in new_images:
+            place_image(index)
         
         while True:
             # find the unplaced image with the most connections into
             # the placed set
-
-            # per image counter
-            image_counter = [0] * len(image_list)
-
-            # count up the placed feature references to unplaced images
-            for i, match in enumerate(matches):
-                # only proceed if this feature has been placed (i.e. it
-                # connects to two or more placed images)
-                if placed_features[i] >= 2:
-                    for m in match[1:]:
-                        if not m[0] in placed_images:
-                            image_counter[m[0]] += 1
-            # print 'connected image count:', image_counter
             new_index = -1
             max_connections = -1
-            for i in range(len(image_counter)):
-                if image_counter[i] > max_connections:
-                    new_index = i
-                    max_connections = image_counter[i]
+            while len(image_heap):
+                count, index = image_heap[0]
+                if index in placed_images or -count != image_counter[index]:
+                    heapq.heappop(image_heap) # stale entry
+                else:
+                    new_index = index
+                    max_connections = -count
+                    break
             if max_connections >= 25:
                 print("New image with max connections:", image_list[new_index].name, "features:", max_connections)
                 placed_images.add(new_index)
@@ -109,7 +150,7 @@ def groupByFeatureConnections(image_list, matches):
                     done = True
                 break
 
-            updatePlacedFeatures(placed_images, matches, placed_features)
+            place_image(new_index)
 
             new_image = image_list[new_index]
             new_image.connection_order = len(placed_images) - 1
@@ -125,24 +166,62 @@ def groupByFeatureConnections(image_list, matches):
 
 
 # for the specified image estimate the image area covered by
-# connections to placed images.
+# connections to placed images (from the cached convex hull of its
+# placed keypoints.)
 def estimateConnectionArea(image):
-    pass
+    if image.placed_hull is None:
+        return 0
+    center, (w, h), angle = cv2.minAreaRect(image.placed_hull)
+    return w*h
 
 
 # another idea ...
+#
+# The connected area of each unplaced image (minAreaRect of its
+# keypoints that belong to placed features) is cached.  When an image
+# is placed only the images that share newly placed features are
+# updated, and each image keeps just the convex hull of its placed
+# keypoints (the minimum area rectangle only depends on the hull.)
 def groupByConnectedArea(image_list, matches):
+    start_time = time.time()
     countFeatureConnections(image_list, matches)
     print("Start of top level grouping algorithm...")
 
+    image_tracks = imageTracks(image_list, matches)
+
     # start with no placed images or features
     placed_images = set()
     groups = []
     placed_features = [False] * len(matches)
 
-    # wipe connection order for all images
+    # wipe connection order and the cached areas for all images
     for image in image_list:
         image.connection_order = -1
+        image.placed_hull = None
+        image.connected_area = 0
+
+    # a feature is placed when one of its images is placed (features
+    # need more than 2 observations, same as updatePlacedFeatures())
+    # and then its keypoints in the unplaced images count toward their
+    # connected area.
+    def place_image(index):
+        new_points = {}
+        for i in image_tracks[index]:
+            match = matches[i]
+            if placed_features[i] or len(match[1:]) <= 2:
+                continue
+            placed_features[i] = True
+            for m in match[1:]:
+                if not m[0] in placed_images:
+                    uv = image_list[m[0]].uv_list[m[1]]
+                    new_points.setdefault(m[0], []).append(uv)
+        for j in new_points:
+            image = image_list[j]
+            points = np.array(new_points[j], dtype=np.float32).reshape(-1, 2)
+            if image.placed_hull is not None:
+                points = np.vstack((image.placed_hull, points))
+            image.placed_hull = cv2.convexHull(points).reshape(-1, 2)
+            image.connected_area = estimateConnectionArea(image)
 
     done = False
     while not done:
@@ -155,7 +234,6 @@ def groupByConnectedArea(image_list, matches):
         max_connections = 0
         max_index = -1
         for i, image in enumerate(image_list):
-            print(image.connection_count)
             if image.connection_order < 0 and image.connection_count > max_connections:
                 max_connections = image.connection_count
                 max_index = i
@@ -164,42 +242,15 @@ def groupByConnectedArea(image_list, matches):
         print("Image with max connections: {} num: {}".format(max_image.name, max_connections))
         placed_images.add(max_index)
         group_images.add(max_index)
-        updatePlacedFeatures(placed_images, matches, placed_features)
+        place_image(max_index)
 
         while True:
             # find the unplaced image with the largest connection area
             # into the placed set
-
-            # per image counter
-            # image_counter = [0] * len(image_list)
-
-            # clear the placed feature lists
-            for i, image in enumerate(image_list):
-                image.placed_feature_list = []
-                    
-            # assemble the placed feature lists for each unplaced image
-            for i, match in enumerate(matches):
-                # only proceed if this feature has been placed (i.e. it
-                # connects to two or more placed images)
-                if placed_features[i]:
-                    for m in match[1:]:
-                        if not m[0] in placed_images:
-                            uv = image_list[m[0]].uv_list[m[1]]
-                            image_list[m[0]].placed_feature_list.append(uv)
-
-            # find the minarearect bounds for each the connected
-            # points in each image
-            for image in image_list:
-                if len(image.placed_feature_list):
-                    center, (w, h), angle = cv2.minAreaRect(np.array(image.placed_feature_list))
-                    print('{} {} {}'.format(w, h, w*h))
-                    image.connected_area = w*h
-            
-            # print 'connected image count:', image_counter
             new_index = -1
             max_area = -1
             for i, image in enumerate(image_list):
-                if len(image.placed_feature_list):
+                if not i in placed_images and image.placed_hull is not None:
                     if image.connected_area > max_area:
                         new_index = i
                         max_area = image.connected_area
@@ -216,7 +267,7 @@ def groupByConnectedArea(image_list, matches):
                     done = True
                 break
 
-            updatePlacedFeatures(placed_images, matches, placed_features)
+            place_image(new_index)
 
             new_image = image_list[new_index]
             new_image.connection_order = len(placed_images) - 1
@@ -228,6 +279,7 @@ def groupByConnectedArea(image_list, matches):
             groups.append( [i] )
             
     print(groups)
+    print('Grouping took %.2f sec' % (time.time() - start_time))
     return groups
 
 # return the number of connections into the placed set
@@ -323,6 +375,44 @@ def groupByImageConnections(image_list):
 
     return group_list
 
+# symmetric (n_images x n_images) scipy.sparse matrix of the number of
+# tracks connecting each pair of images, built from packed tracks (see
+# Tracks.py.)
+def pairCounts(tracks, n_images):
+    obs_a, obs_b = Tracks.obs_pairs(tracks)
+    rows = tracks.obs_image[obs_a]
+    cols = tracks.obs_image[obs_b]
+    keep = rows != cols         # skip selfies
+    rows = rows[keep]
+    cols = cols[keep]
+    import scipy.sparse
+    counts = scipy.sparse.coo_matrix((np.ones(len(rows), dtype=np.int64),
+                                      (rows, cols)),
+                                     shape=(n_images, n_images)).tocsr()
+    return (counts + counts.T).tocsr()
+
+# group images by the connected components of the graph of image pairs
+# with at least min_pairs connecting tracks.  Within each group the
+# images are ordered breadth first from the best connected image (so
+# every image after the first connects to an earlier one.)  Groups are
+# returned largest first, unconnected images are groups of 1.
+def groupByConnectedComponents(pair_counts, min_pairs=25):
+    from scipy.sparse.csgraph import breadth_first_order, connected_components
+    graph = pair_counts.multiply(pair_counts >= min_pairs).tocsr()
+    graph.eliminate_zeros()
+    n_groups, labels = connected_components(graph, directed=False)
+    degree = np.asarray(graph.sum(axis=1)).ravel()
+    groups = []
+    for label in range(n_groups):
+        members = np.nonzero(labels == label)[0]
+        start = members[np.argmax(degree[members])]
+        order = breadth_first_order(graph, start, directed=False,
+                                    return_predecessors=False)
+        groups.append([ int(i) for i in order ])
+    groups.sort(key=len, reverse=True)
+    print('Connected groups:', len(groups), 'sizes:', [ len(g) for g in groups if len(g) > 1 ])
+    return groups
+
 def save(path, groups):
     file = os.path.join(path, 'Groups.json')
     try:
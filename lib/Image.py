@@ -7,20 +7,33 @@ import cv2
 import json
 import math
 #from matplotlib import pyplot as plt
-import navpy
 import numpy as np
 import os.path
 import sys
 
 from props import getNode
 
+import DescriptorEncoding
+import SourceIndex
+import Trace
 import transformations
 
 
 d2r = math.pi / 180.0           # a helpful constant
+
+# bumped whenever a camera pose changes, so cached pose tables (see
+# ProjectMgr.get_poses()) know to rebuild.  Code that edits the pose
+# nodes directly should call poses_changed().
+pose_generation = 0
+
+def poses_changed():
+    global pose_generation
+    pose_generation += 1
     
 class Image():
-    def __init__(self, meta_dir=None, image_base=None):
+    # source_index (optional): SourceIndex of the image source dirs to
+    # find the image file in (otherwise the dirs are searched directly)
+    def __init__(self, meta_dir=None, image_base=None, source_index=None):
         if image_base != None:
             self.name = image_base
             self.node = getNode("/images/" + self.name, True)
@@ -31,6 +44,7 @@ class Image():
         self.kp_list = []       # opencv keypoint list
         self.kp_usage = []
         self.des_list = None      # opencv descriptor list
+        self.desc_cache = None    # serves des_list on demand if set
         self.match_list = []
 
         self.uv_list = []       # the 'undistorted' uv coordinates of all kp's
@@ -70,16 +84,20 @@ class Image():
         self.radius = 0.0
 
         if image_base:
-            dir_node = getNode('/config/directories', True)
-            self.image_file = None
-            for i in range( dir_node.getLen('image_sources') ):
-                dir = os.path.normpath(dir_node.getStringEnum('image_sources', i))
-                tmp1 = os.path.join(dir, image_base + '.JPG')
-                tmp2 = os.path.join(dir, image_base + '.jpg')
-                if os.path.isfile(tmp1):
-                    self.image_file = tmp1
-                elif os.path.isfile(tmp2):
-                    self.image_file = tmp2
+            if source_index is not None:
+                self.image_file = SourceIndex.find_image(source_index,
+                                                         image_base)
+            else:
+                dir_node = getNode('/config/directories', True)
+                self.image_file = None
+                for i in range( dir_node.getLen('image_sources') ):
+                    dir = os.path.normpath(dir_node.getStringEnum('image_sources', i))
+                    tmp1 = os.path.join(dir, image_base + '.JPG')
+                    tmp2 = os.path.join(dir, image_base + '.jpg')
+                    if os.path.isfile(tmp1):
+                        self.image_file = tmp1
+                    elif os.path.isfile(tmp2):
+                        self.image_file = tmp2
             if not self.image_file:
                 print('Warning: no image source file found:', image_base)
                 self.image_file = None
@@ -91,7 +109,8 @@ class Image():
     def load_rgb(self):
         # print("Loading:", self.image_file)
         try:
-            img_rgb = cv2.imread(self.image_file, flags=cv2.IMREAD_ANYCOLOR|cv2.IMREAD_ANYDEPTH|cv2.IMREAD_IGNORE_ORIENTATION)
+            with Trace.span('image load'):
+                img_rgb = cv2.imread(self.image_file, flags=cv2.IMREAD_ANYCOLOR|cv2.IMREAD_ANYDEPTH|cv2.IMREAD_IGNORE_ORIENTATION)
             h, w = img_rgb.shape[:2]
             self.node.setInt('height', h)
             self.node.setInt('width', w)
@@ -119,6 +138,7 @@ class Image():
     def get_size(self):
         return self.node.getInt('width'), self.node.getInt('height')
     
+    @Trace.traced('load features')
     def load_features(self):
         if len(self.kp_list) == 0 and os.path.exists(self.features_file):
             #print "Loading " + self.features_file
@@ -153,6 +173,7 @@ class Image():
                                                       angle, response, octave,
                                                       class_id) )
 
+    @Trace.traced('load descriptors')
     def load_descriptors(self):
         filename = self.des_file + ".npy"
         if self.des_list == None and os.path.exists(filename):
@@ -171,6 +192,16 @@ class Image():
         else:
             print("no file:", filename)
             
+    # descriptors from the project descriptor cache (if there is one)
+    # or loaded into des_list
+    def get_descriptors(self):
+        if self.des_list is None and self.desc_cache is not None:
+            return self.desc_cache.get(self)
+        if self.des_list is None:
+            self.load_descriptors()
+        return self.des_list
+
+    @Trace.traced('load matches')
     def load_matches(self):
         try:
             self.match_list = pickle.load( open( self.match_file, "rb" ) )
@@ -180,6 +211,7 @@ class Image():
                   + str(sys.exc_info()[0]) + ": " + str(sys.exc_info()[1]))
             return
 
+    @Trace.traced('save features')
     def save_features(self):
         # convert from native opencv kp class to a python list
         feature_list = []
@@ -195,6 +227,7 @@ class Image():
         except:
             raise
 
+    @Trace.traced('save descriptors')
     def save_descriptors(self):
         # write descriptors as 'ppm image' format
         try:
@@ -203,6 +236,7 @@ class Image():
             print(self.des_file + ": error saving file: " \
                 + str(sys.exc_info()[1]))
 
+    @Trace.traced('save matches')
     def save_matches(self):
         try:
             pickle.dump(self.match_list, open(self.match_file, "wb"))
@@ -273,10 +307,12 @@ class Image():
         detector_node = getNode('/config/detector', True)
         detector = self.make_detector()
         grid_size = detector_node.getInt('grid_detect')
-        if detector_node.getString('detector') == 'ORB' and grid_size > 1:
-            kp_list = self.orb_grid_detect(detector, scaled, grid_size)
-        else:
-            kp_list = detector.detect(scaled)
+        with Trace.span('detect') as span:
+            if detector_node.getString('detector') == 'ORB' and grid_size > 1:
+                kp_list = self.orb_grid_detect(detector, scaled, grid_size)
+            else:
+                kp_list = detector.detect(scaled)
+            span.add(len(kp_list))
 
         # compute the descriptors for the found features (Note: Star
         # is a special case that uses the brief extractor
@@ -288,7 +324,16 @@ class Image():
             extractor = cv2.DescriptorExtractor_create('ORB')
         else:
             extractor = detector
-        self.kp_list, self.des_list = extractor.compute(scaled, kp_list)
+        with Trace.span('compute descriptors', len(kp_list)):
+            self.kp_list, self.des_list = extractor.compute(scaled, kp_list)
+
+        # optional compact encoding of the float descriptors ('uint8'
+        # or 'float16', pca is applied project wide by the descriptor
+        # store)
+        encoding = detector_node.getString('descriptor_encoding')
+        if encoding in [ 'uint8', 'float16' ] \
+           and DescriptorEncoding.supported(encoding, detector_node.getString('detector')):
+            self.des_list = DescriptorEncoding.encode(self.des_list, encoding)
 
         # scale the keypoint coordinates back to the original image size
         for kp in self.kp_list:
@@ -351,6 +396,7 @@ class Image():
     
     def coverage_lla(self, ref):
         xmin, ymin, xmax, ymax = self.coverage_xy()
+        import navpy
         minlla = navpy.ned2lla([ymin, xmin, 0.0], ref[0], ref[1], ref[2])
         maxlla = navpy.ned2lla([ymax, xmax, 0.0], ref[0], ref[1], ref[2])
         return(minlla[1], minlla[0], maxlla[1], maxlla[0])
@@ -397,6 +443,7 @@ class Image():
         cam_pose_node.setLen('quat', 4)
         for i in range(4):
             cam_pose_node.setFloatEnum('quat', i, quat[i])
+        poses_changed()
         #cam_pose_node.pretty_print('  ')
         
     # set the camera pose using rvec, tvec (rodrigues) which is the
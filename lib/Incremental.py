@@ -0,0 +1,196 @@
+# Incremental.py - extend a previously optimized solution with newly
+# added images instead of re-solving everything from scratch.
+#
+# 1. Existing images keep their optimized (camera_pose_opt) poses, new
+#    images start from their direct georeferenced pose.
+# 2. Tracks that were part of the previous solution keep their
+#    optimized 3d location (found by image name + uv coordinate, so
+#    this works even if image indices or match ordering changed.)
+#    New tracks are triangulated (batched DLT, see Triangulate.py)
+#    from the current camera poses.
+# 3. Only the new cameras plus their local neighbourhood (images that
+#    share tracks with a new image) are optimized.  Previously
+#    optimized points that are not seen by a new image are held fixed
+#    so the neighbourhood stays locked to the existing solution.
+# 4. An optional short global polish over everything.
+
+import json
+import os
+import time
+
+import numpy as np
+
+import Optimizer
+import Tracks
+import Triangulate
+from Submaps import set_optimized_pose
+
+# file (in the project directory) listing the image names in the
+# index order used by matches_opt
+names_file = 'matches_opt_images.json'
+
+def save_image_names(proj):
+    names = [ image.name for image in proj.image_list ]
+    with open(os.path.join(proj.project_dir, names_file), 'w') as fd:
+        json.dump(names, fd)
+
+def load_image_names(proj):
+    path = os.path.join(proj.project_dir, names_file)
+    if os.path.isfile(path):
+        with open(path, 'r') as fd:
+            return json.load(fd)
+    print('Notice: no', names_file, 'assuming image indices are unchanged')
+    return [ image.name for image in proj.image_list ]
+
+def obs_key(name, uv):
+    return "%s-%.2f-%.2f" % (name, uv[0], uv[1])
+
+# index the previous solution: observation key -> optimized ned
+def index_previous(matches_prev, names_prev):
+    lookup = {}
+    for match in matches_prev:
+        for m in match[1:]:
+            lookup[obs_key(names_prev[m[0]], m[1])] = match[0]
+    return lookup
+
+def is_optimized(image):
+    return image.node.getChild('camera_pose_opt', True).getBool('valid')
+
+# Initialize the working match list and camera poses from the previous
+# optimized solution.  Returns (work, new_images, prev_features) where
+# work is a copy of matches with initial 3d locations, new_images is
+# the set of placed images without a previous optimized pose and
+# prev_features is the set of match indices found in the previous
+# solution.
+def initialize(proj, placed_images, matches, matches_prev, names_prev):
+    new_images = set()
+    for i in placed_images:
+        image = proj.image_list[i]
+        if not is_optimized(image):
+            new_images.add(i)
+            ned, ypr, quat = image.get_camera_pose()
+            image.set_camera_pose(ned, ypr[0], ypr[1], ypr[2], opt=True)
+    print('Previously optimized images:', len(placed_images) - len(new_images))
+    print('New images:', len(new_images))
+
+    lookup = index_previous(matches_prev, names_prev)
+    work = []
+    prev_features = set()
+    new_tracks = []
+    for i, match in enumerate(matches):
+        new_match = list(match) # shallow copy
+        for m in match[1:]:
+            key = obs_key(proj.image_list[m[0]].name, m[1])
+            if key in lookup:
+                new_match[0] = list(lookup[key])
+                prev_features.add(i)
+                break
+        if not i in prev_features:
+            new_tracks.append(i)
+        work.append(new_match)
+
+    # triangulate the new tracks from the cameras with a pose
+    tracks = Tracks.pack([ matches[i] for i in new_tracks ])
+    have_pose = np.array([ is_optimized(image) for image in proj.image_list ])
+    tracks = Tracks.compact(tracks, obs_keep=have_pose[tracks.obs_image])
+    P = Triangulate.projection_matrices(proj, opt=True)
+    K = proj.cam.get_K(optimized=True)
+    distCoeffs = proj.cam.get_dist_coeffs(optimized=True)
+    points, valid, angle = Triangulate.triangulate(tracks, P, K, distCoeffs)
+    for k in np.nonzero(valid)[0]:
+        work[new_tracks[k]][0] = points[k].tolist()
+    triangulated = int(np.sum(valid))
+    print('Features from previous solution:', len(prev_features))
+    print('Newly triangulated features:', triangulated)
+    return work, new_images, prev_features
+
+# images that share at least min_shared tracks with a new image
+def neighborhood(matches, new_images, min_shared=1):
+    shared = {}
+    for match in matches:
+        images = [ m[0] for m in match[1:] ]
+        if not any(i in new_images for i in images):
+            continue
+        for i in images:
+            if not i in new_images:
+                shared[i] = shared.get(i, 0) + 1
+    return set([ i for i in shared if shared[i] >= min_shared ])
+
+# Optimize the new images (plus neighbourhood) against the previous
+# solution, then optionally polish globally for polish_nfev function
+# evaluations (all solves use the robust loss and f_scale given.)
+# Returns the same tuple as Optimizer.run() covering all the placed
+# images.  Optimized poses are written to the images.
+def run(proj, placed_images, matches, matches_prev, names_prev,
+        min_shared=1, polish_nfev=0, compare=False, loss='linear',
+        f_scale=1.0):
+    placed_images = list(placed_images)
+    if compare:
+        # full solve from the direct solution for reference (with the
+        # calibration held fixed, as in the incremental solves)
+        print('Running full reference optimization...')
+        opt = Optimizer.Optimizer(proj.project_dir)
+        opt.optimize_calib = 'none'
+        opt.label = 'full'
+        opt.loss = loss
+        opt.f_scale = f_scale
+        opt.setup(proj, placed_images, matches, optimized=False)
+        t0 = time.time()
+        opt.run()
+        full_time = time.time() - t0
+        full_mre = opt.mre_final
+
+    t_start = time.time()
+    work, new_images, prev_features = \
+        initialize(proj, placed_images, matches, matches_prev, names_prev)
+
+    if len(new_images):
+        local = new_images | neighborhood(work, new_images, min_shared)
+        print('Local optimization: new: %d neighbors: %d'
+              % (len(new_images), len(local) - len(new_images)))
+        # previous points not seen by any new image are anchors
+        fixed = set()
+        for i in prev_features:
+            if not any(m[0] in new_images for m in work[i][1:]):
+                fixed.add(i)
+        opt = Optimizer.Optimizer(proj.project_dir)
+        opt.optimize_calib = 'none'
+        opt.label = 'incremental'
+        opt.loss = loss
+        opt.f_scale = f_scale
+        opt.setup(proj, sorted(local), work, optimized=True,
+                  fixed_features=fixed)
+        cameras, features, cam_map, feat_map, fx, fy, cu, cv, dist = opt.run()
+        for i, cam in enumerate(cameras):
+            set_optimized_pose(proj.image_list[cam_map[i]], cam)
+        for i, feat in enumerate(features):
+            work[feat_map[i]][0] = list(feat)
+
+    # global polish (or just assemble the full result)
+    opt = Optimizer.Optimizer(proj.project_dir)
+    opt.label = 'polish'
+    opt.loss = loss
+    opt.f_scale = f_scale
+    opt.optimize_calib = 'none'
+    opt.setup(proj, placed_images, work, optimized=True)
+    if polish_nfev > 0:
+        opt.max_nfev = polish_nfev
+        result = opt.run()
+        mre_final = opt.mre_final
+    else:
+        x0 = np.hstack((opt.camera_params.ravel(), opt.points_3d.ravel()))
+        error = opt.fun(x0, opt.n_cameras, opt.n_points,
+                        opt.by_camera_point_indices, opt.by_camera_points_2d)
+        mre_final = np.mean(np.abs(error))
+        K = opt.K
+        result = ( opt.camera_params.reshape((opt.n_cameras, opt.ncp)),
+                   opt.points_3d.reshape((opt.n_points, 3)),
+                   opt.camera_map_fwd, opt.feat_map_rev,
+                   K[0,0], K[1,1], K[0,2], K[1,2], opt.distCoeffs )
+    inc_time = time.time() - t_start
+    print('Incremental optimization took %.1f sec' % inc_time)
+    print('Incremental final mean reprojection error: %.3f' % mre_final)
+    if compare:
+        print('Full:        mre = %.3f  time = %.1f sec' % (full_mre, full_time))
+        print('Incremental: mre = %.3f  time = %.1f sec' % (mre_final, inc_time))
+    return result
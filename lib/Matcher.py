@@ -8,14 +8,16 @@
 import copy
 import cv2
 import math
-from matplotlib import pyplot as plt
 import numpy as np
 import time
 
 from props import getNode
 
 from find_obj import filter_matches,explore_match
+import DescriptorEncoding
 import ImageList
+import PoseTable
+import Trace
 import transformations
 
 import gms_matcher
@@ -29,6 +31,7 @@ class Matcher():
         self.matcher = None
         self.match_ratio = 0.75
         self.min_pairs = 25
+        self.binary = False
 
     def configure(self):
         detector_str = self.detector_node.getString('detector')
@@ -51,6 +54,7 @@ class Matcher():
         FLANN_INDEX_KDTREE = 1  # bug: flann enums are missing
         FLANN_INDEX_LSH    = 6
         matcher_str = self.matcher_node.getString('matcher')
+        self.binary = (norm == cv2.NORM_HAMMING)
         if matcher_str == 'FLANN':
             if norm == cv2.NORM_L2:
                 flann_params = {
@@ -148,6 +152,7 @@ class Matcher():
     # Notice: this tends to eliminate matches that aren't all on the
     # same plane, so if the scene has a lot of depth, this could knock
     # out a lot of good matches.
+    @Trace.traced('homography filter')
     def filter_by_homography(self, K, i1, i2, j, filter):
         clean = True
         
@@ -267,14 +272,18 @@ class Matcher():
         # keypoints (forward match)
         
         # shape will be a zero length tuple if no features were detected
-        if len(i1.des_list.shape) == 0:
+        des1 = i1.get_descriptors()
+        des2 = i2.get_descriptors()
+        if len(des1.shape) == 0:
             return []
-        if len(i2.des_list.shape) == 0:
+        if len(des2.shape) == 0:
             return []
         
-        matches = self.matcher.knnMatch(np.array(i1.des_list),
-                                        trainDescriptors=np.array(i2.des_list),
-                                        k=2)
+        # (compact encodings are converted for this pair)
+        des1 = DescriptorEncoding.for_matcher(des1, self.binary)
+        des2 = DescriptorEncoding.for_matcher(des2, self.binary)
+        with Trace.span('knnMatch', len(des1)):
+            matches = self.matcher.knnMatch(des1, trainDescriptors=des2, k=2)
         print("  raw matches =", len(matches))
 
         sum = 0.0
@@ -335,8 +344,9 @@ class Matcher():
         size1 = gms_matcher.Size(dim1[0], dim1[1])
         size2 = gms_matcher.Size(dim2[0], dim2[1])
         #gms = gms_matcher.GmsMatcher(i1.kp_list, size1, i2.kp_list, size2, matches_thresh)
-        gms = gms_matcher.GmsMatcher(i1.uv_list, size1, i2.uv_list, size2, matches_thresh)
-        vbInliers, num_inliers = gms.GetInlierMask(with_scale=False, with_rotation=True)
+        with Trace.span('gms', len(matches_thresh)):
+            gms = gms_matcher.GmsMatcher(i1.uv_list, size1, i2.uv_list, size2, matches_thresh)
+            vbInliers, num_inliers = gms.GetInlierMask(with_scale=False, with_rotation=True)
         print('gms inliers:', num_inliers)
 
         idx_pairs = []
@@ -467,8 +477,10 @@ class Matcher():
         # a = raw_input("Press Enter to continue...")
 
 
+    # desc_cache (optional): the project descriptor cache, the images of
+    # the next few pairs in the work list are prefetched through it
     def robustGroupMatches(self, image_list, K, filter="fundamental",
-                           review=False):
+                           review=False, desc_cache=None, prefetch=2):
         max_dist = self.matcher_node.getFloat('max_dist')
         print('max_dist:', max_dist)
         
@@ -483,32 +495,44 @@ class Matcher():
         # physical camera separation, then sort by distance and matche
         # closest first
         work_list = []
+        cam_ned = PoseTable.PoseTable(image_list).ned
         for i, i1 in enumerate(image_list):
             if len(i1.match_list) == 0:
                 i1.match_list = [None] * len(image_list)
 
-            for j, i2 in enumerate(image_list):
-                if j <= i:
-                    continue
-                
-                # camera pose distance check
-                ned1, ypr1, q1 = i1.get_camera_pose()
-                ned2, ypr2, q2 = i2.get_camera_pose()
-                dist = np.linalg.norm(np.array(ned2) - np.array(ned1))
-                if dist <= max_dist:
-                    work_list.append( [dist, i, j] )
+            # camera pose distance check
+            dist = np.linalg.norm(cam_ned[i+1:] - cam_ned[i], axis=1)
+            for j in np.nonzero(dist <= max_dist)[0]:
+                work_list.append( [dist[j], i, i + 1 + j] )
         work_list = sorted(work_list, key=lambda fields: fields[0])
+
+        # skip the pairs already matched (resuming a partial run), so
+        # only the pairs left are prefetched
+        todo = []
+        for line in work_list:
+            i1 = image_list[line[1]]
+            i2 = image_list[line[2]]
+            if i1.match_list[line[2]] != None and i2.match_list[line[1]] != None:
+                print('Skipping: ', i1.name, 'vs', i2.name, 'already done.')
+            else:
+                todo.append(line)
+        work_list = todo
         
         # proces the work list form closest to furthest
         n_count = 0
         save_time = time.time()
         save_interval = 60      # seconds
-        for line in work_list:
+        for k, line in enumerate(work_list):
             dist = line[0]
             i = line[1]
             j = line[2]
             i1 = image_list[i]
             i2 = image_list[j]
+            if desc_cache is not None:
+                upcoming = []
+                for [d, a, b] in work_list[k+1:k+1+prefetch]:
+                    upcoming += [ image_list[a], image_list[b] ]
+                desc_cache.prefetch(upcoming)
                 
             percent = n_count / float(len(work_list))
             t_elapsed = time.time() - t_start
@@ -518,11 +542,6 @@ class Matcher():
                 t_end = t_start
             t_remain = t_end - t_elapsed
             
-            # skip if match has already been computed
-            if i1.match_list[j] != None and i2.match_list[i] != None:
-                print('Skipping: ', i1.name, 'vs', i2.name, 'already done.')
-                continue
-            
             print('Matching %s vs %s - ' % (i1.name, i2.name), end='')
             print('%.1f%% done: ' % (percent * 100.0), end='')
             if t_remain < 3600:
@@ -573,7 +592,10 @@ class Matcher():
         # and save
         self.saveMatches(image_list)
         print('Pair-wise matches successfully saved.')
+        if desc_cache is not None:
+            desc_cache.report()
 
+        from matplotlib import pyplot as plt
         dist_stats = np.array(dist_stats)
         plt.plot(dist_stats[:,0], dist_stats[:,1], 'ro')
         plt.show()
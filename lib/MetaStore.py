@@ -0,0 +1,59 @@
+# MetaStore.py - optional single file store for the per image meta
+# data (the /images/<name> property trees normally kept one json file
+# per image in the project meta directory.)
+#
+# The store is a sqlite database (meta.sqlite in the project directory)
+# with one row per image holding the same json the per image file
+# would contain, so a project converts back and forth losslessly.  A
+# project uses the store when the file exists (see
+# ProjectMgr.load_images_info().)  Rows are replaced individually, so
+# saving a few changed poses only writes those records.
+
+import json
+import os
+import sqlite3
+
+import props_json
+
+store_file = 'meta.sqlite'
+
+def path(project_dir):
+    return os.path.join(project_dir, store_file)
+
+def exists(project_dir):
+    return os.path.isfile(path(project_dir))
+
+# property tree <-> dict (the same dict props_json writes/reads, in
+# memory.)  basepath is where relative 'include' files are found.
+def node_to_dict(node):
+    result = {}
+    props_json.buildDict(result, node)
+    return result
+
+def dict_to_node(meta, node, basepath=''):
+    props_json.parseDict(node, meta, basepath)
+
+# canonical text of a meta dict (used for storage and change detection)
+def encode(meta):
+    return json.dumps(meta, sort_keys=True)
+
+class MetaStore():
+    def __init__(self, project_dir):
+        self.path = path(project_dir)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('create table if not exists images (name text primary key, meta text)')
+        self.db.commit()
+
+    # name -> meta text of all the images
+    def load(self):
+        return dict(self.db.execute('select name, meta from images'))
+
+    # write (insert or replace) the records (name -> meta text) in one
+    # transaction
+    def write(self, records):
+        with self.db:
+            self.db.executemany('insert or replace into images (name, meta) values (?, ?)',
+                                records.items())
+
+    def close(self):
+        self.db.close()
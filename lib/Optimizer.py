@@ -11,12 +11,10 @@ import time
 
 import cv2
 import math
-import matplotlib.pyplot as plt
-from matplotlib import cm
 import numpy as np
-from scipy.optimize import least_squares
-from scipy.sparse import lil_matrix
 
+import SolverLog
+import Trace
 import transformations
 
 # This is a python class that optimizes the estimate camera and 3d
@@ -28,27 +26,38 @@ class Optimizer():
         self.camera_map_rev = {}
         self.feat_map_fwd = {}
         self.feat_map_rev = {}
-        self.last_mre = 1.0e+10 # a big number
-        self.graph = None
-        self.graph_counter = 0
         self.optimize_calib = 'global' # global camera optimization
         #self.optimize_calib = 'none' # no camera calibration optimization
         self.min_chain_length = 3
         self.with_bounds = False
         self.ncp = 6
-
-    # plot range
-    def my_plot_range(self, data, stats=False):
-        if stats:
-            avg = np.mean(data)
-            std = np.std(data)
-            min = math.floor((avg-3*std) / 10) * 10
-            max = math.ceil((avg+3*std) / 10) * 10
+        self.verbose = 2
+        # progress log (json lines, plot offline with
+        # 5f-plot-solver-log.py), records are throttled to one per
+        # log_interval seconds.
+        if root is not None:
+            self.log_file = os.path.join(root, 'optimizer-log.jsonl')
         else:
-            min = math.floor(np.amin(data) / 10) * 10
-            max = math.ceil(np.amax(data) / 10) * 10
-        return min, max
-    
+            self.log_file = None
+        self.log_interval = 1.0
+        self.label = 'optimizer'
+        self.log = None
+        # robust loss (see scipy least_squares: 'linear', 'huber',
+        # 'soft_l1', 'cauchy', 'arctan') and residual scale in pixels
+        self.loss = 'linear'
+        self.f_scale = 1.0
+        # in-memory outlier rejection: number of short solve rounds
+        # followed by observation culling, threshold (number of robust
+        # std deviations above the median error, never below
+        # outlier_min_px), and function evaluation limit per round.
+        self.outlier_rounds = 0
+        self.outlier_sigma = 5.0
+        self.outlier_min_px = 2.0
+        self.round_nfev = 25
+        self.max_nfev = None    # evaluation limit for the final solve
+        self.outliers = []      # [match index, image index, error]
+        self.outlier_log = []   # per round summary
+
     # for lack of a better function name, input rvec, tvec, and return
     # corresponding ypr and ned values
     def rvectvec2yprned(self, rvec, tvec):
@@ -74,6 +83,7 @@ class Optimizer():
         n = n_cameras * self.ncp + n_points * 3
         if self.optimize_calib == 'global':
             n += 8  # three K params (fx == fy) + five distortion params
+        from scipy.sparse import lil_matrix
         A = lil_matrix((m, n), dtype=int)
         print('sparsity matrix is %d x %d' % (m, n))
 
@@ -82,9 +92,14 @@ class Optimizer():
             A[2 * i, camera_indices * self.ncp + s] = 1
             A[2 * i + 1, camera_indices * self.ncp + s] = 1
 
+        # fixed points (index >= n_points) are constants, not
+        # parameters, so they have no columns in the jacobian
+        free = point_indices < n_points
+        i = i[free]
         for s in range(3):
-            A[2 * i, n_cameras * self.ncp + point_indices * 3 + s] = 1
-            A[2 * i + 1, n_cameras * self.ncp + point_indices * 3 + s] = 1
+            A[2 * i, n_cameras * self.ncp + point_indices[free] * 3 + s] = 1
+            A[2 * i + 1, n_cameras * self.ncp + point_indices[free] * 3 + s] = 1
+        i = np.arange(camera_indices.size)
 
         if self.optimize_calib == 'global':
             for s in range(0,3): # K
@@ -100,12 +115,17 @@ class Optimizer():
     # compute an array of residuals (one for each observation)
     # params contains camera parameters, 3-D coordinates, and
     # camera calibration parameters.
+    @Trace.traced('optimizer fun')
     def fun(self, params, n_cameras, n_points, by_camera_point_indices, by_camera_points_2d):
+        t_start = time.time()
         error = None
         # extract the parameters
         camera_params = params[:n_cameras * self.ncp].reshape((n_cameras, self.ncp))
         
         points_3d = params[n_cameras * self.ncp:n_cameras * self.ncp + n_points * 3].reshape((n_points, 3))
+        if self.n_fixed:
+            # fixed points are appended after the free points
+            points_3d = np.vstack((points_3d, self.points_3d_fixed))
         
         if self.optimize_calib == 'global':
             # assemble K and distCoeffs from the optimizer param list
@@ -126,12 +146,9 @@ class Optimizer():
         #distCoeffs = self.distCoeffs
 
         sum = 0
-        cams_3d = np.zeros((n_cameras, 3)) # for plotting
         for i, cam in enumerate(camera_params):
             rvec = cam[:3]
             tvec = cam[3:6]
-            ypr, ned = self.rvectvec2yprned(rvec, tvec)
-            cams_3d[i] = ned
             if len(by_camera_point_indices[i]) == 0:
                 continue
             proj_points, jac = cv2.projectPoints(points_3d[by_camera_point_indices[i]], rvec, tvec, K, distCoeffs)
@@ -141,51 +158,35 @@ class Optimizer():
             else:
                 error = np.append(error, (by_camera_points_2d[i] - proj_points).ravel())
 
-        # provide some runtime feedback for the operator
-        mre = np.mean(np.abs(error))
-        if 1.0 - mre/self.last_mre > 0.001:
-            # mre has improved by more than 0.1%
-            self.last_mre = mre
-            print('mre: %.3f std: %.3f max: %.2f' % (mre, np.std(error), np.amax(np.abs(error))) )
-            print("K:\n", K)
-            print("distCoeffs: %.3f %.3f %.3f %.3f %.3f" %
-                  (distCoeffs[0], distCoeffs[1], distCoeffs[2], distCoeffs[3],
-                   distCoeffs[4]))
-            if not self.graph is None:
-                points = points_3d
-                #points = cams_3d
-                self.graph.set_offsets(points[:,[1,0]])
-                self.graph.set_array(-points[:,2])
-                xmin, xmax = self.my_plot_range(points[:,1])
-                ymin, ymax = self.my_plot_range(points[:,0])
-                plt.xlim(xmin, xmax)
-                plt.ylim(ymin, ymax)
-                cmin, cmax = self.my_plot_range(-points[:,2], stats=True)
-                plt.clim(cmin, cmax)
-                plt.gcf().set_size_inches(16,9,forward=True)
-                plt.draw()
-                # ex: ffmpeg -f image2 -r 2 -s 1280x720 -i optimizer-%03d.png -vcodec libx264 -crf 25  -pix_fmt yuv420p optimizer.mp4
-                plt_name = 'optimizer-%03d.png' % self.graph_counter
-                out_file = os.path.join(self.root, plt_name)
-                plt.savefig(out_file, dpi=80)
-                self.graph_counter += 1
-                plt.pause(0.01)
+        if self.log is not None:
+            self.log.evaluation(error, time.time() - t_start)
         return error
 
     # assemble the structures and remapping indices required for
     # optimizing a group of images/features
-    def setup(self, proj, placed_images, matches_list, optimized=False):
+    #
+    # fixed_features is an optional set of match indices whose 3d
+    # locations are held constant.  They still contribute
+    # observations (and so constrain the cameras that see them) but
+    # are not part of the parameter vector.  A fixed feature only
+    # needs to be seen by one placed image to be useful.
+    def setup(self, proj, placed_images, matches_list, optimized=False,
+              fixed_features=None):
         print('Setting up optimizer data structures...')
+        if fixed_features is None:
+            fixed_features = set()
         if placed_images == None:
             placed_images = set()
             # if no placed images specified, mark them all as placed
             for i in range(len(proj.image_list)):
                 placed_images.add(i)
+        placed_list = list(placed_images)
+        placed_images = set(placed_list) # fast membership tests
                 
         # construct the camera index remapping
         self.camera_map_fwd = {}
         self.camera_map_rev = {}
-        for i, index in enumerate(placed_images):
+        for i, index in enumerate(placed_list):
             self.camera_map_fwd[i] = index
             self.camera_map_rev[index] = i
         #print(self.camera_map_fwd)
@@ -199,40 +200,52 @@ class Optimizer():
         self.distCoeffs = np.array(proj.cam.get_dist_coeffs(optimized))
         
         # assemble the initial camera estimates
-        self.n_cameras = len(placed_images)
+        self.n_cameras = len(placed_list)
         self.camera_params = np.empty(self.n_cameras * self.ncp)
-        for cam_idx, global_index in enumerate(placed_images):
-            image = proj.image_list[global_index]
-            rvec, tvec = image.get_proj(optimized)
-            self.camera_params[cam_idx*self.ncp:cam_idx*self.ncp+self.ncp] = np.append(rvec, tvec)
+        poses = proj.get_poses(optimized)
+        for cam_idx, global_index in enumerate(placed_list):
+            self.camera_params[cam_idx*self.ncp:cam_idx*self.ncp+self.ncp] = np.append(poses.rvec[global_index], poses.tvec[global_index])
 
         # count number of 3d points and observations
         self.n_points = 0
+        self.n_fixed = 0
         n_observations = 0
+        used_list = []
         for i, match in enumerate(matches_list):
             # count the number of referenced observations
             count = 0
             for m in match[1:]:
                 if m[0] in placed_images:
                     count += 1
-            if count >= self.min_chain_length:
+            if i in fixed_features:
+                if count >= 1:
+                    n_observations += count
+                    self.n_fixed += 1
+                    used_list.append(i)
+            elif count >= self.min_chain_length:
                 n_observations += count
                 self.n_points += 1
+                used_list.append(i)
 
-        # assemble 3d point estimates and build indexing maps
+        # assemble 3d point estimates and build indexing maps (free
+        # points first, followed by the fixed points)
         self.points_3d = np.empty(self.n_points * 3)
+        self.points_3d_fixed = np.empty((self.n_fixed, 3))
+        self.fixed_map_rev = {}
         point_idx = 0
         feat_used = 0
-        for i, match in enumerate(matches_list):
-            count = 0
-            for m in match[1:]:
-                if m[0] in placed_images:
-                    count += 1
-            if count >= self.min_chain_length:
+        fixed_used = 0
+        for i in used_list:
+            ned = np.array(matches_list[i][0])
+            if i in fixed_features:
+                self.feat_map_fwd[i] = self.n_points + fixed_used
+                self.fixed_map_rev[fixed_used] = i
+                self.points_3d_fixed[fixed_used] = ned[:3]
+                fixed_used += 1
+            else:
                 self.feat_map_fwd[i] = feat_used
                 self.feat_map_rev[feat_used] = i
                 feat_used += 1
-                ned = np.array(match[0])
                 self.points_3d[point_idx] = ned[0]
                 self.points_3d[point_idx+1] = ned[1]
                 self.points_3d[point_idx+2] = ned[2]
@@ -244,20 +257,16 @@ class Optimizer():
         #print('by_camera:', by_camera)
         #points_2d = np.empty((n_observations, 2))
         #obs_idx = 0
-        for i, match in enumerate(matches_list):
-            count = 0
+        for i in used_list:
+            match = matches_list[i]
             for m in match[1:]:
                 if m[0] in placed_images:
-                    count += 1
-            if count >= self.min_chain_length:
-                for m in match[1:]:
-                    if m[0] in placed_images:
-                        cam_index = self.camera_map_rev[m[0]]
-                        feat_index = self.feat_map_fwd[i]
-                        kp = m[1] # orig/distorted
-                        #kp = proj.image_list[m[0]].uv_list[m[1]] # undistorted
-                        self.by_camera_point_indices[cam_index].append(feat_index)
-                        self.by_camera_points_2d[cam_index].append(kp)
+                    cam_index = self.camera_map_rev[m[0]]
+                    feat_index = self.feat_map_fwd[i]
+                    kp = m[1] # orig/distorted
+                    #kp = proj.image_list[m[0]].uv_list[m[1]] # undistorted
+                    self.by_camera_point_indices[cam_index].append(feat_index)
+                    self.by_camera_points_2d[cam_index].append(kp)
 
         # convert to numpy native structures
         for i in range(self.n_cameras):
@@ -278,10 +287,98 @@ class Optimizer():
                 obs_idx += 1
         print("num observations:", obs_idx)
 
+    # least_squares iteration callback (scipy >= 1.16), reports the
+    # progress once per solver iteration.  (The argument name selects
+    # the OptimizeResult form of the callback.)
+    def iteration(self, intermediate_result):
+        if self.log is not None:
+            self.log.iteration(intermediate_result.x, intermediate_result.fun)
+
+    # drop the observations where keep is False (keep is in the same
+    # order as camera_indices/point_indices) and rebuild the index
+    # structures.  Free points left with fewer than min_chain_length
+    # observations are dropped from the problem as well.  Returns the
+    # (old) indices of the free points that remain so the caller can
+    # carry their current estimates forward.
+    def remove_observations(self, keep):
+        points_2d = np.vstack([ p.reshape(-1, 2) for p in self.by_camera_points_2d ])
+        free = self.point_indices < self.n_points
+        counts = np.bincount(self.point_indices[keep & free],
+                             minlength=self.n_points)
+        point_keep = counts >= self.min_chain_length
+
+        # old point index -> new point index (-1 if dropped), the fixed
+        # points follow the free points
+        n_points = int(np.sum(point_keep))
+        point_map = np.append(np.where(point_keep, np.cumsum(point_keep) - 1, -1),
+                              n_points + np.arange(self.n_fixed))
+        point_indices = point_map[self.point_indices]
+        keep = keep & (point_indices >= 0)
+        camera_indices = self.camera_indices[keep]
+        point_indices = point_indices[keep]
+        points_2d = points_2d[keep]
+
+        kept = np.nonzero(point_keep)[0]
+        feat_map_rev = {}
+        for new_index, old_index in enumerate(kept):
+            feat_map_rev[new_index] = self.feat_map_rev[old_index]
+        self.feat_map_rev = feat_map_rev
+        self.feat_map_fwd = {}
+        for new_index, match_index in self.feat_map_rev.items():
+            self.feat_map_fwd[match_index] = new_index
+        for k, match_index in self.fixed_map_rev.items():
+            self.feat_map_fwd[match_index] = n_points + k
+        self.n_points = n_points
+
+        self.camera_indices = camera_indices
+        self.point_indices = point_indices
+        for i in range(self.n_cameras):
+            sel = camera_indices == i
+            self.by_camera_point_indices[i] = point_indices[sel]
+            self.by_camera_points_2d[i] = points_2d[sel].reshape(-1, 1, 2)
+        return kept
+
+    # cull the observations with a reprojection error above an adaptive
+    # threshold (median plus outlier_sigma robust standard deviations.)
+    # Returns the indices of the kept free points (see
+    # remove_observations) or None if nothing was removed.
+    def reject_outliers(self, residuals):
+        error = np.linalg.norm(residuals.reshape(-1, 2), axis=1)
+        median = np.median(error)
+        mad = np.median(np.abs(error - median)) * 1.4826
+        threshold = max(median + self.outlier_sigma * mad, self.outlier_min_px)
+        bad = error > threshold
+        n_bad = int(np.sum(bad))
+        self.outlier_log.append( { 'mre': float(np.mean(error)),
+                                   'threshold': float(threshold),
+                                   'observations': int(len(error)),
+                                   'removed': n_bad } )
+        print('outlier round: threshold: %.2f removed: %d of %d observations'
+              % (threshold, n_bad, len(error)))
+        if n_bad == 0:
+            return None
+        for obs in np.nonzero(bad)[0]:
+            p = self.point_indices[obs]
+            if p < self.n_points:
+                match_index = self.feat_map_rev[p]
+            else:
+                match_index = self.fixed_map_rev[p - self.n_points]
+            image_index = self.camera_map_fwd[self.camera_indices[obs]]
+            self.outliers.append( [match_index, image_index, float(error[obs])] )
+        return self.remove_observations(~bad)
+
     # assemble the structures and remapping indices required for
     # optimizing a group of images/features, call the optimizer, and
     # save the result.
+    #
+    # With outlier_rounds > 0 the problem is solved in short rounds
+    # (round_nfev evaluations) and the worst observations are culled in
+    # memory between rounds.  Each round is warm started from the
+    # previous solution and the final round runs to convergence.  The
+    # culled observations are left in self.outliers.
     def run(self):
+        import inspect
+        from scipy.optimize import least_squares
         if self.optimize_calib == 'global':
             x0 = np.hstack((self.camera_params.ravel(), self.points_3d.ravel(),
                             self.K[0,0], self.K[0,2], self.K[1,2],
@@ -336,25 +433,65 @@ class Optimizer():
             bounds = [lower, upper]
         else:
             bounds = (-np.inf, np.inf)
-        plt.figure(figsize=(16,9))
-        plt.ion()
-        mypts = self.points_3d.reshape((self.n_points, 3))
-        self.graph = plt.scatter(mypts[:,1], mypts[:,0], 100, -mypts[:,2], cmap=cm.jet)
-        plt.colorbar()
-        plt.draw()
-        plt.pause(0.01)
-        
+        self.log = SolverLog.SolverLog(self.log_file, self.log_interval,
+                                       self.label, verbose=self.verbose > 0)
+        # report progress per iteration where least_squares can call
+        # back, otherwise from the function evaluations
+        options = {}
+        if 'callback' in inspect.signature(least_squares).parameters:
+            options['callback'] = self.iteration
+        else:
+            self.log.by_iteration = False
+        self.log.start(len(x0), len(f0), n_cameras=self.n_cameras,
+                       n_points=self.n_points, loss=self.loss)
+
         t0 = time.time()
-        res = least_squares(self.fun, x0, bounds=bounds,
-                            jac_sparsity=A,
-                            verbose=2,
-                            x_scale='jac',
-                            method='trf',
-                            loss='linear', ftol=1e-3,
-                            args=(self.n_cameras, self.n_points,
-                                  self.by_camera_point_indices,
-                                  self.by_camera_points_2d))
+        self.outliers = []
+        self.outlier_log = []
+        for round in range(self.outlier_rounds + 1):
+            last_round = (round == self.outlier_rounds)
+            res = least_squares(self.fun, x0, bounds=bounds,
+                                jac_sparsity=A,
+                                verbose=self.verbose,
+                                x_scale='jac',
+                                method='trf',
+                                loss=self.loss, f_scale=self.f_scale,
+                                ftol=1e-3,
+                                max_nfev=self.max_nfev if last_round else self.round_nfev,
+                                args=(self.n_cameras, self.n_points,
+                                      self.by_camera_point_indices,
+                                      self.by_camera_points_2d),
+                                **options)
+            if last_round:
+                break
+            n_points = self.n_points
+            kept = self.reject_outliers(res.fun)
+            if kept is None:
+                if res.status > 0:
+                    break       # converged and nothing left to cull
+                x0 = res.x
+                continue
+            # warm start from the current solution (minus the dropped
+            # points) and rebuild the sparsity structure
+            cams = res.x[:self.n_cameras * self.ncp]
+            points = res.x[self.n_cameras * self.ncp:self.n_cameras * self.ncp + n_points * 3].reshape((n_points, 3))
+            calib = res.x[self.n_cameras * self.ncp + n_points * 3:]
+            x0 = np.hstack((cams, points[kept].ravel(), calib))
+            A = self.bundle_adjustment_sparsity(self.n_cameras, self.n_points,
+                                                self.camera_indices,
+                                                self.point_indices)
+            if self.with_bounds:
+                bounds = [ bounds[0][:self.n_cameras * self.ncp] + [-np.inf] * (self.n_points * 3) + bounds[0][len(bounds[0]) - len(calib):],
+                           bounds[1][:self.n_cameras * self.ncp] + [np.inf] * (self.n_points * 3) + bounds[1][len(bounds[1]) - len(calib):] ]
+        if len(self.outliers):
+            print('Outlier rejection removed %d observations in %d rounds'
+                  % (len(self.outliers), len(self.outlier_log)))
         t1 = time.time()
+        self.log.finish(res.fun, status=int(res.status),
+                        message=str(res.message),
+                        optimality=float(res.optimality),
+                        outliers=len(self.outliers))
+        self.log = None
         print("Optimization took {0:.0f} seconds".format(t1 - t0))
         # print(res['x'])
         print(res)
@@ -378,6 +515,8 @@ class Optimizer():
         mre_final = np.mean(np.abs(res.fun))
         iterations = res.njev
         time_sec = t1 - t0
+        self.mre_start = mre_start
+        self.mre_final = mre_final
 
         print("Starting mean reprojection error: %.2f" % mre_start)
         print("Final mean reprojection error: %.2f" % mre_final)
@@ -386,11 +525,6 @@ class Optimizer():
         if self.optimize_calib == 'global':
             print("Final camera calib:\n", camera_calib)
 
-        # final plot
-        # plt.plot(res.fun)
-        plt.ioff()
-        plt.show()
-
         return ( self.camera_params, self.points_3d,
                  self.camera_map_fwd, self.feat_map_rev,
                  fx, fy, cu, cv, distCoeffs_opt )
@@ -5,6 +5,8 @@ import cv2
 import math
 import os.path
 
+import Trace
+
 def make_textures(src_dir, project_dir, image_list, resolution=256):
     dst_dir = project_dir + '/Textures/'
     if not os.path.exists(dst_dir):
@@ -26,27 +28,28 @@ def make_textures_opencv(src_dir, project_dir, image_list, resolution=256):
         dst = os.path.join(dst_dir, image.name + '.JPG')
         print(src, '->', dst)
         if not os.path.exists(dst):
-            src = cv2.imread(src, flags=cv2.IMREAD_ANYCOLOR|cv2.IMREAD_ANYDEPTH|cv2.IMREAD_IGNORE_ORIENTATION)
-            height, width = src.shape[:2]
-            # downscale image first
-            method = cv2.INTER_AREA  # cv2.INTER_AREA
-            scale = cv2.resize(src, (0,0),
-                               fx=resolution/float(width),
-                               fy=resolution/float(height),
-                               interpolation=method)
-            # convert to hsv color space
-            hsv = cv2.cvtColor(scale, cv2.COLOR_BGR2HSV)
-            hue,sat,val = cv2.split(hsv)
-            # adaptive histogram equalization on 'value' channel
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            aeq = clahe.apply(val)
-            # recombine
-            hsv = cv2.merge((hue,sat,aeq))
-            # convert back to rgb
-            result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-            cv2.imwrite(dst, result)
-            print("Texture %dx%d %s" % (resolution, resolution, dst))
-            
+            with Trace.span('render texture'):
+                src = cv2.imread(src, flags=cv2.IMREAD_ANYCOLOR|cv2.IMREAD_ANYDEPTH|cv2.IMREAD_IGNORE_ORIENTATION)
+                height, width = src.shape[:2]
+                # downscale image first
+                method = cv2.INTER_AREA  # cv2.INTER_AREA
+                scale = cv2.resize(src, (0,0),
+                                   fx=resolution/float(width),
+                                   fy=resolution/float(height),
+                                   interpolation=method)
+                # convert to hsv color space
+                hsv = cv2.cvtColor(scale, cv2.COLOR_BGR2HSV)
+                hue,sat,val = cv2.split(hsv)
+                # adaptive histogram equalization on 'value' channel
+                clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+                aeq = clahe.apply(val)
+                # recombine
+                hsv = cv2.merge((hue,sat,aeq))
+                # convert back to rgb
+                result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+                cv2.imwrite(dst, result)
+                print("Texture %dx%d %s" % (resolution, resolution, dst))
+                
 def generate(image_list, group, ref_image=False, src_dir=".", project_dir=".", base_name="quick", version=1.0, trans=0.0, resolution=512 ):
     # make the textures if needed
     make_textures_opencv(src_dir, project_dir, image_list, resolution)
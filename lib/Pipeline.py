@@ -0,0 +1,360 @@
+# Pipeline.py - run the numbered processing scripts as a dependency
+# graph, skipping the stages whose results are still current.
+#
+# Each stage declares its script and options, the project files it
+# reads (inputs) and writes (outputs) as glob patterns relative to the
+# project directory, and the config.json subtrees it depends on (paths
+# like 'camera/K'.)  After a stage runs, pipeline-state.json records a
+# signature of each of these (file names, sizes and modification times,
+# or the file contents with content=True; a hash of the config
+# subtree; a hash of the script itself and the options.)  A stage
+# reruns when any of them differs from the recorded run, when one of
+# its outputs has gone missing, or when a stage it reads from reruns.
+#
+# Several stages rewrite their input files in place (4g culls
+# matches_direct, 5a writes the optimized poses into the image meta
+# files, ...)  So that a later stage rewriting a file does not make
+# the earlier readers of that file look stale, the state also
+# remembers the last signature the pipeline itself left each output
+# in.  If the file still matches that, a reader compares against what
+# the stage that produced its input wrote; only a file changed outside
+# the pipeline (a script run by hand, an edited file) counts as a
+# changed input.
+#
+# Stages run in list order, except that a stage only waits for the
+# earlier stages it shares files with (it reads what they write, or
+# writes what they read or write), so independent stages run
+# concurrently.
+
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+state_file = 'pipeline-state.json'
+stages_file = 'pipeline.json'
+log_dir = 'pipeline-logs'
+
+# the image meta info and descriptor files, in either storage layout
+# (per image files or the single file stores, see MetaStore and
+# DescriptorStore)
+meta_files = [ 'meta/*.json', 'meta.sqlite' ]
+descriptor_files = [ 'meta/*.desc.npy', 'descriptors.bin', 'descriptors.json' ]
+
+# the standard processing chain.  Options the scripts store in the
+# config themselves (/config/detector, /config/matcher) are stage
+# options here: change them in the project pipeline.json.  4g culls
+# only matches_direct, so the grouping is redone after it.
+default_stages = [
+    { 'name': 'detect',
+      'script': '3a-detect-features.py',
+      'args': [ '--scale', '0.25', '--detector', 'SIFT' ],
+      'inputs': [],
+      'outputs': [ 'meta/*.feat' ] + descriptor_files,
+      'config': [ 'camera/K', 'camera/dist_coeffs' ] },
+    { 'name': 'match',
+      'script': '4a-matching.py',
+      'args': [ '--matcher', 'FLANN', '--match-ratio', '0.75' ],
+      'inputs': [ 'meta/*.feat' ] + descriptor_files + meta_files,
+      'outputs': [ 'meta/*.match' ],
+      'config': [ 'camera/K', 'camera/dist_coeffs' ] },
+    { 'name': 'reset',
+      'script': '4b-clean-and-reset-matches.py',
+      'args': [],
+      'inputs': [ 'meta/*.feat', 'meta/*.match' ] + meta_files,
+      'outputs': [ 'matches_direct' ],
+      'config': [ 'camera/K', 'camera/dist_coeffs' ] },
+    { 'name': 'group',
+      'script': '4d-match-grouping.py',
+      'args': [],
+      'inputs': [ 'matches_direct', 'meta/*.feat' ] + meta_files,
+      'outputs': [ 'matches_grouped' ],
+      'config': [] },
+    { 'name': 'groups',
+      'script': '4e-image-groups.py',
+      'args': [],
+      'inputs': [ 'matches_grouped', 'matches_direct' ] + meta_files,
+      'outputs': [ 'Groups.json', 'connections.gnuplot' ],
+      'config': [] },
+    { 'name': 'cull',
+      'script': '4g-match-culling.py',
+      'args': [ '--yes' ],
+      'inputs': [ 'matches_direct', 'Groups.json' ] + meta_files,
+      'outputs': [ 'matches_direct' ],
+      'config': [] },
+    { 'name': 'regroup',
+      'script': '4d-match-grouping.py',
+      'args': [],
+      'inputs': [ 'matches_direct', 'meta/*.feat' ] + meta_files,
+      'outputs': [ 'matches_grouped' ],
+      'config': [] },
+    { 'name': 'optimize',
+      'script': '5a-optimize.py',
+      'args': [],
+      'inputs': [ 'matches_grouped', 'Groups.json' ] + meta_files,
+      'outputs': [ 'matches_opt' ] + meta_files,
+      'config': [ 'camera/K', 'camera/dist_coeffs' ] },
+    { 'name': 'mre-by-feature',
+      'script': '5c-mre-by-feature3.py',
+      'args': [ '--yes' ],
+      'inputs': [ 'matches_grouped', 'matches_opt', 'Groups.json' ] + meta_files,
+      'outputs': [ 'matches_grouped', 'matches_opt' ],
+      'config': [] },
+    { 'name': 'mre-by-image',
+      'script': '5c-mre-by-image.py',
+      'args': [],
+      'inputs': [ 'matches_opt', 'Groups.json' ] + meta_files,
+      'outputs': [],
+      'config': [] },
+]
+
+# the project stage list: pipeline.json in the project directory if
+# present, otherwise the default chain.
+def load_stages(project_dir):
+    path = os.path.join(project_dir, stages_file)
+    if not os.path.isfile(path):
+        return default_stages
+    with open(path, 'r') as fd:
+        stages = json.load(fd)
+    names = set()
+    for stage in stages:
+        if 'name' not in stage or 'script' not in stage:
+            raise ValueError(path + ': each stage needs a name and a script')
+        if stage['name'] in names:
+            raise ValueError(path + ': duplicate stage name: ' + stage['name'])
+        names.add(stage['name'])
+        for key in [ 'args', 'inputs', 'outputs', 'config' ]:
+            stage.setdefault(key, [])
+    return stages
+
+def load_state(project_dir):
+    path = os.path.join(project_dir, state_file)
+    state = { 'stages': {}, 'files': {} }
+    if os.path.isfile(path):
+        with open(path, 'r') as fd:
+            state.update(json.load(fd))
+    return state
+
+def save_state(project_dir, state):
+    path = os.path.join(project_dir, state_file)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fd:
+        json.dump(state, fd, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        for block in iter(lambda: fd.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# signature of the files matching a pattern, None if there are none
+def fingerprint(project_dir, pattern, content=False):
+    files = sorted(glob.glob(os.path.join(project_dir, pattern)))
+    files = [ f for f in files if os.path.isfile(f) ]
+    if not len(files):
+        return None
+    h = hashlib.sha1()
+    for f in files:
+        h.update(os.path.relpath(f, project_dir).encode())
+        if content:
+            h.update(hash_file(f).encode())
+        else:
+            st = os.stat(f)
+            h.update(('%d %d' % (st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+def load_config(project_dir):
+    path = os.path.join(project_dir, 'config.json')
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as fd:
+        return json.load(fd)
+
+def config_hash(config, path):
+    node = config
+    for key in path.strip('/').split('/'):
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return hashlib.sha1(json.dumps(node, sort_keys=True).encode()).hexdigest()
+
+def script_path(scripts_dir, stage):
+    return os.path.join(scripts_dir, stage['script'])
+
+def overlaps(patterns1, patterns2):
+    for p1 in patterns1:
+        for p2 in patterns2:
+            if p1 == p2 or fnmatch.fnmatch(p1, p2) or fnmatch.fnmatch(p2, p1):
+                return True
+    return False
+
+# the earlier stages each stage must wait for: it reads what they
+# write, or writes what they read or write.
+def dependencies(stages):
+    deps = {}
+    for i, stage in enumerate(stages):
+        deps[stage['name']] = []
+        for prev in stages[:i]:
+            if overlaps(prev['outputs'], stage['inputs']) \
+               or overlaps(prev['outputs'], stage['outputs']) \
+               or overlaps(prev['inputs'], stage['outputs']):
+                deps[stage['name']].append(prev['name'])
+    return deps
+
+# the signature a stage sees for one of its input patterns (see the
+# top of the file.)
+def input_signature(project_dir, stages, state, index, pattern,
+                    content=False):
+    current = fingerprint(project_dir, pattern, content)
+    if current != state['files'].get(pattern):
+        # changed outside the pipeline (or never written by it)
+        return current
+    for prev in reversed(stages[:index]):
+        if pattern in prev['outputs']:
+            record = state['stages'].get(prev['name'])
+            if record:
+                return record['outputs'].get(pattern)
+            return current
+    record = state['stages'].get(stages[index]['name'])
+    if record and pattern in record['inputs']:
+        return record['inputs'][pattern]
+    return current
+
+# decide which stages need to run.  Returns a list of [stage, reasons]
+# in stage order, an empty reason list means the stage is current.
+# Stages not in selected (if given) are not run, so they do not make
+# the stages after them rerun.
+def plan(project_dir, scripts_dir, stages, state, force=[], selected=None,
+         content=False):
+    config = load_config(project_dir)
+    deps = dependencies(stages)
+    rerun = set()
+    result = []
+    for i, stage in enumerate(stages):
+        name = stage['name']
+        record = state['stages'].get(name)
+        reasons = []
+        if name in force:
+            reasons.append('forced')
+        if record is None:
+            reasons.append('never run')
+        else:
+            if hash_file(script_path(scripts_dir, stage)) != record['script']:
+                reasons.append('script %s changed' % stage['script'])
+            if stage['args'] != record['args']:
+                reasons.append('options changed: %s -> %s'
+                               % (' '.join(record['args']),
+                                  ' '.join(stage['args'])))
+            for path in stage['config']:
+                if config_hash(config, path) != record['config'].get(path):
+                    reasons.append('config %s changed' % path)
+            for pattern in stage['inputs']:
+                sig = input_signature(project_dir, stages, state, i,
+                                      pattern, content)
+                if sig != record['inputs'].get(pattern):
+                    reasons.append('input %s changed' % pattern)
+            # (only the outputs the last run left behind, a stage
+            # writes one of the alternative storage layouts)
+            for pattern in stage['outputs']:
+                if fingerprint(project_dir, pattern) is None \
+                   and record['outputs'].get(pattern) is not None:
+                    reasons.append('output %s missing' % pattern)
+        for prev in stages[:i]:
+            if prev['name'] in rerun and prev['name'] in deps[name] \
+               and overlaps(prev['outputs'], stage['inputs']):
+                reasons.append('upstream stage %s reruns' % prev['name'])
+        if len(reasons) and (selected is None or name in selected):
+            rerun.add(name)
+        result.append( [stage, reasons] )
+    return result
+
+# run one stage script (unattended: no input, plots are not shown),
+# returns the exit status, run time and log file
+def run_stage(project_dir, scripts_dir, stage):
+    os.makedirs(os.path.join(project_dir, log_dir), exist_ok=True)
+    log = os.path.join(project_dir, log_dir, stage['name'] + '.log')
+    cmd = [ sys.executable, stage['script'], '--project',
+            os.path.abspath(project_dir) ] + stage['args']
+    env = dict(os.environ)
+    env['MPLBACKEND'] = 'Agg'
+    t_start = time.time()
+    with open(log, 'w') as fd:
+        result = subprocess.call(cmd, cwd=scripts_dir, stdout=fd,
+                                 stderr=subprocess.STDOUT,
+                                 stdin=subprocess.DEVNULL, env=env)
+    return result, time.time() - t_start, log
+
+# record a successful run (input signatures as seen when the stage was
+# started, the rest as left after it finished.)
+def record_stage(project_dir, scripts_dir, stages, state, stage, inputs,
+                 content=False):
+    config = load_config(project_dir)
+    record = { 'script': hash_file(script_path(scripts_dir, stage)),
+               'args': list(stage['args']),
+               'config': {},
+               'inputs': inputs,
+               'outputs': {},
+               'time': time.strftime('%Y-%m-%d %H:%M:%S') }
+    for path in stage['config']:
+        record['config'][path] = config_hash(config, path)
+    for pattern in stage['outputs']:
+        sig = fingerprint(project_dir, pattern, content)
+        record['outputs'][pattern] = sig
+        state['files'][pattern] = sig
+    state['stages'][stage['name']] = record
+
+# run the planned stages, up to jobs at a time.  Returns the names of
+# the stages that failed (their dependents are not started.)
+def run(project_dir, scripts_dir, stages, state, steps, jobs=1,
+        content=False):
+    deps = dependencies(stages)
+    index = { stage['name']: i for i, stage in enumerate(stages) }
+    todo = [ stage for [stage, reasons] in steps if len(reasons) ]
+    pending = set([ stage['name'] for stage in todo ])
+    failed = []
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    while len(todo) or len(running):
+        for stage in list(todo):
+            blocked = [ d for d in deps[stage['name']] if d in pending ]
+            if len([ d for d in blocked if d in failed ]):
+                print('skip %s: depends on a failed stage' % stage['name'])
+                todo.remove(stage)
+                failed.append(stage['name'])
+                continue
+            if len(blocked) or len(running) >= jobs:
+                continue
+            inputs = {}
+            for pattern in stage['inputs']:
+                inputs[pattern] = input_signature(project_dir, stages, state,
+                                                  index[stage['name']],
+                                                  pattern, content)
+            print('start %s: %s %s' % (stage['name'], stage['script'],
+                                       ' '.join(stage['args'])))
+            future = executor.submit(run_stage, project_dir, scripts_dir, stage)
+            running[future] = (stage, inputs)
+            todo.remove(stage)
+        if not len(running):
+            continue
+        done, not_done = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            (stage, inputs) = running.pop(future)
+            result, secs, log = future.result()
+            if result == 0:
+                print('done %s (%.1f sec)' % (stage['name'], secs))
+                record_stage(project_dir, scripts_dir, stages, state, stage,
+                             inputs, content)
+                save_state(project_dir, state)
+                pending.remove(stage['name'])
+            else:
+                print('FAILED %s (exit %d, see %s)' % (stage['name'], result, log))
+                failed.append(stage['name'])
+    executor.shutdown()
+    return failed
@@ -7,11 +7,11 @@ import math
 import os
 import re
 
-import navpy
 from props import getNode
 
 import transformations
 import Image
+import SourceIndex
 
 # a helpful constant
 d2r = math.pi / 180.0
@@ -34,6 +34,7 @@ r2d = 180.0 / math.pi
 def setAircraftPoses(proj, posefile="", order='ypr'):
     meta_dir = os.path.join(proj.project_dir, 'meta')
     proj.image_list = []
+    source_index = proj.get_source_index()
     
     f = fileinput.input(posefile)
     for line in f:
@@ -58,13 +59,8 @@ def setAircraftPoses(proj, posefile="", order='ypr'):
             pitch_deg = float(field[5])
             yaw_deg = float(field[6])
 
-        found_dir = ''
-        for i in range( proj.dir_node.getLen('image_sources') ):
-            dir = proj.dir_node.getStringEnum('image_sources', i)
-            if os.path.isfile( os.path.join(dir, name) ):
-                found_dir = dir
-        if not len(found_dir):
-            print('No image file:', image_file, 'skipping ...')
+        if not SourceIndex.find_file(source_index, name):
+            print('No image file:', name, 'skipping ...')
             continue
         if abs(roll_deg) > 30.0:
             # rolled into a turn, skip
@@ -72,7 +68,7 @@ def setAircraftPoses(proj, posefile="", order='ypr'):
             continue
 
         base, ext = os.path.splitext(name)
-        image = Image.Image(meta_dir, base)
+        image = Image.Image(meta_dir, base, source_index)
         image.set_aircraft_pose(lat_deg, lon_deg, alt_m,
                                 yaw_deg, pitch_deg, roll_deg)
         print(name, 'yaw=%.1f pitch=%.1f roll=%.1f' % (yaw_deg, pitch_deg, roll_deg))
@@ -81,6 +77,7 @@ def setAircraftPoses(proj, posefile="", order='ypr'):
 # for each image, compute the estimated camera pose in NED space from
 # the aircraft body pose and the relative camera orientation
 def compute_camera_poses(proj):
+    import navpy
     mount_node = getNode('/config/camera/mount', True)
     ref_node = getNode('/config/ned_reference', True)
     images_node = getNode('/images', True)
@@ -0,0 +1,55 @@
+# PoseTable.py - the camera poses of all the images as contiguous
+# arrays (structure of arrays), for loops that would otherwise read the
+# property tree (image.get_camera_pose() / get_body2ned() / get_proj())
+# once per match.
+#
+#   ned:      (n, 3) camera position
+#   ypr:      (n, 3) yaw, pitch, roll (deg)
+#   quat:     (n, 4) body2ned quaternion
+#   body2ned: (n, 3, 3) rotation (image.get_body2ned())
+#   R:        (n, 3, 3) ned -> camera rotation, body2cam * ned2body
+#   rvec:     (n, 3) R as a rodrigues vector (image.get_proj())
+#   tvec:     (n, 3) -R * ned (image.get_proj())
+#   P:        (n, 3, 4) projection matrix [R|t] (without K)
+#   valid:    (n) bool, optimized pose is valid (always True for the
+#             direct poses)
+#
+# ProjectMgr.get_poses() keeps one table per pose set and rebuilds it
+# after any image.set_camera_pose() call (see Image.pose_generation.)
+
+import cv2
+import numpy as np
+
+import transformations
+
+class PoseTable():
+    def __init__(self, image_list, opt=False):
+        n = len(image_list)
+        self.opt = opt
+        self.ned = np.zeros((n, 3))
+        self.ypr = np.zeros((n, 3))
+        self.quat = np.zeros((n, 4))
+        self.body2ned = np.zeros((n, 3, 3))
+        self.valid = np.ones(n, dtype=bool)
+        for i, image in enumerate(image_list):
+            ned, ypr, quat = image.get_camera_pose(opt)
+            self.ned[i] = ned
+            self.ypr[i] = ypr
+            self.quat[i] = quat
+            self.body2ned[i] = transformations.quaternion_matrix(np.array(quat))[:3,:3]
+            if opt:
+                self.valid[i] = image.node.getChild('camera_pose_opt', True).getBool('valid')
+        if n:
+            body2cam = image_list[0].get_body2cam()
+        else:
+            body2cam = np.eye(3)
+        self.R = np.matmul(body2cam, np.transpose(self.body2ned, (0, 2, 1)))
+        self.tvec = -np.einsum('nij,nj->ni', self.R, self.ned)
+        self.rvec = np.zeros((n, 3))
+        for i in range(n):
+            rvec, jac = cv2.Rodrigues(self.R[i])
+            self.rvec[i] = rvec.ravel()
+        self.P = np.concatenate((self.R, self.tvec[:,:,np.newaxis]), axis=2)
+
+    def __len__(self):
+        return len(self.ned)
@@ -6,11 +6,9 @@ import fnmatch
 import fractions
 import json
 import math
-from matplotlib import pyplot as plt
 import numpy as np
 import os.path
 from progress.bar import Bar
-import scipy.interpolate
 import subprocess
 import sys
 import time
@@ -22,11 +20,17 @@ import props_json
 
 from getchar import find_getch
 import Camera
+import DescriptorCache
+import DescriptorStore
 import Image
 
 import ImageList
 import Matcher
+import MetaStore
+import PoseTable
+import SourceIndex
 import Render
+import Trace
 import transformations
 
 
@@ -35,6 +39,14 @@ class ProjectMgr():
         self.project_dir = project_dir
         self.cam = Camera.Camera()
         self.image_list = []
+        self.name_index = {}    # image name -> image_list index
+        self.path_index = {}    # image source file -> image_list index
+        self.index_key = None
+        self.pose_tables = {}   # opt -> [key, PoseTable]
+        self.source_index = None
+        self.source_dirs = None
+        self.meta_saved = {}    # image name -> meta text as last loaded/saved
+        self.desc_cache = None
         self.matcher_params = { 'matcher': 'FLANN', # { FLANN or 'BF' }
                                 'match-ratio': 0.75,
                                 'filter': 'fundamental',
@@ -85,6 +97,23 @@ class ProjectMgr():
             if not os.path.exists(dir):
                 print("Error: image source path does not exist:", dir)
             self.dir_node.setStringEnum('image_sources', i, dir)
+        self.source_index = None
+
+    # the image source directories from the config
+    def get_image_sources(self):
+        dirs = []
+        for i in range( self.dir_node.getLen('image_sources') ):
+            dirs.append( self.dir_node.getStringEnum('image_sources', i) )
+        return dirs
+
+    # file name index of the image source directories (see SourceIndex),
+    # listed once and reused until the source directories change
+    def get_source_index(self):
+        dirs = self.get_image_sources()
+        if self.source_index is None or dirs != self.source_dirs:
+            self.source_index = SourceIndex.build(dirs)
+            self.source_dirs = dirs
+        return self.source_index
 
     def save(self):
         # create a project dictionary and write it out as json
@@ -124,41 +153,67 @@ class ProjectMgr():
 
         #root.pretty_print()
 
+    @Trace.traced('load images info')
     def load_images_info(self):
-        # load image meta info
+        # load image meta info (from the single file store if the
+        # project has one, otherwise one json file per image)
         result = False
         meta_dir = os.path.join(self.project_dir, 'meta')
         images_node = getNode("/images", True)
 
-        for file in os.listdir(meta_dir):
-            if fnmatch.fnmatch(file, '*.json'):
-                name, ext = os.path.splitext(file)
+        self.meta_saved = {}
+        if MetaStore.exists(self.project_dir):
+            store = MetaStore.MetaStore(self.project_dir)
+            for name, text in store.load().items():
                 image_node = images_node.getChild(name, True)
-                props_json.load(os.path.join(meta_dir, file), image_node)
+                MetaStore.dict_to_node(json.loads(text), image_node)
+                self.meta_saved[name] = text
+            store.close()
+        else:
+            for file in os.listdir(meta_dir):
+                if fnmatch.fnmatch(file, '*.json'):
+                    name, ext = os.path.splitext(file)
+                    image_node = images_node.getChild(name, True)
+                    # (parsed here so the text for the change
+                    # detection comes from the same read)
+                    with open(os.path.join(meta_dir, file), 'r') as f:
+                        meta = json.load(f)
+                    MetaStore.dict_to_node(meta, image_node, meta_dir)
+                    self.meta_saved[name] = MetaStore.encode(meta)
         # images_node.pretty_print()
                 
         # wipe image list (so we don't double load)
         self.image_list = []
+        source_index = self.get_source_index()
         for name in images_node.getChildren():
-            image = Image.Image(meta_dir, name)
+            image = Image.Image(meta_dir, name, source_index)
             self.image_list.append( image )
+        self.index_images()
+        Image.poses_changed()
 
         # make sure our matcher gets a copy of the image list
         self.render.setImageList(self.image_list)
 
-    def load_features(self, descriptors=False):
+    # load the keypoints.  With descriptors the descriptors are not
+    # loaded here but served on demand (image.get_descriptors()) by a
+    # shared LRU cache limited to desc_cache_mb, optionally memory mapped
+    # (and read from the project descriptor store if there is one.)
+    def load_features(self, descriptors=False, desc_cache_mb=2048,
+                      desc_mmap=False):
         if descriptors:
-            msg = 'Loading keypoints and descriptors:'
-        else:
-            msg = 'Loading keypoints:'
-        bar = Bar(msg, max = len(self.image_list))
+            self.desc_cache = DescriptorCache.DescriptorCache(desc_cache_mb,
+                                                              desc_mmap)
+            if DescriptorStore.exists(self.project_dir):
+                self.desc_cache.store = DescriptorStore.DescriptorStore(self.project_dir)
+        bar = Bar('Loading keypoints:', max = len(self.image_list))
         for image in self.image_list:
             image.load_features()
             if descriptors:
-                image.load_descriptors()
+                image.desc_cache = self.desc_cache
             bar.next()
         bar.finish()
 
+    @Trace.traced('load match pairs')
     def load_match_pairs(self, extra_verbose=True):
         if extra_verbose:
             print("")
@@ -203,7 +258,10 @@ class ProjectMgr():
         #        print 'b:', result[i][j]
         return result
                 
-    def save_images_info(self):
+    # write the image meta info, only the images that changed since they
+    # were loaded or last saved (all of them if force)
+    @Trace.traced('save images info')
+    def save_images_info(self, force=False):
         # create a project dictionary and write it out as json
         if not os.path.exists(self.project_dir):
             print("Error: project doesn't exist:", self.project_dir)
@@ -211,17 +269,53 @@ class ProjectMgr():
 
         meta_dir = os.path.join(self.project_dir, 'meta')
         images_node = getNode("/images", True)
+        changed = {}
         for name in images_node.getChildren():
             image_node = images_node.getChild(name, True)
+            text = MetaStore.encode(MetaStore.node_to_dict(image_node))
+            if force or self.meta_saved.get(name) != text:
+                changed[name] = text
+        if MetaStore.exists(self.project_dir):
+            store = MetaStore.MetaStore(self.project_dir)
+            store.write(changed)
+            store.close()
+        else:
+            for name in changed:
+                image_path = os.path.join(meta_dir, name + '.json')
+                props_json.save(image_path, images_node.getChild(name, True))
+        self.meta_saved.update(changed)
+        return len(changed)
+
+    # convert the image meta info between one json file per image and
+    # the single file store (the images must be loaded.)  The json
+    # files are left in place (but stop being used) when converting to
+    # the store, the store is removed when converting back.
+    def export_images_store(self):
+        if MetaStore.exists(self.project_dir):
+            os.remove(MetaStore.path(self.project_dir))
+        store = MetaStore.MetaStore(self.project_dir)
+        store.close()
+        self.save_images_info(force=True)
+
+    def export_images_json(self):
+        meta_dir = os.path.join(self.project_dir, 'meta')
+        images_node = getNode("/images", True)
+        for name in images_node.getChildren():
             image_path = os.path.join(meta_dir, name + '.json')
-            props_json.save(image_path, image_node)
-            
+            props_json.save(image_path, images_node.getChild(name, True))
+        if MetaStore.exists(self.project_dir):
+            os.remove(MetaStore.path(self.project_dir))
+
     def set_matcher_params(self, mparams):
         self.matcher_params = mparams
         
-    def detect_features(self, scale, show=False):
+    # detect features in the images (until a 'q' with show), returns
+    # the images processed.  With update_store=False the caller updates
+    # the descriptor store itself (after filtering the features.)
+    def detect_features(self, scale, show=False, update_store=True):
         if not show:
             bar = Bar('Detecting features:', max = len(self.image_list))
+        processed = []
         for image in self.image_list:
             #print "detecting features and computing descriptors: " + image.name
             rgb = image.load_rgb()
@@ -229,6 +323,7 @@ class ProjectMgr():
             image.save_features()
             image.save_descriptors()
             image.save_matches()
+            processed.append(image)
             if show:
                 result = image.show_features()
                 if result == 27 or result == ord('q'):
@@ -237,8 +332,28 @@ class ProjectMgr():
                 bar.next()
         if not show:
             bar.finish()
+        if update_store:
+            self.update_descriptor_store(processed)
 
         self.save_images_info()
+        return processed
+
+    # append the freshly computed (in memory) descriptors of these
+    # images to the project descriptor store, if the project has one.
+    # Each append leaves the image's previous rows behind as garbage,
+    # so pass only the images whose descriptors changed.
+    def update_descriptor_store(self, images):
+        if not DescriptorStore.exists(self.project_dir):
+            return
+        store = DescriptorStore.DescriptorStore(self.project_dir)
+        des_dict = {}
+        for image in images:
+            if image.des_list is None:
+                # no features found (saved the same way)
+                des_dict[image.name] = np.array(None)
+            else:
+                des_dict[image.name] = image.des_list
+        store.append(des_dict)
 
     def show_features_image(self, image):
         result = image.show_features()
@@ -250,17 +365,66 @@ class ProjectMgr():
             if result == 27 or result == ord('q'):
                 break
                 
-    def findImageByName(self, name):
-        for i in self.image_list:
-            if i.name == name:
+    # (re)build the name and source file lookup tables of image_list.
+    # Lookups rebuild them automatically when image_list is replaced or
+    # changes length, and check each hit against the list (a stale hit,
+    # e.g. after an in place reorder, falls back to a scan.)  A name or
+    # path missing from a current table is not found (no scan), so call
+    # this after replacing an element of image_list in place.
+    def index_images(self):
+        self.name_index = {}
+        self.path_index = {}
+        # (reversed so the first of any duplicates wins, like a scan)
+        for i in reversed(range(len(self.image_list))):
+            image = self.image_list[i]
+            self.name_index[image.name] = i
+            if getattr(image, 'image_file', None):
+                self.path_index[os.path.normpath(image.image_file)] = i
+        self.index_key = (id(self.image_list), len(self.image_list))
+
+    def lookup_index(self, table, key, matches):
+        if self.index_key != (id(self.image_list), len(self.image_list)):
+            self.index_images()
+        i = getattr(self, table).get(key)
+        if i is None:
+            return None
+        if matches(self.image_list[i]):
+            return i
+        for i, image in enumerate(self.image_list):
+            if matches(image):
+                self.index_images()
                 return i
         return None
-    
+
     def findIndexByName(self, name):
-        for i, img in enumerate(self.image_list):
-            if img.name == name:
-                return i
-        return None
+        return self.lookup_index('name_index', name,
+                                 lambda image: image.name == name)
+
+    # camera poses of image_list as arrays (see PoseTable), cached until
+    # a pose changes or image_list is replaced / changes length
+    def get_poses(self, opt=False):
+        key = (Image.pose_generation, id(self.image_list), len(self.image_list))
+        if not opt in self.pose_tables or self.pose_tables[opt][0] != key:
+            self.pose_tables[opt] = [ key, PoseTable.PoseTable(self.image_list, opt) ]
+        return self.pose_tables[opt][1]
+
+    def findImageByName(self, name):
+        i = self.findIndexByName(name)
+        if i is None:
+            return None
+        return self.image_list[i]
+
+    # find an image by its source image file path
+    def findIndexByPath(self, path):
+        path = os.path.normpath(path)
+        return self.lookup_index('path_index', path,
+                                 lambda image: getattr(image, 'image_file', None) is not None and os.path.normpath(image.image_file) == path)
+
+    def findImageByPath(self, path):
+        i = self.findIndexByPath(path)
+        if i is None:
+            return None
+        return self.image_list[i]
 
     # compute a center reference location (lon, lat) for the group of
     # images.
@@ -521,6 +685,7 @@ class ProjectMgr():
             # their 3d locations and interpolate from the raw uv's,
             # but we already have a convenient list of undistored uv
             # points.
+            import scipy.interpolate
             g = scipy.interpolate.LinearNDInterpolator(uv_filt, coord_list)
 
             # interpolate all the keypoints now to approximate their
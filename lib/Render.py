@@ -3,6 +3,7 @@ import math
 import numpy as np
 
 import ImageList
+import Trace
 
 class Render():
     def __init__(self):
@@ -240,9 +241,10 @@ class Render():
                                                      xcenter, ycenter, pad,
                                                      only_placed=True)
         if len(draw_list):
-            self.drawImages( draw_list, source_dir=source_dir,
-                             cm_per_pixel=cm_per_pixel, blend_cm=blend_cm,
-                             bounds=bounds, file=file)
+            with Trace.span('render tile', len(draw_list)):
+                self.drawImages( draw_list, source_dir=source_dir,
+                                 cm_per_pixel=cm_per_pixel, blend_cm=blend_cm,
+                                 bounds=bounds, file=file)
         return draw_list
 
     def x2lon(self, x):
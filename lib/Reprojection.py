@@ -0,0 +1,99 @@
+# Reprojection.py - vectorized reprojection error of packed tracks (see
+# Tracks.py) for a whole project in one pass.
+#
+# All observations are projected together (the same pinhole + radial /
+# tangential distortion model as cv2.projectPoints) and the per track
+# and per image statistics are gathered with np.bincount /
+# np.maximum.at instead of python loops.
+
+import numpy as np
+
+# per image (rvec, tvec) arrays from the image poses
+def camera_params(proj, opt=True):
+    poses = proj.get_poses(opt)
+    return poses.rvec.copy(), poses.tvec.copy()
+
+# batched Rodrigues: (n, 3) rotation vectors -> (n, 3, 3) matrices
+def rotation_matrices(rvecs):
+    theta = np.linalg.norm(rvecs, axis=1)
+    small = theta < 1e-12
+    k = rvecs / np.where(small, 1.0, theta)[:,np.newaxis]
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:,0,1] = -k[:,2]; K[:,0,2] = k[:,1]
+    K[:,1,0] = k[:,2];  K[:,1,2] = -k[:,0]
+    K[:,2,0] = -k[:,1]; K[:,2,1] = k[:,0]
+    s = np.sin(theta)[:,np.newaxis,np.newaxis]
+    c = (1.0 - np.cos(theta))[:,np.newaxis,np.newaxis]
+    R = np.eye(3) + s * K + c * np.matmul(K, K)
+    R[small] = np.eye(3)
+    return R
+
+# project points (n, 3) seen by cameras R (n, 3, 3), t (n, 3) to pixel
+# coordinates with camera matrix K and distortion coefficients
+# [k1, k2, p1, p2, k3]
+def project(points, R, t, K, distCoeffs):
+    pc = np.einsum('nij,nj->ni', R, points) + t
+    x = pc[:,0] / pc[:,2]
+    y = pc[:,1] / pc[:,2]
+    d = np.zeros(5)
+    d[:len(distCoeffs)] = np.asarray(distCoeffs).ravel()[:5]
+    k1, k2, p1, p2, k3 = d
+    r2 = x*x + y*y
+    radial = 1.0 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    xd = x * radial + 2.0*p1*x*y + p2*(r2 + 2.0*x*x)
+    yd = y * radial + p1*(r2 + 2.0*y*y) + 2.0*p2*x*y
+    u = K[0,0] * xd + K[0,1] * yd + K[0,2]
+    v = K[1,1] * yd + K[1,2]
+    return np.column_stack((u, v))
+
+# per observation residual (observed - projected, (n_obs, 2)) for the
+# current track locations and camera poses
+def residuals(tracks, rvecs, tvecs, K, distCoeffs):
+    R = rotation_matrices(rvecs)
+    obs_image = tracks.obs_image
+    uv = project(tracks.points[tracks.obs_track()], R[obs_image],
+                 tvecs[obs_image], K, distCoeffs)
+    return tracks.obs_uv - uv
+
+# per track mean and max error (pixel distance), tracks without
+# selected observations get 0.  obs_mask optionally selects the
+# observations to consider.
+def track_stats(tracks, error, obs_mask=None):
+    obs_track = tracks.obs_track()
+    if obs_mask is not None:
+        obs_track = obs_track[obs_mask]
+        error = error[obs_mask]
+    n = len(tracks)
+    count = np.bincount(obs_track, minlength=n)
+    total = np.bincount(obs_track, weights=error, minlength=n)
+    mean = np.divide(total, count, out=np.zeros(n), where=count > 0)
+    worst = np.zeros(n)
+    np.maximum.at(worst, obs_track, error)
+    return mean, worst
+
+# per image observation count, mean, standard deviation and max error
+def image_stats(tracks, error, n_images, obs_mask=None):
+    obs_image = tracks.obs_image
+    if obs_mask is not None:
+        obs_image = obs_image[obs_mask]
+        error = error[obs_mask]
+    count = np.bincount(obs_image, minlength=n_images)
+    total = np.bincount(obs_image, weights=error, minlength=n_images)
+    total2 = np.bincount(obs_image, weights=error*error, minlength=n_images)
+    mean = np.divide(total, count, out=np.zeros(n_images), where=count > 0)
+    var = np.divide(total2, count, out=np.zeros(n_images), where=count > 0) - mean*mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    worst = np.zeros(n_images)
+    np.maximum.at(worst, obs_image, error)
+    return count, mean, std, worst
+
+# observations that take part in an optimization of the placed images
+# (same selection as Optimizer.setup(): observations in placed images
+# of tracks seen by at least min_chain_length placed images.)
+def placed_mask(tracks, placed_images, n_images, min_chain_length=3):
+    placed = np.zeros(n_images, dtype=bool)
+    placed[list(placed_images)] = True
+    obs_placed = placed[tracks.obs_image]
+    obs_track = tracks.obs_track()
+    counts = np.bincount(obs_track[obs_placed], minlength=len(tracks))
+    return obs_placed & (counts >= min_chain_length)[obs_track]
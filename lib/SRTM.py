@@ -3,9 +3,7 @@
 import json
 import numpy as np
 import os
-from pylab import *
 import random
-import scipy.interpolate
 import struct
 import urllib.request
 import zipfile
@@ -15,7 +13,7 @@ import navpy
 # return the lower left corner of the 1x1 degree tile containing
 # the specified lla coordinate
 def lla_ll_corner(lat_deg, lon_deg):
-    return int(floor(lat_deg)), int(floor(lon_deg))
+    return int(np.floor(lat_deg)), int(np.floor(lon_deg))
 
 # return the tile base name for the specified coordinate
 def make_tile_name(lat, lon):
@@ -104,6 +102,7 @@ class SRTM():
         y = np.linspace(self.lat, self.lat+1, 1201)
         #print x
         #print y
+        import scipy.interpolate
         self.lla_interp = scipy.interpolate.RegularGridInterpolator((x, y), srtm_pts, bounds_error=False, fill_value=-32768)
         #print self.lla_interp([-93.14530573529404, 45.220697421008396])
         #for i in range(20):
@@ -128,9 +127,10 @@ class SRTM():
                 zzz[r][c]=float(va)
  
         #zz=np.log1p(zzz)
-        imshow(zzz, interpolation='bilinear',cmap=cm.gray,alpha=1.0)
-        grid(False)
-        show()
+        from matplotlib import pyplot as plt
+        plt.imshow(zzz, interpolation='bilinear',cmap='gray',alpha=1.0)
+        plt.grid(False)
+        plt.show()
 
 # Build a gridded elevation interpolation table centered at lla_ref
 # with width and height.  This is a little bit of quick feet dancing,
@@ -236,13 +236,15 @@ class NEDGround():
         # now finally build the actual grid interpolator with evenly
         # spaced ned n, e values and elevations interpolated out of
         # the srtm lla interpolator.
+        import scipy.interpolate
         self.interp = scipy.interpolate.RegularGridInterpolator((n_list, e_list), ned_ds, bounds_error=False, fill_value=-32768)
 
         do_plot = False
         if do_plot:
-            imshow(ned_ds, interpolation='bilinear', origin='lower', cmap=cm.gray, alpha=1.0)
-            grid(False)
-            show()
+            from matplotlib import pyplot as plt
+            plt.imshow(ned_ds, interpolation='bilinear', origin='lower', cmap='gray', alpha=1.0)
+            plt.grid(False)
+            plt.show()
         
         do_test = False
         if do_test:
@@ -0,0 +1,142 @@
+# SolverLog.py - lightweight, time throttled progress reporting for
+# the optimizer.  Nothing is drawn while solving; progress records are
+# appended to a JSON-lines file (one json object per line) that can be
+# plotted offline with scripts/5f-plot-solver-log.py.
+#
+# Record fields:
+#   event: 'start', 'progress' or 'finish'
+#   label: optimizer label (so several solves can share one log)
+#   time: seconds since the start of this solve
+#   nfev: residual function evaluations so far (including the ones
+#         spent on the finite difference jacobian)
+#   nit: solver iterations so far
+#   cost: 0.5 * sum(residuals^2)
+#   mre: mean absolute residual (pixels)
+#   step_norm: norm of the parameter change of the last iteration
+#   eval_ms: mean time per evaluation since the previous record
+#   optimality: (finish record) infinity norm of the gradient at the
+#         solution, as reported by least_squares
+#
+# Progress is reported per solver iteration when the solver can call
+# back (iteration()), otherwise from the residual evaluations
+# themselves (set by_iteration = False.)
+
+import json
+import time
+
+import numpy as np
+
+class SolverLog():
+    def __init__(self, path=None, interval=1.0, label='optimizer',
+                 verbose=True):
+        self.path = path
+        self.interval = interval    # minimum seconds between records
+        self.label = label
+        self.verbose = verbose
+        self.by_iteration = True
+        self.fd = None
+        self.nfev = 0
+        self.nit = 0
+        self.cost = None
+        self.mre = None
+        self.step_norm = None
+        self.last_x = None
+
+    # open the log and write the start record
+    def start(self, n_params, n_residuals, **info):
+        if self.path is not None:
+            self.fd = open(self.path, 'a')
+        self.t_start = time.time()
+        self.t_last = self.t_start
+        self.nfev = 0
+        self.nit = 0
+        self.eval_time = 0.0
+        self.eval_count = 0
+        self.cost = None
+        self.mre = None
+        self.step_norm = None
+        self.last_x = None
+        record = { 'n_params': n_params, 'n_residuals': n_residuals }
+        record.update(info)
+        self.write('start', record)
+
+    # account for one residual function evaluation (cheap unless a
+    # record is due)
+    def evaluation(self, residuals, elapsed):
+        self.nfev += 1
+        self.eval_time += elapsed
+        self.eval_count += 1
+        if self.cost is None:
+            self.update(residuals)
+        if not self.by_iteration and time.time() - self.t_last >= self.interval:
+            self.update(residuals)
+            self.progress()
+
+    # account for one solver iteration (x and residuals at the new
+    # iterate), writes a progress record if the throttle interval has
+    # passed
+    def iteration(self, x, residuals):
+        self.nit += 1
+        if self.last_x is not None and len(self.last_x) == len(x):
+            self.step_norm = float(np.linalg.norm(x - self.last_x))
+        self.last_x = np.copy(x)
+        self.update(residuals)
+        if time.time() - self.t_last >= self.interval:
+            self.progress()
+
+    def update(self, residuals):
+        self.cost = float(0.5 * np.dot(residuals, residuals))
+        self.mre = float(np.mean(np.abs(residuals)))
+
+    def progress(self):
+        record = {}
+        if self.eval_count:
+            record['eval_ms'] = 1000.0 * self.eval_time / self.eval_count
+        self.eval_time = 0.0
+        self.eval_count = 0
+        self.write('progress', record)
+        if self.verbose:
+            print('%s: %.1fs nfev: %d nit: %d cost: %.4e mre: %.3f step: %.3e'
+                  % (self.label, time.time() - self.t_start, self.nfev,
+                     self.nit, self.cost, self.mre,
+                     self.step_norm if self.step_norm is not None else 0.0))
+
+    # write the final record (never throttled) and close the log
+    def finish(self, residuals, **info):
+        self.update(residuals)
+        self.write('finish', info)
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+    def write(self, event, fields):
+        self.t_last = time.time()
+        if self.fd is None:
+            return
+        record = { 'event': event, 'label': self.label,
+                   'time': self.t_last - self.t_start,
+                   'nfev': self.nfev, 'nit': self.nit,
+                   'cost': self.cost, 'mre': self.mre,
+                   'step_norm': self.step_norm }
+        record.update(fields)
+        self.fd.write(json.dumps(record) + '\n')
+        self.fd.flush()
+
+# load a log file, returns a list of runs, each run is the list of
+# records from a 'start' record up to the next 'start' record with
+# the same label.
+def load(path):
+    runs = []
+    current = {}
+    with open(path, 'r') as fd:
+        for line in fd:
+            line = line.strip()
+            if not len(line):
+                continue
+            record = json.loads(line)
+            label = record.get('label')
+            if record['event'] == 'start' or not label in current:
+                current[label] = []
+                runs.append(current[label])
+            current[label].append(record)
+    return runs
@@ -0,0 +1,44 @@
+# SourceIndex.py - one pass listing of the image source directories.
+#
+# Finding an image's source file used to mean an os.path.isfile() for
+# every source directory and extension, for every image, which is slow
+# on network file systems.  Instead each source directory is listed
+# once (os.scandir) into a dict of lowercase file name -> path, and the
+# images look themselves up there.
+#
+# Like the old search, a file in a later source directory takes
+# precedence over one in an earlier directory, and within a directory
+# .JPG is preferred over .jpg.
+
+import os
+
+image_exts = [ '.jpg' ]
+
+def build(dirs):
+    index = {}
+    for dir in dirs:
+        dir = os.path.normpath(dir)
+        found = {}
+        try:
+            entries = sorted([ entry.name for entry in os.scandir(dir)
+                               if entry.is_file() ])
+        except OSError as e:
+            print('Warning: cannot list image source dir:', dir, e)
+            continue
+        # (sorted, so upper case extensions come first)
+        for name in entries:
+            found.setdefault(name.lower(), os.path.join(dir, name))
+        index.update(found)
+    return index
+
+# source file of a file name (exact name including extension)
+def find_file(index, name):
+    return index.get(name.lower())
+
+# source image file of an image base name
+def find_image(index, image_base):
+    for ext in image_exts:
+        path = index.get((image_base + ext).lower())
+        if path:
+            return path
+    return None
@@ -0,0 +1,264 @@
+# Submaps.py - split a large bundle adjustment problem into spatially
+# coherent submaps that can be optimized independently (and in
+# parallel) and then stitched back together.
+#
+# 1. Partition the placed cameras into submaps (recursive median split
+#    of the camera NED locations.)
+# 2. Features seen by cameras in more than one submap are 'separators'.
+#    Each submap is optimized on its own with the separators held
+#    fixed, so every submap stays in the common reference frame.
+# 3. Optionally (align=True, 5a-optimize.py --submap-align) each
+#    optimized submap is refit (similarity transform) onto the
+#    original camera locations, the same way 5a-optimize.py can refit
+#    an optimized group.  The fixed separators already tie the submaps
+#    to the common frame, so this is off by default; it is useful when
+#    there are very few separators.
+# 4. A final reduced joint refinement optimizes just the boundary
+#    cameras (the ones that see separators) and the separator points,
+#    holding the interior points of each submap fixed.
+
+from multiprocessing import Pool
+import time
+
+import cv2
+import numpy as np
+
+import Optimizer
+import transformations
+
+# split the image index list at the median camera location along the
+# longest horizontal axis until every submap has no more than
+# max_cameras images.
+def partition_by_ned(proj, image_indices, max_cameras):
+    if len(image_indices) <= max_cameras:
+        return [ list(image_indices) ]
+    ned_list = proj.get_poses().ned[list(image_indices)]
+    spans = np.amax(ned_list[:,:2], axis=0) - np.amin(ned_list[:,:2], axis=0)
+    axis = np.argmax(spans)
+    order = np.argsort(ned_list[:,axis], kind='stable')
+    half = len(order) // 2
+    lower = [ image_indices[k] for k in order[:half] ]
+    upper = [ image_indices[k] for k in order[half:] ]
+    return partition_by_ned(proj, lower, max_cameras) \
+        + partition_by_ned(proj, upper, max_cameras)
+
+# return the set of match indices that are seen by images in more
+# than one submap
+def find_separators(submaps, matches):
+    owner = {}
+    for k, submap in enumerate(submaps):
+        for i in submap:
+            owner[i] = k
+    separators = set()
+    for i, match in enumerate(matches):
+        seen = set()
+        for m in match[1:]:
+            if m[0] in owner:
+                seen.add(owner[m[0]])
+        if len(seen) > 1:
+            separators.add(i)
+    return separators
+
+# worker process entry point
+def solve_submap(opt):
+    result = opt.run()
+    return result[0], result[1], result[2], result[3]
+
+# copy the (rvec, tvec) camera solution into the image optimized pose
+def set_optimized_pose(image, cam):
+    rvec = cam[0:3]
+    tvec = cam[3:6]
+    Rned2cam, jac = cv2.Rodrigues(rvec)
+    cam2body = image.get_cam2body()
+    Rned2body = cam2body.dot(Rned2cam)
+    Rbody2ned = np.matrix(Rned2body).T
+    (yaw, pitch, roll) = transformations.euler_from_matrix(Rbody2ned, 'rzyx')
+    pos = -np.matrix(Rned2cam).T * np.matrix(tvec).T
+    newned = pos.T[0].tolist()[0]
+    r2d = 180.0 / np.pi
+    image.set_camera_pose( newned, yaw*r2d, pitch*r2d, roll*r2d, opt=True )
+
+# camera center (ned) of an optimizer camera parameter vector
+def camera_center(cam):
+    R, jac = cv2.Rodrigues(cam[0:3])
+    return -R.T.dot(cam[3:6])
+
+# apply the 4x4 similarity transform A (with rotation R and scale) to
+# an optimizer camera parameter vector.
+def transform_camera(A, R, cam):
+    Rned2cam, jac = cv2.Rodrigues(cam[0:3])
+    center = A.dot(np.append(camera_center(cam), 1.0))[:3]
+    newR = Rned2cam.dot(R.T)
+    rvec, jac = cv2.Rodrigues(newR)
+    tvec = -newR.dot(center)
+    return np.append(rvec.ravel(), tvec)
+
+# mean reprojection error of the current optimized solution (poses
+# from camera_pose_opt, points from matches) over the placed images.
+def evaluate(proj, placed_images, matches):
+    opt = Optimizer.Optimizer(None)
+    opt.setup(proj, placed_images, matches, optimized=True)
+    x0 = np.hstack((opt.camera_params.ravel(), opt.points_3d.ravel(),
+                    opt.K[0,0], opt.K[0,2], opt.K[1,2], opt.distCoeffs))
+    error = opt.fun(x0, opt.n_cameras, opt.n_points,
+                    opt.by_camera_point_indices, opt.by_camera_points_2d)
+    return np.mean(np.abs(error))
+
+# Optimize the placed image set as a collection of submaps.  Returns
+# the same tuple as Optimizer.run() so callers can treat both modes
+# the same way.  Intermediate (and final) camera poses are written to
+# the images' optimized pose and the returned feature array covers
+# every match that was optimized in any stage.
+#
+# loss and f_scale select the robust loss of every solve (see
+# Optimizer.)
+#
+# With compare=True a conventional (monolithic) optimization is run
+# first from the same starting point (and, like the submaps, with the
+# calibration held fixed) and its error is reported next to the
+# partitioned result.  The monolithic solution is discarded.
+def run(proj, placed_images, matches, submaps, optimized=False,
+        workers=None, align=False, compare=False, loss='linear',
+        f_scale=1.0):
+    placed_images = list(placed_images)
+    if compare:
+        print('Running monolithic reference optimization...')
+        opt = Optimizer.Optimizer(proj.project_dir)
+        opt.optimize_calib = 'none'
+        opt.label = 'monolithic'
+        opt.loss = loss
+        opt.f_scale = f_scale
+        opt.setup(proj, placed_images, matches, optimized=optimized)
+        t0 = time.time()
+        opt.run()
+        mono_time = time.time() - t0
+        mono_mre = opt.mre_final
+
+    t_start = time.time()
+    separators = find_separators(submaps, matches)
+    print('Submaps:', len(submaps), 'sizes:', [len(s) for s in submaps])
+    print('Separator features:', len(separators))
+
+    K = proj.cam.get_K(optimized)
+    distCoeffs = np.array(proj.cam.get_dist_coeffs(optimized))
+
+    # setup each submap in this process (the optimizer only holds
+    # numpy arrays and index maps, so it can be shipped to a worker.)
+    opt_list = []
+    for submap in submaps:
+        opt = Optimizer.Optimizer(proj.project_dir)
+        opt.optimize_calib = 'none'
+        opt.verbose = 0
+        opt.label = 'submap-%d' % len(opt_list)
+        opt.loss = loss
+        opt.f_scale = f_scale
+        opt.setup(proj, submap, matches, optimized=optimized,
+                  fixed_features=separators)
+        opt_list.append(opt)
+
+    print('Optimizing submaps...')
+    t0 = time.time()
+    if workers is None or workers > 1:
+        pool = Pool(workers)
+        results = pool.map(solve_submap, opt_list)
+        pool.close()
+        pool.join()
+    else:
+        results = [ solve_submap(opt) for opt in opt_list ]
+    print('Submap optimization took %.1f sec' % (time.time() - t0))
+
+    # collect the per-submap solutions
+    cams = {}                   # image index -> camera params
+    points = {}                 # match index -> ned
+    for k, (cameras, features, cam_map, feat_map) in enumerate(results):
+        cam_list = []
+        for i, cam in enumerate(cameras):
+            cam_list.append(cam_map[i])
+            cams[cam_map[i]] = np.array(cam)
+        feat_list = []
+        for i, feat in enumerate(features):
+            feat_list.append(feat_map[i])
+            points[feat_map[i]] = np.array(feat)
+
+        if align and len(cam_list) >= 3:
+            # refit this submap onto the original camera locations
+            src = np.array( [ camera_center(cams[i]) for i in cam_list ] ).T
+            dst = proj.get_poses(optimized).ned[list(cam_list)].T
+            A = transformations.superimposition_matrix(src, dst, scale=True)
+            scale, shear, angles, trans, persp = transformations.decompose_matrix(A)
+            R = transformations.euler_matrix(*angles)[:3,:3]
+            print('submap %d alignment: scale: %.4f trans: %s' % (k, scale[0], trans))
+            for i in cam_list:
+                cams[i] = transform_camera(A, R, cams[i])
+            for i in feat_list:
+                points[i] = A.dot(np.append(points[i], 1.0))[:3]
+
+    # publish the stitched solution so the boundary refinement (and
+    # the final evaluation) start from it
+    work = []
+    for i, match in enumerate(matches):
+        new_match = list(match) # shallow copy
+        if i in points:
+            new_match[0] = points[i].tolist()
+        work.append(new_match)
+    for i in placed_images:
+        if i in cams:
+            set_optimized_pose(proj.image_list[i], cams[i])
+        else:
+            # not in any submap, carry the starting pose forward
+            image = proj.image_list[i]
+            ned, ypr, quat = image.get_camera_pose(opt=optimized)
+            image.set_camera_pose(ned, ypr[0], ypr[1], ypr[2], opt=True)
+    if optimized == False:
+        # later stages read the optimized calibration
+        proj.cam.set_K(K[0,0], K[1,1], K[0,2], K[1,2], optimized=True)
+        proj.cam.set_dist_coeffs(distCoeffs.tolist(), optimized=True)
+
+    # reduced joint refinement over the submap boundaries
+    boundary = set()
+    for i in separators:
+        for m in matches[i][1:]:
+            if m[0] in cams:
+                boundary.add(m[0])
+    if len(boundary) and len(separators):
+        print('Boundary refinement: cameras:', len(boundary))
+        interior = set(range(len(matches))) - separators
+        opt = Optimizer.Optimizer(proj.project_dir)
+        opt.optimize_calib = 'none'
+        opt.label = 'boundary'
+        opt.loss = loss
+        opt.f_scale = f_scale
+        opt.setup(proj, sorted(boundary), work, optimized=True,
+                  fixed_features=interior)
+        if opt.n_points > 0:
+            cameras, features, cam_map, feat_map, fx, fy, cu, cv, dist = opt.run()
+            for i, cam in enumerate(cameras):
+                cams[cam_map[i]] = np.array(cam)
+                set_optimized_pose(proj.image_list[cam_map[i]], cam)
+            for i, feat in enumerate(features):
+                points[feat_map[i]] = np.array(feat)
+                work[feat_map[i]][0] = list(feat)
+
+    mre_final = evaluate(proj, placed_images, work)
+    part_time = time.time() - t_start
+    print('Partitioned optimization took %.1f sec' % part_time)
+    print('Partitioned final mean reprojection error: %.3f' % mre_final)
+    if compare:
+        print('Monolithic:  mre = %.3f  time = %.1f sec' % (mono_mre, mono_time))
+        print('Partitioned: mre = %.3f  time = %.1f sec' % (mre_final, part_time))
+
+    # assemble the result in Optimizer.run() form
+    cam_index_map = {}
+    cameras = []
+    for i in placed_images:
+        if i in cams:
+            cam_index_map[len(cameras)] = i
+            cameras.append(cams[i])
+    feat_index_map = {}
+    features = []
+    for i in sorted(points):
+        feat_index_map[len(features)] = i
+        features.append(points[i].tolist())
+    return ( np.array(cameras), np.array(features),
+             cam_index_map, feat_index_map,
+             K[0,0], K[1,1], K[0,2], K[1,2], distCoeffs )
@@ -0,0 +1,237 @@
+# Synthetic.py - build a synthetic survey with a known answer, for
+# repeatable end to end benchmarks (see tests/0-synthetic-project.py
+# and tests/0-pipeline-bench.py.)
+#
+# The scene is a textured ground plane, optionally a smooth heightfield
+# (relief_m > 0), laid out in a local NED frame whose origin is the
+# center of the survey area at zero altitude.  A nadir camera flies a
+# lawnmower pattern over it (north/south legs, constant altitude above
+# the mean ground) and each image is rendered by casting a ray per
+# pixel into the scene, using the same camera model as the rest of the
+# code (Image.get_proj(): R = body2cam * ned2body, aircraft pose plus
+# camera mount offset as in Pose.compute_camera_poses()), with zero
+# lens distortion.
+#
+# The output directory gets:
+#
+#   images/IMG_nnnn.JPG  the rendered images
+#   camera.json          camera config for 1b-set-camera-config.py
+#   poses.csv            aircraft poses (with simulated gps/ahrs noise)
+#                        in the sentera format Pose.setAircraftPoses()
+#                        parses: name,lat,lon,alt,yaw,pitch,roll
+#   truth.json           the true aircraft poses, ground elevation,
+#                        camera mount and survey parameters
+
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+
+import transformations
+
+d2r = math.pi / 180.0
+
+# lens coordinate system <-> body (see Image.__init__)
+cam2body = np.array( [[0, 0, 1],
+                      [1, 0, 0],
+                      [0, 1, 0]], dtype=float )
+body2cam = np.linalg.inv(cam2body)
+
+# a feature rich random texture: a few octaves of smooth noise for
+# large scale shading plus random shapes for detail
+def make_texture(rows, cols, seed=0):
+    rng = np.random.RandomState(seed)
+    img = np.zeros((rows, cols, 3), np.float32)
+    for octave in [ 8, 32, 128, 512 ]:
+        small = rng.uniform(0, 255, (max(2, rows // octave),
+                                     max(2, cols // octave), 3))
+        img += cv2.resize(small.astype(np.float32), (cols, rows),
+                          interpolation=cv2.INTER_CUBIC) * 0.25
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    n_shapes = rows * cols // 400
+    for i in range(n_shapes):
+        color = tuple([ int(c) for c in rng.randint(0, 256, 3) ])
+        x = int(rng.randint(0, cols))
+        y = int(rng.randint(0, rows))
+        size = int(rng.randint(2, 12))
+        kind = rng.randint(3)
+        if kind == 0:
+            cv2.circle(img, (x, y), size, color, -1)
+        elif kind == 1:
+            cv2.rectangle(img, (x, y), (x + size, y + int(rng.randint(2, 12))),
+                          color, -1)
+        else:
+            cv2.line(img, (x, y), (x + int(rng.randint(-20, 20)),
+                                   y + int(rng.randint(-20, 20))), color, 2)
+    return img
+
+# smooth random relief (meters above the mean ground, zero mean), None
+# for a flat ground
+def make_heightfield(rows, cols, relief_m, seed=0):
+    if relief_m <= 0.0:
+        return None
+    rng = np.random.RandomState(seed + 1)
+    small = rng.uniform(-1, 1, (max(2, rows // 200), max(2, cols // 200)))
+    field = cv2.resize(small.astype(np.float32), (cols, rows),
+                       interpolation=cv2.INTER_CUBIC)
+    field -= np.mean(field)
+    return field * (relief_m / max(1e-6, np.max(np.abs(field))))
+
+# camera (ned2cam) quaternion from the aircraft attitude and the camera
+# mount offset, composed like Pose.compute_camera_poses()
+def camera_quat(yaw_deg, pitch_deg, roll_deg, mount):
+    ned2body = transformations.quaternion_from_euler(yaw_deg * d2r,
+                                                     pitch_deg * d2r,
+                                                     roll_deg * d2r, 'rzyx')
+    mount_quat = transformations.quaternion_from_euler(mount[0] * d2r,
+                                                       mount[1] * d2r,
+                                                       mount[2] * d2r, 'rzyx')
+    return transformations.quaternion_multiply(ned2body, mount_quat)
+
+# ned -> camera rotation for a camera quaternion (Image.get_proj())
+def camera_rotation(quat):
+    body2ned = transformations.quaternion_matrix(np.array(quat))[:3,:3]
+    return body2cam.dot(body2ned.T)
+
+class Scene():
+    # width_m (east) x height_m (north) area centered on the origin,
+    # textured at gsd_m meters per texture pixel
+    def __init__(self, width_m, height_m, gsd_m=0.05, ground_m=0.0,
+                 relief_m=0.0, seed=0):
+        self.gsd = gsd_m
+        self.ground_m = ground_m
+        self.rows = int(height_m / gsd_m)
+        self.cols = int(width_m / gsd_m)
+        self.n0 = height_m * 0.5   # north edge
+        self.e0 = -width_m * 0.5   # west edge
+        self.texture = make_texture(self.rows, self.cols, seed)
+        self.heights = make_heightfield(self.rows, self.cols, relief_m, seed)
+
+    # ned -> texture pixel coordinates
+    def to_pixel(self, n, e):
+        return (e - self.e0) / self.gsd, (self.n0 - n) / self.gsd
+
+    # ground elevation (meters) at ned positions
+    def elevation(self, n, e):
+        if self.heights is None:
+            return np.full(np.shape(n), self.ground_m)
+        x, y = self.to_pixel(n, e)
+        h = cv2.remap(self.heights, x.astype(np.float32), y.astype(np.float32),
+                      cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return self.ground_m + h
+
+    # render the view of a camera at ned with the given camera
+    # quaternion and calibration K
+    def render(self, ned, quat, K, width, height):
+        R = camera_rotation(quat)
+        u, v = np.meshgrid(np.arange(width, dtype=np.float64),
+                           np.arange(height, dtype=np.float64))
+        rays = np.stack((u, v, np.ones_like(u)), axis=-1).dot(np.linalg.inv(K).T)
+        rays = rays.dot(R)          # (R.T * ray) for every pixel
+        # intersect with the ground (fixed point iteration on the
+        # heightfield, exact for a flat ground)
+        d = np.full(u.shape, -self.ground_m)
+        for i in range(4 if self.heights is not None else 1):
+            t = (d - ned[2]) / rays[:,:,2]
+            n = ned[0] + t * rays[:,:,0]
+            e = ned[1] + t * rays[:,:,1]
+            d = -self.elevation(n, e)
+        x, y = self.to_pixel(n, e)
+        return cv2.remap(self.texture, x.astype(np.float32), y.astype(np.float32),
+                         cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+# lawnmower survey: (n, e, yaw_deg) of each image.  Legs run north and
+# south alternately, spaced across track, images spaced along track.
+def lawnmower(legs, per_leg, leg_spacing_m, image_spacing_m):
+    poses = []
+    for leg in range(legs):
+        e = (leg - (legs - 1) * 0.5) * leg_spacing_m
+        for i in range(per_leg):
+            n = (i - (per_leg - 1) * 0.5) * image_spacing_m
+            if leg % 2:
+                poses.append( [-n, e, 180.0] )
+            else:
+                poses.append( [n, e, 0.0] )
+    return poses
+
+# build the synthetic survey in out_dir (see the top of the file)
+def generate(out_dir, images=16, width_px=1024, height_px=768,
+             focal_px=1000.0, agl_m=60.0, forward_overlap=0.7,
+             side_overlap=0.6, ground_m=300.0, relief_m=0.0,
+             gps_sigma_m=1.0, att_sigma_deg=1.0, ref_lla=(45.0, -93.0),
+             seed=0):
+    import navpy
+
+    rng = np.random.RandomState(seed)
+    legs = max(1, int(round(math.sqrt(images))))
+    per_leg = int(math.ceil(images / float(legs)))
+    # the nadir image footprint: height along track, width across
+    along_m = height_px * agl_m / focal_px
+    across_m = width_px * agl_m / focal_px
+    image_spacing = along_m * (1.0 - forward_overlap)
+    leg_spacing = across_m * (1.0 - side_overlap)
+    poses = lawnmower(legs, per_leg, leg_spacing, image_spacing)[:images]
+
+    # scene: the flown area plus a footprint of margin all around
+    margin = max(along_m, across_m)
+    width_m = (legs - 1) * leg_spacing + 2 * margin
+    height_m = (per_leg - 1) * image_spacing + 2 * margin
+    print('Scene %.0f x %.0f m, %d images (%d legs x %d)'
+          % (width_m, height_m, len(poses), legs, per_leg))
+    scene = Scene(width_m, height_m, gsd_m=agl_m / focal_px,
+                  ground_m=ground_m, relief_m=relief_m, seed=seed)
+
+    K = np.array( [[focal_px, 0, width_px * 0.5],
+                   [0, focal_px, height_px * 0.5],
+                   [0, 0, 1]] )
+    mount = [ 0.0, -90.0, 0.0 ]
+    image_dir = os.path.join(out_dir, 'images')
+    if not os.path.exists(image_dir):
+        os.makedirs(image_dir)
+
+    truth = { 'ref_lla': [ ref_lla[0], ref_lla[1], 0.0 ],
+              'ground_m': ground_m, 'relief_m': relief_m,
+              'agl_m': agl_m, 'mount': mount, 'seed': seed,
+              'images': {} }
+    lines = [ 'File Name,Lat (decimal degrees),Lon (decimal degrees),Alt (meters MSL),Yaw (decimal degrees),Pitch (decimal degrees),Roll (decimal degrees)' ]
+    for i, [n, e, yaw] in enumerate(poses):
+        name = 'IMG_%04d' % (i + 1)
+        # a little real attitude wobble, so the images are not all
+        # perfectly aligned
+        pitch = rng.normal(0, 1.0)
+        roll = rng.normal(0, 1.0)
+        yaw = (yaw + rng.normal(0, 2.0)) % 360.0
+        ned = [ n, e, -(ground_m + agl_m) ]
+        quat = camera_quat(yaw, pitch, roll, mount)
+        img = scene.render(ned, quat, K, width_px, height_px)
+        cv2.imwrite(os.path.join(image_dir, name + '.JPG'), img,
+                    [cv2.IMWRITE_JPEG_QUALITY, 95])
+        lla = navpy.ned2lla(ned, ref_lla[0], ref_lla[1], 0.0)
+        truth['images'][name] = { 'lla': [ float(lla[0]), float(lla[1]), float(lla[2]) ],
+                                  'ned': ned,
+                                  'ypr': [ yaw, pitch, roll ] }
+        # the measured (noisy) pose
+        noisy = [ n + rng.normal(0, gps_sigma_m),
+                  e + rng.normal(0, gps_sigma_m),
+                  ned[2] + rng.normal(0, gps_sigma_m * 2.0) ]
+        lla = navpy.ned2lla(noisy, ref_lla[0], ref_lla[1], 0.0)
+        lines.append('%s.JPG,%.10f,%.10f,%.3f,%.3f,%.3f,%.3f'
+                     % (name, lla[0], lla[1], lla[2],
+                        (yaw + rng.normal(0, att_sigma_deg * 2.0)) % 360.0,
+                        pitch + rng.normal(0, att_sigma_deg),
+                        roll + rng.normal(0, att_sigma_deg)))
+
+    with open(os.path.join(out_dir, 'poses.csv'), 'w') as fd:
+        fd.write('\n'.join(lines) + '\n')
+    camera = { 'make': 'synthetic', 'model': 'nadir', 'lens_model': 'pinhole',
+               'K': K.ravel().tolist(), 'dist_coeffs': [ 0.0 ] * 5,
+               'width_px': width_px, 'height_px': height_px,
+               'ccd_width_mm': width_px * 0.005, 'ccd_height_mm': height_px * 0.005,
+               'focal_len_mm': focal_px * 0.005 }
+    with open(os.path.join(out_dir, 'camera.json'), 'w') as fd:
+        json.dump(camera, fd, indent=4, sort_keys=True)
+    with open(os.path.join(out_dir, 'truth.json'), 'w') as fd:
+        json.dump(truth, fd, indent=1, sort_keys=True)
+    return truth
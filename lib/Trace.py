@@ -0,0 +1,127 @@
+# Trace.py - lightweight timing spans for finding where a run spends
+# its time.
+#
+#   with Trace.span('knnMatch', len(des1)):
+#       matches = matcher.knnMatch(...)
+#
+#   @Trace.traced('optimizer fun')
+#   def fun(self, ...):
+#
+# Each span records its wall time, process cpu time, an item count and
+# the peak resident memory (ru_maxrss) at its end.  Tracing is off
+# unless start() was called (the scripts' --trace option), and then
+# span() just returns a shared no-op object, so the instrumented code
+# pays one function call.  At exit the spans are written as Chrome
+# trace event json (load in chrome://tracing or ui.perfetto.dev) and a
+# summary table per span name is printed.  Spans in worker processes
+# are not collected.
+
+import atexit
+import json
+import os
+import resource
+import threading
+import time
+
+enabled = False
+trace_file = None
+events = []
+pid = os.getpid()
+t_start = time.perf_counter()
+
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, count):
+        pass
+
+null_span = NullSpan()
+
+class Span():
+    __slots__ = [ 'name', 'count', 'wall', 'cpu' ]
+
+    def __init__(self, name, count=0):
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    # add to the item count (when it is only known inside the span)
+    def add(self, count):
+        self.count += count
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        # ru_maxrss is in kilobytes (linux)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        events.append( { 'name': self.name, 'ph': 'X', 'pid': pid,
+                         'tid': threading.get_ident(),
+                         'ts': (self.wall - t_start) * 1e6,
+                         'dur': (wall - self.wall) * 1e6,
+                         'args': { 'cpu_ms': (cpu - self.cpu) * 1000.0,
+                                   'count': self.count,
+                                   'peak_rss_mb': rss / 1024.0 } } )
+        return False
+
+def span(name, count=0):
+    if not enabled:
+        return null_span
+    return Span(name, count)
+
+# decorator version of span() for functions
+def traced(name):
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+# turn tracing on, the trace is written to path at exit (no-op if path
+# is None, so scripts can pass their --trace option straight through)
+def start(path):
+    global enabled, trace_file
+    if path is None:
+        return
+    trace_file = path
+    enabled = True
+    atexit.register(finish)
+
+def summary():
+    totals = {}
+    for event in events:
+        name = event['name']
+        if name not in totals:
+            totals[name] = [ 0, 0.0, 0.0, 0, 0.0 ]
+        t = totals[name]
+        t[0] += 1
+        t[1] += event['dur'] / 1e6
+        t[2] += event['args']['cpu_ms'] / 1000.0
+        t[3] += event['args']['count']
+        t[4] = max(t[4], event['args']['peak_rss_mb'])
+    print('%-24s %8s %10s %10s %10s %10s' % ('span', 'calls', 'wall', 'cpu', 'items', 'peak rss'))
+    for name in sorted(totals, key=lambda name: -totals[name][1]):
+        [calls, wall, cpu, count, rss] = totals[name]
+        print('%-24s %8d %9.2fs %9.2fs %10d %8.0fMB' % (name[:24], calls, wall, cpu, count, rss))
+
+def finish():
+    global enabled
+    if not enabled:
+        return
+    enabled = False
+    with open(trace_file, 'w') as fd:
+        json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, fd)
+    summary()
+    print('Wrote trace:', trace_file, '(%d spans)' % len(events))
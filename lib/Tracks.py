@@ -0,0 +1,304 @@
+# Tracks.py - packed (array based) representation of a match list.
+#
+# A match list is a python list of tracks, each track is:
+#
+#   [ [n, e, d], [image_index, uv_or_kp_index], ... ]
+#
+# which is convenient but slow to work through for millions of
+# tracks.  The packed form keeps the same information in a handful of
+# flat numpy arrays:
+#
+#   points:    (n_tracks, 3) float, the 3d (ned) location of each track
+#   offsets:   (n_tracks + 1) int, observations of track i are
+#              obs_*[offsets[i]:offsets[i+1]]
+#   obs_image: (n_obs) int, image index of each observation
+#   obs_uv:    (n_obs, 2) float, pixel coordinate (nan if the match list
+#              stores keypoint indices instead, i.e. matches_direct)
+#   obs_kp:    (n_obs) int, keypoint index (-1 if the match list stores
+#              pixel coordinates)
+#
+# On disk (next to the pickled match list 'name', in 'name.tracks/')
+# the packed form is a set of .npy files that can be memory mapped:
+#
+#   points.npy:  (n_tracks, 3) float64
+#   offsets.npy: (n_tracks + 1) int64
+#   obs.npy:     (n_obs, 3) int32, (track, image, keypoint) sorted by
+#                track
+#   uv.npy:      (n_obs, 2) float64
+#   source.json: the size and modification time (ns) of the pickle when
+#                the copy was written, and whether the copy was packed
+#                from it ('pickle') or written after it ('tracks')
+#
+# read() prefers the columnar copy and falls back to (and refreshes the
+# copy from) the pickle when the pickle is no longer exactly the file
+# the copy was made against, so scripts that still write the pickled
+# lists keep working.  (An exact size + time stamp match rather than a
+# newer-than test: on file systems with coarse time stamps a pickle
+# rewritten within the same tick would otherwise look unchanged.)
+
+import json
+import numpy as np
+import os
+import pickle
+import shutil
+
+class Tracks():
+    def __init__(self, points, offsets, obs_image, obs_uv, obs_kp,
+                 track=None):
+        self.points = points
+        self.offsets = offsets
+        self.obs_image = obs_image
+        self.obs_uv = obs_uv
+        self.obs_kp = obs_kp
+        self.track = track      # track index of each observation (if known)
+
+    def __len__(self):
+        return len(self.points)
+
+    def num_obs(self):
+        return len(self.obs_image)
+
+    # number of observations of each track
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    # track index of each observation
+    def obs_track(self):
+        if self.track is not None:
+            return self.track
+        return np.repeat(np.arange(len(self.points)), self.lengths())
+
+    # observation index range of track i
+    def obs_range(self, i):
+        return self.offsets[i], self.offsets[i+1]
+
+# pack a match list
+def pack(matches):
+    n_tracks = len(matches)
+    lengths = np.fromiter((len(match) - 1 for match in matches),
+                          dtype=np.int64, count=n_tracks)
+    offsets = np.zeros(n_tracks + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    n_obs = int(offsets[-1])
+    points = np.empty((n_tracks, 3))
+    obs_image = np.empty(n_obs, dtype=np.int64)
+    obs_uv = np.full((n_obs, 2), np.nan)
+    obs_kp = np.full(n_obs, -1, dtype=np.int64)
+    k = 0
+    for i, match in enumerate(matches):
+        points[i] = match[0][:3]
+        for m in match[1:]:
+            obs_image[k] = m[0]
+            if isinstance(m[1], (int, np.integer)):
+                obs_kp[k] = m[1]
+            else:
+                obs_uv[k] = m[1]
+            k += 1
+    return Tracks(points, offsets, obs_image, obs_uv, obs_kp)
+
+# convert packed tracks back to a match list
+def unpack(tracks):
+    matches = []
+    points = tracks.points.tolist()
+    obs_image = tracks.obs_image.tolist()
+    obs_uv = tracks.obs_uv.tolist()
+    obs_kp = tracks.obs_kp.tolist()
+    offsets = tracks.offsets.tolist()
+    for i in range(len(points)):
+        match = [ points[i] ]
+        for k in range(offsets[i], offsets[i+1]):
+            if obs_kp[k] >= 0:
+                match.append( [obs_image[k], obs_kp[k]] )
+            else:
+                match.append( [obs_image[k], obs_uv[k]] )
+        matches.append(match)
+    return matches
+
+# columnar directory of the match list 'name' of a project
+def tracks_dir(project_dir, name):
+    return os.path.join(project_dir, name + '.tracks')
+
+# write packed tracks as .npy files in path (replaces any existing
+# copy, the new files are written to a temporary directory first.)
+# source (if given) is written to source.json.
+def save(path, tracks, source=None):
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    if source is not None:
+        with open(os.path.join(tmp, 'source.json'), 'w') as fd:
+            json.dump(source, fd)
+    obs = np.empty((tracks.num_obs(), 3), dtype=np.int32)
+    obs[:,0] = tracks.obs_track()
+    obs[:,1] = tracks.obs_image
+    obs[:,2] = tracks.obs_kp
+    np.save(os.path.join(tmp, 'points.npy'), np.asarray(tracks.points, dtype=np.float64))
+    np.save(os.path.join(tmp, 'offsets.npy'), np.asarray(tracks.offsets, dtype=np.int64))
+    np.save(os.path.join(tmp, 'obs.npy'), obs)
+    np.save(os.path.join(tmp, 'uv.npy'), np.asarray(tracks.obs_uv, dtype=np.float64))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+
+# load packed tracks written by save(), memory mapped (read only) unless
+# mmap is False
+def load(path, mmap=True):
+    mode = 'r' if mmap else None
+    points = np.load(os.path.join(path, 'points.npy'), mmap_mode=mode)
+    offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mode)
+    obs = np.load(os.path.join(path, 'obs.npy'), mmap_mode=mode)
+    uv = np.load(os.path.join(path, 'uv.npy'), mmap_mode=mode)
+    return Tracks(points, offsets, obs[:,1], uv, obs[:,2], track=obs[:,0])
+
+def offsets_file(project_dir, name):
+    return os.path.join(tracks_dir(project_dir, name), 'offsets.npy')
+
+# size and modification time of the pickled match list 'name' (None if
+# there is no pickle)
+def pickle_stamp(project_dir, name):
+    pickle_file = os.path.join(project_dir, name)
+    if not os.path.isfile(pickle_file):
+        return None
+    st = os.stat(pickle_file)
+    return { 'size': st.st_size, 'mtime_ns': st.st_mtime_ns }
+
+# the source.json record of the columnar copy (None if there is no
+# copy, or it predates the record)
+def read_source(project_dir, name):
+    if not os.path.isfile(offsets_file(project_dir, name)):
+        return None
+    path = os.path.join(tracks_dir(project_dir, name), 'source.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as fd:
+        return json.load(fd)
+
+# True if the columnar copy of a match list exists and the pickle (if
+# any) is unchanged since the copy was written
+def is_current(project_dir, name):
+    if not os.path.isfile(offsets_file(project_dir, name)):
+        return False
+    stamp = pickle_stamp(project_dir, name)
+    if stamp is None:
+        return True
+    source = read_source(project_dir, name)
+    return source is not None and source['pickle'] == stamp
+
+# packed tracks of the match list 'name' of a project (columnar copy if
+# current, otherwise packed from the pickle and, when cache is True, the
+# copy written for the next time)
+def read(project_dir, name, mmap=True, cache=True):
+    path = tracks_dir(project_dir, name)
+    if is_current(project_dir, name):
+        return load(path, mmap)
+    stamp = pickle_stamp(project_dir, name)
+    matches = pickle.load( open(os.path.join(project_dir, name), 'rb') )
+    tracks = pack(matches)
+    if cache:
+        save(path, tracks, { 'pickle': stamp, 'origin': 'pickle' })
+    return tracks
+
+# write the columnar copy of the match list 'name' (it supersedes the
+# pickle, if any, until the pickle is rewritten)
+def write(project_dir, name, tracks):
+    save(tracks_dir(project_dir, name), tracks,
+         { 'pickle': pickle_stamp(project_dir, name), 'origin': 'tracks' })
+
+# the match list 'name' of a project as a python list (from the pickle
+# unless the columnar copy was written after it)
+def read_list(project_dir, name):
+    pickle_file = os.path.join(project_dir, name)
+    if os.path.isfile(pickle_file):
+        source = read_source(project_dir, name)
+        if source is None or source['origin'] != 'tracks' \
+           or source['pickle'] != pickle_stamp(project_dir, name):
+            return pickle.load( open(pickle_file, 'rb') )
+    return unpack(load(tracks_dir(project_dir, name)))
+
+# return a new Tracks keeping only the observations where obs_keep is
+# True and then only the tracks where track_keep is True (tracks are
+# not dropped automatically when they lose observations.)
+def compact(tracks, obs_keep=None, track_keep=None):
+    obs_track = tracks.obs_track()
+    if obs_keep is None:
+        obs_keep = np.ones(tracks.num_obs(), dtype=bool)
+    if track_keep is not None:
+        obs_keep = obs_keep & track_keep[obs_track]
+    else:
+        track_keep = np.ones(len(tracks), dtype=bool)
+    lengths = np.bincount(obs_track[obs_keep], minlength=len(tracks))
+    lengths = lengths[track_keep]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Tracks(tracks.points[track_keep], offsets,
+                  tracks.obs_image[obs_keep], tracks.obs_uv[obs_keep],
+                  tracks.obs_kp[obs_keep])
+
+# every pair of observations within a track, (obs_a, obs_b) with obs_a
+# before obs_b in track order.  Tracks are processed in batches of equal
+# length so all the pairs of a batch are generated at once.
+def obs_pairs(tracks):
+    lengths = tracks.lengths()
+    obs_a = []
+    obs_b = []
+    for n in np.unique(lengths):
+        if n < 2:
+            continue
+        idx = np.nonzero(lengths == n)[0]
+        obs = tracks.offsets[idx][:,np.newaxis] + np.arange(n)
+        a, b = np.triu_indices(n, 1)
+        obs_a.append(obs[:,a].ravel())
+        obs_b.append(obs[:,b].ravel())
+    if not len(obs_a):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(obs_a), np.concatenate(obs_b)
+
+# Inverted index from an (unordered) image pair to the tracks that
+# connect it.  The observation pairs are sorted by pair key
+# (min(i, j) * n_images + max(i, j)) and stored CSR style: the entries
+# of the k'th pair (keys[k]) are [offsets[k], offsets[k+1]) of obs_a,
+# obs_b and track.  Observation pairs within the same image are
+# skipped.
+class PairIndex():
+    def __init__(self, tracks, n_images):
+        self.n_images = n_images
+        obs_a, obs_b = obs_pairs(tracks)
+        image_a = tracks.obs_image[obs_a]
+        image_b = tracks.obs_image[obs_b]
+        keep = image_a != image_b
+        obs_a = obs_a[keep]
+        obs_b = obs_b[keep]
+        key = np.minimum(image_a[keep], image_b[keep]) * n_images \
+            + np.maximum(image_a[keep], image_b[keep])
+        order = np.argsort(key, kind='stable')
+        self.obs_a = obs_a[order]
+        self.obs_b = obs_b[order]
+        self.track = tracks.obs_track()[self.obs_a]
+        self.keys, starts = np.unique(key[order], return_index=True)
+        self.offsets = np.append(starts, len(order)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # (i, j) image arrays of the indexed pairs (i < j)
+    def pairs(self):
+        return self.keys // self.n_images, self.keys % self.n_images
+
+    # number of observation pairs of each indexed pair
+    def counts(self):
+        return np.diff(self.offsets)
+
+    # entry range of the pair (i, j) (empty if the images share no
+    # tracks)
+    def find(self, i, j):
+        key = min(i, j) * self.n_images + max(i, j)
+        k = np.searchsorted(self.keys, key)
+        if k < len(self.keys) and self.keys[k] == key:
+            return self.offsets[k], self.offsets[k+1]
+        return 0, 0
+
+    # track ids connecting images i and j
+    def tracks(self, i, j):
+        start, end = self.find(i, j)
+        return np.unique(self.track[start:end])
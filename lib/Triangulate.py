@@ -0,0 +1,101 @@
+# Triangulate.py - batched multi-view (DLT) triangulation of packed
+# tracks (see Tracks.py.)
+#
+# For every track the linear system A X = 0 is built from two rows per
+# observation (x * P[2] - P[0], y * P[2] - P[1]) in normalized
+# (undistorted) image coordinates, and X is the eigenvector of A^T A
+# with the smallest eigenvalue.  Rather than stacking the 2N x 4
+# systems, A^T A (a 4x4 per track) is accumulated directly from the
+# observations, so every track is solved in one vectorized pass
+# regardless of its length.
+#
+# Quality masks:
+#   cheirality: the point is in front of every camera that sees it
+#   angle: the largest angle (degrees) between any two viewing rays of
+#          the track (small angles mean a poorly conditioned depth.)
+
+import cv2
+import numpy as np
+
+# (n_images, 3, 4) array of [R|t] camera matrices (in normalized image
+# coordinates) from the image poses
+def projection_matrices(proj, opt=False):
+    P = proj.get_poses(opt).P.copy()
+    return P
+
+# camera centers (ned) from the camera matrices
+def camera_centers(P):
+    R = P[:,:,:3]
+    t = P[:,:,3]
+    return -np.einsum('nji,nj->ni', R, t)
+
+# undistort and normalize all the observation pixel coordinates
+def normalize(tracks, K, distCoeffs):
+    uv = tracks.obs_uv.reshape(-1, 1, 2).astype(np.float64)
+    if len(uv) == 0:
+        return np.zeros((0, 2))
+    xy = cv2.undistortPoints(uv, K, np.asarray(distCoeffs, dtype=np.float64))
+    return xy.reshape(-1, 2)
+
+# solve all tracks.  xy are the normalized observation coordinates (see
+# normalize()), P the camera matrices indexed by tracks.obs_image.
+# Returns the (n_tracks, 3) points (nan for tracks with fewer than two
+# observations.)
+def dlt(tracks, xy, P):
+    obs_track = tracks.obs_track()
+    Pobs = P[tracks.obs_image]                  # (n_obs, 3, 4)
+    r1 = xy[:,0,np.newaxis] * Pobs[:,2] - Pobs[:,0]
+    r2 = xy[:,1,np.newaxis] * Pobs[:,2] - Pobs[:,1]
+    # normalize the rows so every observation carries equal weight
+    r1 /= np.linalg.norm(r1, axis=1)[:,np.newaxis]
+    r2 /= np.linalg.norm(r2, axis=1)[:,np.newaxis]
+    outer = np.einsum('ni,nj->nij', r1, r1) + np.einsum('ni,nj->nij', r2, r2)
+    n_tracks = len(tracks)
+    AtA = np.zeros((n_tracks, 16))
+    for k in range(16):
+        AtA[:,k] = np.bincount(obs_track, weights=outer[:,k // 4, k % 4],
+                               minlength=n_tracks)
+    w, v = np.linalg.eigh(AtA.reshape(n_tracks, 4, 4))
+    X = v[:,:,0]                                # smallest eigenvalue
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points = X[:,:3] / X[:,3,np.newaxis]
+    points[tracks.lengths() < 2] = np.nan
+    return points
+
+# per track cheirality mask (in front of every observing camera)
+def cheirality(tracks, points, P):
+    depth = np.einsum('nj,nj->n', P[tracks.obs_image,2,:3],
+                      points[tracks.obs_track()]) + P[tracks.obs_image,2,3]
+    ok = np.ones(len(tracks), dtype=bool)
+    bad = ~(depth > 0)
+    ok[tracks.obs_track()[bad]] = False
+    return ok
+
+# per track maximum triangulation angle (degrees), tracks are grouped
+# by length so the pairwise ray comparisons vectorize.
+def angles(tracks, points, P):
+    centers = camera_centers(P)
+    rays = points[tracks.obs_track()] - centers[tracks.obs_image]
+    rays /= np.linalg.norm(rays, axis=1)[:,np.newaxis]
+    lengths = tracks.lengths()
+    result = np.zeros(len(tracks))
+    for n in np.unique(lengths):
+        if n < 2:
+            continue
+        idx = np.nonzero(lengths == n)[0]
+        obs = tracks.offsets[idx][:,np.newaxis] + np.arange(n)
+        r = rays[obs]                           # (tracks, n, 3)
+        dots = np.einsum('tik,tjk->tij', r, r)
+        result[idx] = np.degrees(np.arccos(np.clip(np.amin(dots, axis=(1,2)), -1.0, 1.0)))
+    return result
+
+# Triangulate all tracks, returns (points, valid, angle) where valid
+# combines finite solution, cheirality and min_angle (degrees.)
+def triangulate(tracks, P, K, distCoeffs, min_angle=0.0):
+    xy = normalize(tracks, K, distCoeffs)
+    points = dlt(tracks, xy, P)
+    finite = np.all(np.isfinite(points), axis=1)
+    safe = np.where(finite[:,np.newaxis], points, 0.0)
+    angle = angles(tracks, safe, P)
+    valid = finite & cheirality(tracks, safe, P) & (angle >= min_angle)
+    return points, valid, angle
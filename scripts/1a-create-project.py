@@ -8,14 +8,17 @@ import sys
 sys.path.append('../lib')
 import ProjectMgr
 import Image
+import Trace
 
 # initialize a new project workspace
 
 parser = argparse.ArgumentParser(description='Create an empty project.')
 parser.add_argument('--project', required=True, help='project work directory')
 parser.add_argument('--image-dirs', required=True, nargs='+', help='image source directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 print(args)
 
 # create an empty project
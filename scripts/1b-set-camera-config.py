@@ -9,6 +9,7 @@ import os.path
 
 sys.path.append('../lib')
 import ProjectMgr
+import Trace
 
 # from the aura-props package
 from props import getNode, PropertyNode
@@ -26,8 +27,10 @@ parser.add_argument('--pitch-deg', required=True, type=float,
                     help='camera pitch mounting offset from aircraft')
 parser.add_argument('--roll-deg', required=True, type=float,
                     help='camera roll mounting offset from aircraft')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# Convert the per image meta info of a project between one json file
+# per image (meta/*.json) and the single file store (meta.sqlite), and
+# optionally benchmark loading / saving both ways.
+
+import argparse
+import os
+import shutil
+import time
+
+import sys
+sys.path.append('../lib')
+import MetaStore
+import ProjectMgr
+import Trace
+
+parser = argparse.ArgumentParser(description='Convert the image meta info storage.')
+parser.add_argument('--project', required=True, help='project work directory')
+group = parser.add_mutually_exclusive_group()
+group.add_argument('--to-store', action='store_true', help='move the image meta info into the single file store')
+group.add_argument('--to-json', action='store_true', help='move the image meta info back to one json file per image')
+parser.add_argument('--benchmark', action='store_true', help='time loading and saving the image meta info both ways (on a scratch copy inside the project directory)')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
+args = parser.parse_args()
+Trace.start(args.trace)
+
+def timed(func):
+    t0 = time.time()
+    result = func()
+    return result, time.time() - t0
+
+def benchmark(proj):
+    # scratch copy of the config and image meta json files, on the same
+    # file system as the project
+    project_dir = proj.project_dir
+    scratch = os.path.join(project_dir, 'meta-benchmark')
+    if os.path.exists(scratch):
+        shutil.rmtree(scratch)
+    os.makedirs(os.path.join(scratch, 'meta'))
+    shutil.copy(os.path.join(project_dir, 'config.json'), scratch)
+    proj.project_dir = scratch
+    proj.export_images_json()
+    proj.project_dir = project_dir
+    n = len(proj.image_list)
+
+    report = []
+    for mode in [ 'json', 'store' ]:
+        proj = ProjectMgr.ProjectMgr(scratch)
+        if mode == 'store':
+            proj.load_images_info()
+            proj.export_images_store()
+        result, t_load = timed(proj.load_images_info)
+        count, t_save_all = timed(lambda: proj.save_images_info(force=True))
+        # change a single pose
+        image = proj.image_list[0]
+        ned, ypr, quat = image.get_camera_pose()
+        image.set_camera_pose(ned, ypr[0] + 0.001, ypr[1], ypr[2])
+        count, t_save_one = timed(proj.save_images_info)
+        report.append( [mode, t_load, t_save_all, t_save_one, count] )
+    shutil.rmtree(scratch)
+
+    print('Images:', n)
+    print('%-6s %10s %10s %12s' % ('mode', 'load', 'save all', 'save 1 dirty'))
+    for [mode, t_load, t_save_all, t_save_one, count] in report:
+        print('%-6s %9.3fs %9.3fs %11.3fs  (%d written)' % (mode, t_load, t_save_all, t_save_one, count))
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_images_info()
+print('Images:', len(proj.image_list),
+      '(store)' if MetaStore.exists(args.project) else '(json files)')
+
+if args.to_store:
+    proj.export_images_store()
+    print('Wrote:', MetaStore.path(args.project))
+    print('Note: the meta/*.json files are no longer used while the store exists.')
+elif args.to_json:
+    proj.export_images_json()
+    print('Wrote:', len(proj.image_list), 'json files, removed the store.')
+
+if args.benchmark:
+    benchmark(proj)
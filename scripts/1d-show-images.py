@@ -7,14 +7,17 @@ import argparse
 import sys
 sys.path.append('../lib')
 import ProjectMgr
+import Trace
 
 # for all the images in the project image_dir, detect features using the
 # specified method and parameters
 
 parser = argparse.ArgumentParser(description='Load the project\'s images.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 #print args
 
 proj = ProjectMgr.ProjectMgr(args.project)
@@ -8,6 +8,7 @@ import sys
 sys.path.append('../lib')
 import Pose
 import ProjectMgr
+import Trace
 
 # for all the images in the project image_dir, detect features using the
 # specified method and parameters
@@ -16,8 +17,10 @@ parser = argparse.ArgumentParser(description='Set the aircraft poses from flight
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--sentera', help='use the specified sentera image-metadata.txt file (lat,lon,alt,yaw,pitch,roll)')
 parser.add_argument('--pix4d', help='use the specified pix4d csv file (lat,lon,alt,roll,pitch,yaw)')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 print("Loading image info...")
@@ -17,6 +17,7 @@ import AC3D
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 import transformations
 
 # for all the images in the project image_dir, compute the camera
@@ -30,8 +31,10 @@ parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--texture-resolution', type=int, default=512, help='texture resolution (should be 2**n, so numbers like 256, 512, 1024, etc.')
 parser.add_argument('--ground', type=float, help='ground elevation in meters')
 parser.add_argument('--sba', action='store_true', help='use sba pose')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
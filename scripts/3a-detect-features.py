@@ -10,7 +10,9 @@ import sys
 from props import getNode
 
 sys.path.append('../lib')
+import DescriptorEncoding
 import ProjectMgr
+import Trace
 
 # for all the images in the project image_dir, detect features using the
 # specified method and parameters
@@ -46,11 +48,19 @@ parser.add_argument('--star-line-threshold-projected', default=10)
 parser.add_argument('--star-line-threshold-binarized', default=8)
 parser.add_argument('--star-suppress-nonmax-size', default=5)
 parser.add_argument('--reject-margin', default=0, help='reject features within this distance of the image margin')
+parser.add_argument('--encoding', default='native', choices=['native', 'uint8', 'float16'],
+                    help='store SIFT/SURF descriptors in a compact encoding (uint8: SIFT only, lossless)')
 
 parser.add_argument('--show', action='store_true',
                     help='show features as we detect them')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
+
+if not DescriptorEncoding.supported(args.encoding, args.detector):
+    print('The', args.encoding, 'encoding is not supported for', args.detector, 'descriptors')
+    quit()
 
 proj = ProjectMgr.ProjectMgr(args.project)
 
@@ -61,6 +71,7 @@ proj.load_images_info()
 detector_node = getNode('/config/detector', True)
 detector_node.setString('detector', args.detector)
 detector_node.setString('scale', args.scale)
+detector_node.setString('descriptor_encoding', args.encoding)
 if args.detector == 'SIFT':
     detector_node.setInt('sift_max_features', args.sift_max_features)
 elif args.detector == 'SURF':
@@ -81,7 +92,9 @@ elif args.detector == 'Star':
                          args.star_suppress_nonmax_size)
 
 # find features in the full image set
-proj.detect_features(scale=args.scale, show=args.show)
+# (the descriptor store is updated after the margin filter below)
+processed = proj.detect_features(scale=args.scale, show=args.show,
+                                 update_store=False)
 
 # I don't know if I want to mess around with undistorting keypoints at
 # this stage.
@@ -119,6 +132,7 @@ if True:
         #print image.name, len(image.kp_list), image.des_list.size
         bar.next()
     bar.finish()
+    proj.update_descriptor_store(processed)
     
 feature_count = 0
 image_count = 0
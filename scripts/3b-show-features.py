@@ -9,6 +9,7 @@ import os.path
 
 sys.path.append('../lib')
 import ProjectMgr
+import Trace
 
 # for all the images in the project image_dir, detect features using the
 # specified method and parameters
@@ -17,8 +18,10 @@ parser = argparse.ArgumentParser(description='Load the project\'s images.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--image', help='show specific image')
 parser.add_argument('--index', type=int, help='show specific image by index')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 #print args
 
 proj = ProjectMgr.ProjectMgr(args.project)
@@ -19,13 +19,16 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 
 # undistort and project keypoints and cull any the blow up in the fringes
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+# Build (or rebuild) the project wide descriptor store: every image's
+# descriptors in one memory mapped matrix (descriptors.bin, indexed by
+# descriptors.json.)  When the store exists, matching reads the
+# descriptors from it instead of the per image .desc.npy files, and
+# detecting features appends new images to it.
+
+import argparse
+import os
+import time
+
+from props import getNode
+
+import sys
+sys.path.append('../lib')
+import DescriptorEncoding
+import DescriptorStore
+import ProjectMgr
+import Trace
+
+parser = argparse.ArgumentParser(description='Build the project descriptor store.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--encoding', default='native', choices=DescriptorEncoding.encodings,
+                    help='store the (SIFT/SURF) descriptors in a compact encoding (uint8: SIFT only)')
+parser.add_argument('--pca-dims', type=int, default=64, help='pca encoding: number of dimensions to keep')
+parser.add_argument('--remove', action='store_true', help='remove the store (go back to the per image files)')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
+args = parser.parse_args()
+Trace.start(args.trace)
+
+if args.remove:
+    for name in [ DescriptorStore.store_file, DescriptorStore.index_file,
+                  DescriptorStore.pca_file ]:
+        path = os.path.join(args.project, name)
+        if os.path.exists(path):
+            os.remove(path)
+            print('Removed:', path)
+    quit()
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_images_info()
+
+detector = getNode('/config/detector', True).getString('detector')
+if not DescriptorEncoding.supported(args.encoding, detector):
+    print('The', args.encoding, 'encoding is not supported for', detector, 'descriptors')
+    quit()
+
+t_start = time.time()
+store = DescriptorStore.convert(args.project, proj.image_list,
+                                args.encoding, args.pca_dims)
+index = store.index
+size = os.path.getsize(store.path) if os.path.exists(store.path) else 0
+print('Images:', len(store), ' descriptors:', index['rows'],
+      ' dim:', index['dim'], ' dtype:', index['dtype'],
+      ' encoding:', index['encoding'])
+print('Wrote: %s (%.1f MB) in %.1f sec' % (store.path, size / (1024.0 * 1024.0),
+                                          time.time() - t_start))
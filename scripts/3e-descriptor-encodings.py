@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# Compare the compact descriptor encodings (see lib/DescriptorEncoding)
+# on a sample of nearby image pairs: for each encoding run the regular
+# pair matching (Matcher.basic_matches(), both directions) and report
+# the resulting (gms inlier, aligned) match counts, the descriptor
+# memory and the matching wall time relative to the native encoding.
+
+import argparse
+import contextlib
+import io
+import numpy as np
+import time
+
+from props import getNode
+
+import sys
+sys.path.append('../lib')
+import DescriptorEncoding
+import DescriptorStore
+import Matcher
+import ProjectMgr
+import Trace
+
+parser = argparse.ArgumentParser(description='Benchmark the descriptor encodings.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--pairs', type=int, default=20, help='number of image pairs to match')
+parser.add_argument('--max-dist', type=float, default=75, help='maximum camera distance of a pair')
+parser.add_argument('--matcher', default='FLANN', choices=['FLANN', 'BF'])
+parser.add_argument('--pca-dims', type=int, default=64, help='pca encoding: number of dimensions to keep')
+parser.add_argument('--encodings', default=','.join(DescriptorEncoding.encodings), help='comma separated list of encodings to compare')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
+args = parser.parse_args()
+Trace.start(args.trace)
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_images_info()
+proj.load_features()
+proj.undistort_keypoints()
+
+# the closest image pairs
+work_list = []
+for i, i1 in enumerate(proj.image_list):
+    ned1, ypr1, q1 = i1.get_camera_pose()
+    for j in range(i+1, len(proj.image_list)):
+        ned2, ypr2, q2 = proj.image_list[j].get_camera_pose()
+        dist = np.linalg.norm(np.array(ned2) - np.array(ned1))
+        if dist <= args.max_dist:
+            work_list.append( [dist, i, j] )
+work_list = sorted(work_list, key=lambda fields: fields[0])[:args.pairs]
+used = sorted(set([ i for [d, i, j] in work_list ] + [ j for [d, i, j] in work_list ]))
+images = [ proj.image_list[i] for i in used ]
+print('Pairs:', len(work_list), ' images:', len(images))
+
+native = {}
+for image in images:
+    native[image.name] = DescriptorStore.load_file(image)
+
+getNode('/config/matcher', True).setString('matcher', args.matcher)
+m = Matcher.Matcher()
+m.configure()
+
+detector = getNode('/config/detector', True).getString('detector')
+report = []
+for encoding in args.encodings.split(','):
+    if not DescriptorEncoding.supported(encoding, detector):
+        print('Skipping', encoding, '(not supported for', detector, 'descriptors)')
+        continue
+    pca = None
+    if encoding == 'pca':
+        pca = DescriptorStore.sample_pca(images, args.pca_dims)
+    nbytes = 0
+    for image in images:
+        image.des_list = DescriptorEncoding.encode(native[image.name], encoding, pca)
+        if image.des_list is not None:
+            nbytes += image.des_list.nbytes
+    counts = []
+    t_start = time.time()
+    for [dist, i, j] in work_list:
+        i1 = proj.image_list[i]
+        i2 = proj.image_list[j]
+        # (the matcher is chatty)
+        with contextlib.redirect_stdout(io.StringIO()):
+            pairs1 = m.basic_matches(i1, i2)
+            pairs2 = m.basic_matches(i2, i1)
+        counts.append(len(pairs1) + len(pairs2))
+    report.append( [encoding, nbytes, time.time() - t_start, counts] )
+for image in images:
+    image.des_list = None
+
+print('%-8s %10s %10s %10s %10s' % ('encoding', 'memory', 'time', 'matches', 'vs first'))
+base = report[0][3]
+for [encoding, nbytes, secs, counts] in report:
+    ratio = np.sum(counts) / max(1, np.sum(base))
+    print('%-8s %8.1fMB %9.2fs %10d %9.1f%%' %
+          (encoding, nbytes / (1024.0 * 1024.0), secs, np.sum(counts),
+           100.0 * ratio))
@@ -13,6 +13,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 
 # working on matching features ...
 
@@ -28,13 +29,20 @@ parser.add_argument('--max-dist', default=75, type=float,
                     help='maximum 2d camera distance for pair comparison')
 parser.add_argument('--filter', default='essential',
                     choices=['gms', 'homography', 'fundamental', 'essential', 'none'])
+parser.add_argument('--desc-cache-mb', default=2048, type=float,
+                    help='memory budget for the descriptors held at once (MB)')
+parser.add_argument('--desc-mmap', action='store_true',
+                    help='memory map the descriptor files')
 #parser.add_argument('--ground', type=float, help='ground elevation in meters')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
-proj.load_features(descriptors=True)
+proj.load_features(descriptors=True, desc_cache_mb=args.desc_cache_mb,
+                   desc_mmap=args.desc_mmap)
 proj.undistort_keypoints()
 proj.load_match_pairs()
 
@@ -55,7 +63,8 @@ print("K:", K)
 # fire up the matcher
 m = Matcher.Matcher()
 m.configure()
-m.robustGroupMatches(proj.image_list, K, filter=args.filter, review=False)
+m.robustGroupMatches(proj.image_list, K, filter=args.filter, review=False,
+                     desc_cache=proj.desc_cache)
 
 # The following code is deprecated ...
 do_old_match_consolodation = False
@@ -4,18 +4,24 @@
 # connections to each other cannot be correctly placed.
 
 import argparse
-import pickle
 import os.path
 import sys
 
 sys.path.append('../lib')
+import Cleaning
 import Groups
 import ProjectMgr
+import Trace
+import Tracks
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--original-pairs', action='store_true', help='use original pair-rwise matches')
+parser.add_argument('--components', action='store_true', help='group by connected components of the image pair graph (fast, for large projects.)')
+parser.add_argument('--min-pairs', type=int, default=25, help='minimum number of shared features to connect two images (--components mode)')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -25,39 +31,34 @@ proj.load_images_info()
 #source = 'matches_direct'
 source = 'matches_grouped'
 print("Loading source matches:", source)
-matches = pickle.load( open( os.path.join(args.project, source), 'rb' ) )
+if args.components:
+    tracks = Tracks.read(args.project, source)
+else:
+    # (the feature connection grouping needs the match list itself)
+    matches = Tracks.read_list(args.project, source)
+    tracks = Tracks.pack(matches)
+
+print("features:", len(tracks))
 
-print("features:", len(matches))
+# image pair connection counts (sparse, symmetric)
+pair_counts = Groups.pairCounts(tracks, len(proj.image_list))
+print("connected image pairs:", pair_counts.nnz // 2)
 
-if not args.original_pairs:
+# (the per image match lists are only needed by the feature
+# connection grouping)
+if not args.components and not args.original_pairs:
     # recreate the pair-wise match structure
-    matches_list = pickle.load( open( os.path.join(args.project, "matches_direct"), "rb" ) )
-    for i1 in proj.image_list:
-        i1.match_list = []
-        for i2 in proj.image_list:
-            i1.match_list.append([])
-    for match in matches_list:
-        for p1 in match[1:]:
-            for p2 in match[1:]:
-                if p1 == p2:
-                    pass
-                else:
-                    i = p1[0]
-                    j = p2[0]
-                    image = proj.image_list[i]
-                    image.match_list[j].append( [p1[1], p2[1]] )
-    # for i in range(len(proj.image_list)):
-    #     print(len(proj.image_list[i].match_list))
-    #     print(proj.image_list[i].match_list)
-    #     for j in range(len(proj.image_list)):
-    #         print(i, j, len(proj.image_list[i].match_list[j]),
-    #               proj.image_list[i].match_list[j])
-else:
+    matches_list = Tracks.read_list(args.project, "matches_direct")
+    Cleaning.pair_match_lists(proj, matches_list)
+elif not args.components:
     proj.load_match_pairs(extra_verbose=False)
 
 # compute the group connections within the image set.
 
-groups = Groups.groupByFeatureConnections(proj.image_list, matches)
+if args.components:
+    groups = Groups.groupByConnectedComponents(pair_counts, args.min_pairs)
+else:
+    groups = Groups.groupByFeatureConnections(proj.image_list, matches)
 
 #groups = Groups.groupByConnectedArea(proj.image_list, matches)
 
@@ -74,21 +75,11 @@ print('Main group size:', len(groups[0]))
 # that will show all the match connectivity in the set.
 file = os.path.join(args.project, 'connections.gnuplot')
 f = open(file, 'w')
-pair_dict = {}
-for match in matches:
-    for m1 in match[1:]:
-        for m2 in match[1:]:
-            if m1[0] == m2[0]:
-                # skip selfies
-                continue
-            key = '%d %d' % (m1[0], m2[0])
-            pair_dict[key] = [m1[0], m2[0]]
-for pair in pair_dict:
-    #print 'pair:', pair, pair_dict[pair]
-    image1 = proj.image_list[pair_dict[pair][0]]
-    image2 = proj.image_list[pair_dict[pair][1]]
-    (ned1, ypr1, quat1) = image1.get_camera_pose()
-    (ned2, ypr2, quat2) = image2.get_camera_pose()
+pairs = pair_counts.tocoo()
+cam_ned = proj.get_poses().ned
+for i, j in zip(pairs.row, pairs.col):
+    ned1 = cam_ned[i]
+    ned2 = cam_ned[j]
     f.write("%.2f %.2f\n" % (ned1[1], ned1[0]))
     f.write("%.2f %.2f\n" % (ned2[1], ned2[0]))
     f.write("\n")
@@ -4,7 +4,6 @@
 # connectivity in the image set.
 
 import argparse
-import pickle
 import os.path
 import sys
 
@@ -13,19 +12,21 @@ import pygraphviz as pgv
 sys.path.append('../lib')
 import Groups
 import ProjectMgr
+import Trace
+import Tracks
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
-proj.load_features()
-proj.undistort_keypoints()
 
 # no! (maybe?)
 print("Loading direct matches...")
-matches = pickle.load( open( os.path.join(args.project, 'matches_direct'), 'rb' ) )
+tracks = Tracks.read(args.project, 'matches_direct')
 
 #print("Loading grouped matches...")
 #matches = pickle.load( open( os.path.join(args.project, 'matches_grouped'), 'rb' ) )
@@ -33,14 +34,10 @@ matches = pickle.load( open( os.path.join(args.project, 'matches_direct'), 'rb'
 
 A = pgv.AGraph()
 
-for match in matches:
-    for m1 in match[1:]:
-        for m2 in match[1:]:
-            if m1 == m2:
-                continue
-            i1 = proj.image_list[m1[0]]
-            i2 = proj.image_list[m2[0]]
-            A.add_edge(i1.name, i2.name)
+# every image pair sharing a track
+index = Tracks.PairIndex(tracks, len(proj.image_list))
+for i, j in zip(*index.pairs()):
+    A.add_edge(proj.image_list[i].name, proj.image_list[j].name)
 
 A.layout()
 
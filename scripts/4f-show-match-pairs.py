@@ -12,6 +12,7 @@ sys.path.append('../lib')
 import Matcher
 import Pose
 import ProjectMgr
+import Trace
 
 # working on matching features ...
 
@@ -27,7 +28,9 @@ parser.add_argument('--image', default="", help='show specific image matches')
 parser.add_argument('--index', type=int, help='show specific image by index')
 parser.add_argument('--direct', action='store_true', help='show matches_direct')
 parser.add_argument('--sba', action='store_true', help='show matches_sba')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
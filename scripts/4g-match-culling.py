@@ -1,82 +1,58 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-import sys
-sys.path.insert(0, "/usr/local/lib/python2.7/site-packages/")
+# Remove all the features and matches from images that are not part
+# of the primary (connected) image group.
 
 import argparse
-import commands
-import cPickle as pickle
-import cv2
-import fnmatch
-import math
 import numpy as np
-import os.path
-from progress.bar import Bar
-import scipy.spatial
+import os
+import pickle
 
+import sys
 sys.path.append('../lib')
-import Matcher
-import Pose
+import Cleaning
+import Groups
 import ProjectMgr
+import Trace
+import Tracks
 
-# working on matching features ...
+import match_culling as cull
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--yes', action='store_true', help='remove the non-group features without asking')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
-proj.load_image_info()
-proj.load_features()
-proj.load_match_pairs()
-
-print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
-print "Total unique features =", len(matches_direct)
+proj.load_images_info()
 
-print "Generating match pairs"
-match_pairs = proj.generate_match_pairs(matches_direct)
+print("Loading original (direct) matches ...")
+matches_direct = pickle.load( open( os.path.join(args.project, "matches_direct"), "rb" ) )
+print("Total unique features =", len(matches_direct))
 
-group_list = Matcher.groupByConnections(proj.image_list, matches_direct, match_pairs)
-
-# group_list[0] should be the primary collection of connected images.
+# groups[0] should be the primary collection of connected images.
 # The rest need to get removed and ignored from the solution
-remove_dict = {}
-for group in group_list[1:]:
-    for image in group:
-        i = proj.findIndexByName(image.name)
-        remove_dict[i] = True
-print "Removing all features and matches from the following images."
-print "These are not part of the primary group."
-print remove_dict
+groups = Groups.load(args.project)
+main_group = groups[0] if len(groups) else []
+print("Removing all features and matches from the following images.")
+print("These are not part of the primary group.")
+print([ image.name for i, image in enumerate(proj.image_list) if not i in set(main_group) ])
 
-# mark any features in the weak images list
-mark_sum = 0
-for i, match in enumerate(matches_direct):
-    #print 'before:', match
-    for j, p in enumerate(match[1:]):
-        if p[0] in remove_dict:
-             match[j+1] = [-1, -1]
-             mark_sum += 1
-    #print 'after:', match
+# mark any features in the non-group images
+tracks = Tracks.pack(matches_direct)
+mark_mask = Cleaning.ungrouped_mask(tracks, main_group, len(proj.image_list))
+mark_sum = np.count_nonzero(mark_mask)
 
 if mark_sum > 0:
-    result=raw_input('Remove ' + str(mark_sum) + ' non-group features from the original matches? (y/n):')
+    if args.yes:
+        result = 'y'
+    else:
+        result = input('Remove ' + str(mark_sum) + ' non-group features from the original matches? (y/n):')
     if result == 'y' or result == 'Y':
-        print " deleting marked items..."
-        for i in reversed(range(len(matches_direct))):
-            match_direct = matches_direct[i]
-            has_bad_elem = False
-            for j in reversed(range(1, len(match_direct))):
-                p = match_direct[j]
-                if p == [-1, -1]:
-                    has_bad_elem = True
-                    match_direct.pop(j)
-            if len(match_direct) < 3:
-                print "deleting match that is now in less than 2 images:", match_direct
-                matches_direct.pop(i)
+        cull.delete_masked_matches(matches_direct, mark_mask)
         # write out the updated match dictionaries
-        print "Writing direct matches..."
-        pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
-
+        print("Writing direct matches...")
+        pickle.dump(matches_direct, open(os.path.join(args.project, "matches_direct"), "wb"))
@@ -5,6 +5,7 @@
 # collective data set.
 
 import argparse
+import json
 import pickle
 import cv2
 import math
@@ -14,18 +15,41 @@ import sys
 
 sys.path.append('../lib')
 import Groups
+import Image
+import Incremental
 import Optimizer
 import ProjectMgr
+import Submaps
+import Trace
 import transformations
 
+import match_culling as cull
+
 d2r = math.pi / 180.0
 r2d = 180.0 / math.pi
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--refine', action='store_true', help='refine a previous optimization.')
+parser.add_argument('--incremental', action='store_true', help='extend the previous optimization (matches_opt + optimized poses) with newly added images instead of solving from scratch.')
+parser.add_argument('--polish-nfev', type=int, default=0, help='incremental mode: function evaluations for a final global polish (0 = no polish.)')
+parser.add_argument('--compare-full', action='store_true', help='incremental mode: also run a full optimization from scratch and report its error and time (results are not saved.)')
+parser.add_argument('--submap-cameras', type=int, help='partitioned mode: split the main group into spatial submaps with at most this many cameras each.')
+parser.add_argument('--submap-align', action='store_true', help='partitioned mode: refit each optimized submap onto the original camera locations (useful when the submaps share very few features.)')
+parser.add_argument('--workers', type=int, help='number of worker processes for the submap solves (default: one per cpu)')
+parser.add_argument('--loss', default='linear', choices=['linear', 'huber', 'soft_l1', 'cauchy', 'arctan'], help='robust loss function.')
+parser.add_argument('--f-scale', type=float, default=1.0, help='robust loss scale (pixels.)')
+parser.add_argument('--outlier-rounds', type=int, default=0, help='number of in-memory outlier rejection rounds (removed observations are also deleted from the match files; not with --submap-cameras or --incremental.)')
+parser.add_argument('--outlier-sigma', type=float, default=5.0, help='outlier threshold in robust stddevs above the median reprojection error.')
+parser.add_argument('--compare-monolithic', action='store_true', help='also run a single full optimization and report its error next to the partitioned result (results are not saved.)')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
+
+if args.outlier_rounds > 0 and (args.submap_cameras or args.incremental):
+    print('--outlier-rounds is only supported by the standard (single) optimization, not with --submap-cameras or --incremental')
+    quit()
 
 # return a 3d affine tranformation between current camera locations
 # and original camera locations.
@@ -71,7 +95,13 @@ proj.load_images_info()
 source_file = os.path.join(args.project, 'matches_grouped' )
 #source_file = os.path.join(args.project, 'matches_direct' )
 opt_file = os.path.join(args.project, 'matches_opt')
-if args.refine and os.path.isfile( opt_file ):
+if args.incremental:
+    print('Match file:', source_file)
+    matches = pickle.load( open(source_file, "rb") )
+    print('Previous optimized match file:', opt_file)
+    matches_prev = pickle.load( open(opt_file, "rb") )
+    names_prev = Incremental.load_image_names(proj)
+elif args.refine and os.path.isfile( opt_file ):
     print('Match file:', opt_file)
     matches = pickle.load( open(opt_file, "rb") )
 elif os.path.isfile( source_file ):
@@ -87,14 +117,25 @@ print('Match features:', len(matches))
 groups = Groups.load(args.project)
 print('Main group size:', len(groups[0]))
 
-opt = Optimizer.Optimizer(args.project)
-opt.setup( proj, groups[0], matches, optimized=args.refine )
-cameras, features, cam_index_map, feat_index_map, fx_opt, fy_opt, cu_opt, cv_opt, distCoeffs_opt = opt.run()
+if args.incremental:
+    cameras, features, cam_index_map, feat_index_map, fx_opt, fy_opt, cu_opt, cv_opt, distCoeffs_opt = Incremental.run(proj, groups[0], matches, matches_prev, names_prev, polish_nfev=args.polish_nfev, compare=args.compare_full, loss=args.loss, f_scale=args.f_scale)
+elif args.submap_cameras:
+    submaps = Submaps.partition_by_ned(proj, groups[0], args.submap_cameras)
+    cameras, features, cam_index_map, feat_index_map, fx_opt, fy_opt, cu_opt, cv_opt, distCoeffs_opt = Submaps.run(proj, groups[0], matches, submaps, optimized=args.refine, workers=args.workers, align=args.submap_align, compare=args.compare_monolithic, loss=args.loss, f_scale=args.f_scale)
+else:
+    opt = Optimizer.Optimizer(args.project)
+    opt.loss = args.loss
+    opt.f_scale = args.f_scale
+    opt.outlier_rounds = args.outlier_rounds
+    opt.outlier_sigma = args.outlier_sigma
+    opt.setup( proj, groups[0], matches, optimized=args.refine )
+    cameras, features, cam_index_map, feat_index_map, fx_opt, fy_opt, cu_opt, cv_opt, distCoeffs_opt = opt.run()
 
 # mark all the optimized poses as invalid
 for image in proj.image_list:
     opt_cam_node = image.node.getChild('camera_pose_opt', True)
     opt_cam_node.setBool('valid', False)
+Image.poses_changed()
 
 for i, cam in enumerate(cameras):
     image_index = cam_index_map[i]
@@ -230,9 +271,34 @@ else:
         match = matches_opt[match_index]
         match[0] = feat
 
+# apply the observations culled during optimization to both match
+# lists (same convention as the 5c outlier scripts) and write a summary
+if not args.submap_cameras and not args.incremental and len(opt.outliers):
+    matches_orig = pickle.load( open(source_file, "rb") )
+    summary = { 'rounds': opt.outlier_log, 'images': {}, 'outliers': [] }
+    for [match_index, image_index, error] in opt.outliers:
+        match = matches_opt[match_index]
+        for k, p in enumerate(match[1:]):
+            if p[0] == image_index:
+                cull.mark_outlier(matches_orig, match_index, k, error)
+                cull.mark_outlier(matches_opt, match_index, k, error)
+                break
+        name = proj.image_list[image_index].name
+        summary['images'][name] = summary['images'].get(name, 0) + 1
+        summary['outliers'].append( [match_index, name, error] )
+    summary_file = os.path.join(args.project, 'optimizer-outliers.json')
+    print('Writing outlier summary:', summary_file)
+    with open(summary_file, 'w') as fd:
+        json.dump(summary, fd, indent=4, sort_keys=True)
+    cull.delete_marked_matches(matches_orig)
+    cull.delete_marked_matches(matches_opt)
+    print('Writing:', source_file)
+    pickle.dump(matches_orig, open(source_file, 'wb'))
+
 # write out the updated match_dict
 print('Writing matches_opt file:', len(matches_opt), 'features')
 pickle.dump(matches_opt, open(os.path.join(args.project, 'matches_opt'), 'wb'))
+Incremental.save_image_names(proj)
 
 #proj.cam.set_K(fx_opt/scale[0], fy_opt/scale[0], cu_opt/scale[0], cv_opt/scale[0], optimized=True)
 #proj.save()
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+
+# Run a sequence of the match cleaning, grouping and optimization steps
+# (4b, 4d, 4e, 4g, 5a, 5c) against one in-memory copy of the project.
+# The project, features and match files are loaded once (when a stage
+# first needs them), the stages share the match lists and their packed
+# track arrays, and the results are only written at the end (or by a
+# 'checkpoint' stage.)  Per stage timings are printed at the end and
+# written to pipeline-timings.json.
+#
+# stages:
+#   reset        4b: new matches_direct from the match pairs
+#   group        4d: matches_grouped from matches_direct
+#   groups       4e: image groups (see --components)
+#   cull-groups  4g: drop the observations outside the main group
+#   optimize     5a: optimize the main group -> matches_opt, poses
+#   triangulate  re-triangulate matches_opt from the optimized poses
+#                (batched DLT, see lib/Triangulate.py) and drop the
+#                tracks behind a camera or under --min-angle
+#   mre          5c-mre-by-feature3: drop reprojection error outliers
+#   surface      5c-surface-outliers3: drop surface outliers (repeated
+#                until nothing more is found)
+#   checkpoint   write everything modified so far
+
+import argparse
+import json
+import numpy as np
+import os
+import pickle
+import time
+
+import sys
+sys.path.append('../lib')
+import Cleaning
+import Groups
+import Image
+import Incremental
+import Optimizer
+import ProjectMgr
+import Submaps
+import Trace
+import Tracks
+import Triangulate
+
+import match_culling as cull
+
+parser = argparse.ArgumentParser(description='Run a chain of cleaning stages in memory.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--stages', default='reset,group,groups,cull-groups,optimize,mre,optimize', help='comma separated list of stages to run in order.')
+parser.add_argument('--ground', type=float, help='reset: ground elevation in meters')
+parser.add_argument('--components', action='store_true', help='groups: group by connected components of the image pair graph.')
+parser.add_argument('--min-pairs', type=int, default=25, help='groups: minimum number of shared features to connect two images (--components mode)')
+parser.add_argument('--refine', action='store_true', help='optimize: start from the current optimized poses and features.')
+parser.add_argument('--loss', default='linear', choices=['linear', 'huber', 'soft_l1', 'cauchy', 'arctan'], help='optimize: robust loss function.')
+parser.add_argument('--f-scale', type=float, default=1.0, help='optimize: robust loss scale (pixels.)')
+parser.add_argument('--outlier-rounds', type=int, default=0, help='optimize: number of in-memory outlier rejection rounds.')
+parser.add_argument('--outlier-sigma', type=float, default=5.0, help='optimize: outlier threshold in robust stddevs above the median reprojection error.')
+parser.add_argument('--min-angle', type=float, default=1.0, help='triangulate: minimum triangulation angle (degrees) of a track')
+parser.add_argument('--mre-stddev', type=float, default=5, help='mre: how many stddevs above the mean for discarding features')
+parser.add_argument('--surface-stddev', type=float, default=5, help='surface: standard dev threshold')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
+args = parser.parse_args()
+Trace.start(args.trace)
+
+match_files = [ 'matches_direct', 'matches_grouped', 'matches_opt' ]
+
+# The shared project state.  Match lists are loaded on first use and
+# written (by save()) only if a stage replaced or modified them.
+class State():
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.proj = ProjectMgr.ProjectMgr(project_dir)
+        self.proj.load_images_info()
+        self.matches = {}
+        self.packed = {}
+        self.groups = None
+        self.features = False
+        self.dirty = set()
+
+    def has(self, name):
+        return name in self.matches or \
+            os.path.isfile(os.path.join(self.project_dir, name)) or \
+            Tracks.is_current(self.project_dir, name)
+
+    def get(self, name):
+        if not name in self.matches:
+            print("Loading:", name)
+            self.matches[name] = Tracks.read_list(self.project_dir, name)
+        return self.matches[name]
+
+    # replace (or mark as modified) a match list
+    def put(self, name, matches):
+        self.matches[name] = matches
+        self.packed.pop(name, None)
+        self.dirty.add(name)
+
+    # packed tracks of a match list (cached until the list changes,
+    # read from the columnar copy if the list hasn't been loaded)
+    def tracks(self, name):
+        if not name in self.packed:
+            if name in self.matches:
+                self.packed[name] = Tracks.pack(self.matches[name])
+            else:
+                print("Loading:", name, "(tracks)")
+                self.packed[name] = Tracks.read(self.project_dir, name)
+        return self.packed[name]
+
+    def get_groups(self):
+        if self.groups is None:
+            self.groups = Groups.load(self.project_dir)
+        return self.groups
+
+    def load_features(self):
+        if not self.features:
+            self.proj.load_features()
+            self.proj.undistort_keypoints()
+            self.features = True
+
+    # delete the masked observations from the grouped and optimized
+    # match lists (which share the same layout.)  Both are loaded if
+    # they exist, a stage may have only looked at the packed tracks.
+    def delete_masked(self, mask):
+        for name in [ 'matches_grouped', 'matches_opt' ]:
+            if self.has(name):
+                cull.delete_masked_matches(self.get(name), mask)
+                self.put(name, self.matches[name])
+
+    def save(self):
+        for name in match_files:
+            if name in self.dirty:
+                print("Writing:", name, len(self.matches[name]), 'features')
+                pickle.dump(self.matches[name],
+                            open(os.path.join(self.project_dir, name), "wb"))
+        if 'matches_opt' in self.dirty:
+            Incremental.save_image_names(self.proj)
+        if 'groups' in self.dirty:
+            Groups.save(self.project_dir, self.groups)
+        if 'images' in self.dirty:
+            self.proj.save_images_info()
+        if 'config' in self.dirty:
+            self.proj.save()
+        self.dirty = set()
+
+def reset(state):
+    state.load_features()
+    state.proj.load_match_pairs(extra_verbose=False)
+    state.put('matches_direct',
+              Cleaning.reset_matches(state.proj, ground=args.ground))
+
+def group(state):
+    state.load_features()
+    state.put('matches_grouped',
+              Cleaning.group_chains(state.proj, state.get('matches_direct')))
+
+def image_groups(state):
+    proj = state.proj
+    if args.components:
+        pair_counts = Groups.pairCounts(state.tracks('matches_grouped'),
+                                        len(proj.image_list))
+        groups = Groups.groupByConnectedComponents(pair_counts, args.min_pairs)
+    else:
+        Cleaning.pair_match_lists(proj, state.get('matches_direct'))
+        groups = Groups.groupByFeatureConnections(proj.image_list,
+                                                  state.get('matches_grouped'))
+    groups.sort(key=len, reverse=True)
+    print('Main group size:', len(groups[0]))
+    state.groups = groups
+    state.dirty.add('groups')
+
+def cull_groups(state):
+    n_images = len(state.proj.image_list)
+    main_group = state.get_groups()[0]
+    if state.has('matches_direct'):
+        mask = Cleaning.ungrouped_mask(state.tracks('matches_direct'),
+                                       main_group, n_images)
+        print('Non-group features (direct):', np.count_nonzero(mask))
+        cull.delete_masked_matches(state.get('matches_direct'), mask)
+        state.put('matches_direct', state.get('matches_direct'))
+    state.get('matches_grouped')
+    mask = Cleaning.ungrouped_mask(state.tracks('matches_grouped'),
+                                   main_group, n_images)
+    print('Non-group features (grouped):', np.count_nonzero(mask))
+    state.delete_masked(mask)
+
+def optimize(state):
+    proj = state.proj
+    main_group = state.get_groups()[0]
+    if args.refine and state.has('matches_opt'):
+        matches = state.get('matches_opt')
+    else:
+        matches = state.get('matches_grouped')
+    opt = Optimizer.Optimizer(state.project_dir)
+    opt.loss = args.loss
+    opt.f_scale = args.f_scale
+    opt.outlier_rounds = args.outlier_rounds
+    opt.outlier_sigma = args.outlier_sigma
+    opt.setup( proj, main_group, matches, optimized=args.refine )
+    cameras, features, cam_index_map, feat_index_map, fx_opt, fy_opt, cu_opt, cv_opt, distCoeffs_opt = opt.run()
+
+    # mark all the optimized poses as invalid, then update the
+    # optimized ones
+    for image in proj.image_list:
+        image.node.getChild('camera_pose_opt', True).setBool('valid', False)
+    Image.poses_changed()
+    for i, cam in enumerate(cameras):
+        image = proj.image_list[cam_index_map[i]]
+        Submaps.set_optimized_pose(image, cam)
+        image.placed = True
+    proj.cam.set_K(fx_opt, fy_opt, cu_opt, cv_opt, optimized=True)
+    proj.cam.set_dist_coeffs(distCoeffs_opt.tolist(), optimized=True)
+    state.dirty.add('images')
+    state.dirty.add('config')
+
+    # new matches_opt (the observation lists are shared with the
+    # source, the 3d locations are not)
+    matches_opt = [ [ match[0] ] + match[1:] for match in matches ]
+    for i, feat in enumerate(features):
+        matches_opt[feat_index_map[i]][0] = list(feat)
+    state.put('matches_opt', matches_opt)
+
+    # observations rejected during the optimization
+    if len(opt.outliers):
+        marks = []
+        for [match_index, image_index, error] in opt.outliers:
+            for k, p in enumerate(matches_opt[match_index][1:]):
+                if p[0] == image_index:
+                    marks.append( [match_index, k] )
+                    break
+        state.delete_masked(cull.mark_mask(matches_opt, marks))
+
+def triangulate(state):
+    proj = state.proj
+    matches = state.get('matches_opt')
+    tracks = state.tracks('matches_opt')
+    # only the observations from images with a valid optimized pose
+    # (the track indices stay the same)
+    posed = proj.get_poses(True).valid
+    posed_tracks = Tracks.compact(tracks, obs_keep=posed[tracks.obs_image])
+    P = Triangulate.projection_matrices(proj, opt=True)
+    K = proj.cam.get_K(optimized=True)
+    distCoeffs = proj.cam.get_dist_coeffs(optimized=True)
+    points, valid, angle = Triangulate.triangulate(posed_tracks, P, K,
+                                                   distCoeffs, args.min_angle)
+    for k in np.nonzero(valid)[0].tolist():
+        matches[k][0] = points[k].tolist()
+    state.put('matches_opt', matches)
+    # tracks seen by fewer than two posed images are left as they are
+    weak = ~valid & (posed_tracks.lengths() >= 2)
+    print('Triangulated:', np.count_nonzero(valid), ' weak (dropped):',
+          np.count_nonzero(weak))
+    state.delete_masked(weak[tracks.obs_track()])
+
+def mre(state):
+    mask = Cleaning.reprojection_outliers(state.proj,
+                                          state.tracks('matches_opt'),
+                                          state.get_groups()[0],
+                                          args.mre_stddev)
+    print('Reprojection outliers:', np.count_nonzero(mask))
+    state.delete_masked(mask)
+
+def surface(state):
+    n_images = len(state.proj.image_list)
+    while True:
+        tracks = state.tracks('matches_opt')
+        outliers, metric = Cleaning.surface_outliers(tracks, n_images,
+                                                     args.surface_stddev)
+        print('Surface outliers:', np.count_nonzero(outliers))
+        if not np.any(outliers):
+            break
+        state.delete_masked(outliers[tracks.obs_track()])
+
+def checkpoint(state):
+    state.save()
+
+stages = { 'reset': reset,
+           'group': group,
+           'groups': image_groups,
+           'cull-groups': cull_groups,
+           'optimize': optimize,
+           'triangulate': triangulate,
+           'mre': mre,
+           'surface': surface,
+           'checkpoint': checkpoint }
+
+sequence = [ name.strip() for name in args.stages.split(',') if name.strip() ]
+for name in sequence:
+    if not name in stages:
+        print('Unknown stage:', name, ' (choose from:', ', '.join(stages), ')')
+        quit()
+
+timings = []
+t_start = time.time()
+state = State(args.project)
+timings.append( ['load', time.time() - t_start] )
+for i, name in enumerate(sequence):
+    print('Stage %d/%d: %s' % (i+1, len(sequence), name))
+    t0 = time.time()
+    stages[name](state)
+    timings.append( [name, time.time() - t0] )
+t0 = time.time()
+state.save()
+timings.append( ['save', time.time() - t0] )
+total = time.time() - t_start
+
+print('Stage timings:')
+for [name, secs] in timings:
+    print('  %-12s %8.2f sec' % (name, secs))
+print('  %-12s %8.2f sec' % ('total', total))
+with open(os.path.join(args.project, 'pipeline-timings.json'), 'w') as fd:
+    json.dump({ 'stages': timings, 'total': total }, fd, indent=4)
@@ -36,6 +36,7 @@ import sys
 sys.path.append('../lib')
 import Groups
 import ProjectMgr
+import Trace
 
 import match_culling as cull
 
@@ -43,8 +44,10 @@ parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--stddev', type=float, default=3, help='how many standard deviations above the mean for auto discarding features')
 parser.add_argument('--interactive', action='store_true', help='interactively review reprojection errors from worst to best and select for deletion or keep.')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -70,6 +73,7 @@ def compute_feature_depths(image_list, group, matches):
     # init structures
     for image in image_list:
         image.z_list = []
+    cam_ned = proj.get_poses(opt=True).ned
         
     # make a list of distances for each feature of each image
     for match in matches:
@@ -83,8 +87,7 @@ def compute_feature_depths(image_list, group, matches):
         for m in match[1:]:
             if m[0] in group:
                 image = image_list[m[0]]
-                cam_ned, ypr, quat = image.get_camera_pose(opt=True)
-                dist = np.linalg.norm(feat_ned - cam_ned)
+                dist = np.linalg.norm(feat_ned - cam_ned[m[0]])
                 image.z_list.append(dist)
 
     # compute stats
@@ -110,8 +113,7 @@ def compute_feature_depths(image_list, group, matches):
             if p[0] in group:
                 image = image_list[p[0]]
                 count += 1
-                cam_ned, ypr, quat = image.get_camera_pose(opt=True)
-                dist = np.linalg.norm(np.array(feat_ned) - np.array(cam_ned))
+                dist = np.linalg.norm(np.array(feat_ned) - cam_ned[p[0]])
                 dist_error = abs(dist - image.z_avg)
                 #dist_metric = dist_error / image.z_std
                 dist_metric = dist_error
@@ -148,63 +150,47 @@ def mark_outliers(error_list, trim_stddev):
 
     # mark match items to delete
     print(" marking outliers...")
-    mark_count = 0
+    mark_list = []
     for line in error_list:
         # print "line:", line
         if line[0] > mean + stddev * trim_stddev:
-            cull.mark_outlier(matches_orig, line[1], line[2], line[0])
-            cull.mark_outlier(matches_opt, line[1], line[2], line[0])
-            mark_count += 1
-            
-    return mark_count
+            mark_list.append( [line[1], line[2]] )
+    return mark_list
 
 error_list = compute_feature_depths(proj.image_list, groups[0], matches_opt)
 
 if args.interactive:
     # interactively pick outliers
     mark_list = cull.show_outliers(error_list, matches_opt, proj.image_list)
-
-    # mark both direct and optimized match lists as requested
-    cull.mark_using_list(mark_list, matches_orig)
-    cull.mark_using_list(mark_list, matches_opt)
-    mark_sum = len(mark_list)
 else:
     # trim outliers by some # of standard deviations high
-    mark_sum = mark_outliers(error_list, args.stddev)
+    mark_list = mark_outliers(error_list, args.stddev)
+
+# one mask marks both the original and optimized match lists
+mark_mask = cull.mark_mask(matches_opt, mark_list)
+mark_sum = len(mark_list)
 
 # after marking the bad matches, now count how many remaining features
 # show up in each image
-for image in proj.image_list:
-    image.feature_count = 0
-for i, match in enumerate(matches_orig):
-    for j, p in enumerate(match[1:]):
-        if p[1] != [-1, -1]:
-            image = proj.image_list[ p[0] ]
-            image.feature_count += 1
-
-# make a dict of all images with less than 25 feature matches
-weak_dict = {}
-for i, img in enumerate(proj.image_list):
-    # print img.name, img.feature_count
-    if img.feature_count > 0 and img.feature_count < 25:
-        weak_dict[i] = True
-print('weak images:', weak_dict)
-
-# mark any features in the weak images list
-for i, match in enumerate(matches_orig):
-    #print 'before:', match
-    for j, p in enumerate(match[1:]):
-        if p[0] in weak_dict:
-             match[j+1] = [-1, -1]
-             mark_sum += 1
-    #print 'after:', match
+obs_image = cull.obs_images(matches_opt)
+feature_count = np.bincount(obs_image[~mark_mask],
+                            minlength=len(proj.image_list))
+for i, image in enumerate(proj.image_list):
+    image.feature_count = feature_count[i]
+
+# mark any features in images with less than 25 feature matches
+weak = (feature_count > 0) & (feature_count < 25)
+print('weak images:', np.nonzero(weak)[0].tolist())
+weak_obs = weak[obs_image] & ~mark_mask
+mark_mask |= weak_obs
+mark_sum += np.count_nonzero(weak_obs)
 
 if mark_sum > 0:
     print('Outliers removed from match lists:', mark_sum)
     result = input('Save these changes? (y/n):')
     if result == 'y' or result == 'Y':
-        cull.delete_marked_matches(matches_orig)
-        cull.delete_marked_matches(matches_opt)
+        cull.delete_masked_matches(matches_orig, mark_mask)
+        cull.delete_masked_matches(matches_opt, mark_mask)
         
         # write out the updated match dictionaries
         print("Writing original matches...")
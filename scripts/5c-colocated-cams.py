@@ -10,6 +10,8 @@ import sys
 sys.path.append('../lib')
 import Groups
 import ProjectMgr
+import Trace
+import Tracks
 
 import match_culling as cull
 
@@ -17,7 +19,9 @@ r2d = 180.0 / math.pi
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -35,62 +39,48 @@ print('Number of optimized features:', len(matches_opt))
 groups = Groups.load(args.project)
 print('Main group size:', len(groups[0]))
 
-pair_angles = []
-for i in range(len(proj.image_list)):
-    p = [ [] for j in range(len(proj.image_list)) ]
-    pair_angles.append(p)
-
-def compute_angle(ned1, ned2, ned3):
-    vec1 = np.array(ned3) - np.array(ned1)
-    vec2 = np.array(ned3) - np.array(ned2)
-    n1 = np.linalg.norm(vec1)
-    n2 = np.linalg.norm(vec2)
-    denom = n1*n2
-    if abs(denom - 0.000001) > 0:
-        try:
-            tmp = np.dot(vec1, vec2) / denom
-            if tmp > 1.0: tmp = 1.0
-            return math.acos(tmp)
-        except:
-            print('vec1:', vec1, 'vec2', vec2, 'dot:', np.dot(vec1, vec2))
-            print('denom:', denom)
-            return 0
-    else:
-        return 0
-    
+# index of the tracks connecting each image pair (built once)
+tracks = Tracks.pack(matches_opt)
+pair_index = Tracks.PairIndex(tracks, len(proj.image_list))
+print('Image pairs:', len(pair_index))
+
+# angle (between the two camera to feature rays) for every observation
+# pair of every image pair within the main group
 print("Computing match pair angles...")
-for match in matches_opt:
-    for m1 in match[1:]:
-        for m2 in match[1:]:
-            if m1[0] >= m2[0]:
-                continue
-            if m1[0] in groups[0] and m2[0] in groups[0]:
-                i1 = proj.image_list[m1[0]]
-                i2 = proj.image_list[m2[0]]
-                ned1, ypr1, q1 = i1.get_camera_pose(opt=True)
-                ned2, ypr2, q2 = i2.get_camera_pose(opt=True)
-                quick_approx = False
-                if quick_approx:
-                    # quick hack angle approximation
-                    avg = (np.array(ned1) + np.array(ned2)) * 0.5
-                    y = np.linalg.norm(np.array(ned2) - np.array(ned1))
-                    x = np.linalg.norm(avg - np.array(match[0]))
-                    angle_deg = math.atan2(y, x) * r2d
-                else:
-                    angle_deg = compute_angle(ned1, ned2, match[0]) * r2d
-                pair_angles[m1[0]][m2[0]].append(angle_deg)
+cam_ned = proj.get_poses(opt=True).ned
+in_group = np.zeros(len(proj.image_list), dtype=bool)
+in_group[groups[0]] = True
+
+image_a = tracks.obs_image[pair_index.obs_a]
+image_b = tracks.obs_image[pair_index.obs_b]
+point = tracks.points[pair_index.track]
+quick_approx = False
+if quick_approx:
+    # quick hack angle approximation
+    avg = (cam_ned[image_a] + cam_ned[image_b]) * 0.5
+    y = np.linalg.norm(cam_ned[image_b] - cam_ned[image_a], axis=1)
+    x = np.linalg.norm(avg - point, axis=1)
+    angle_deg = np.arctan2(y, x) * r2d
+else:
+    vec1 = point - cam_ned[image_a]
+    vec2 = point - cam_ned[image_b]
+    denom = np.linalg.norm(vec1, axis=1) * np.linalg.norm(vec2, axis=1)
+    dot = np.einsum('ij,ij->i', vec1, vec2)
+    tmp = np.divide(dot, denom, out=np.ones(len(dot)), where=denom > 0)
+    angle_deg = np.arccos(np.clip(tmp, -1.0, 1.0)) * r2d
 
 print("Computing per-image statistics...")
+pair_i, pair_j = pair_index.pairs()
+starts = pair_index.offsets[:-1]
+counts = pair_index.counts()
 by_pair = []
-for i in range(len(proj.image_list)):
-    for j in range(len(proj.image_list)):
-        if len(pair_angles[i][j]):
-            angles = np.array(pair_angles[i][j])
-            avg = np.mean(angles)
-            std = np.std(angles)
-            min = np.amin(angles)
-            #print(i, j, 'avg:', avg, 'std:', std, 'min:', min)
-            by_pair.append( [i, j, avg, std, min] )
+if len(pair_index):
+    avg = np.add.reduceat(angle_deg, starts) / counts
+    sq = np.add.reduceat(angle_deg * angle_deg, starts) / counts
+    std = np.sqrt(np.maximum(sq - avg * avg, 0.0))
+    min = np.minimum.reduceat(angle_deg, starts)
+    for k in np.nonzero(in_group[pair_i] & in_group[pair_j])[0]:
+        by_pair.append( [pair_i[k], pair_j[k], avg[k], std[k], min[k], k] )
 
 # (Average angle) pairs with very small average angles between each feature
 # and camera location indicate closely located camera poses and these
@@ -110,52 +100,26 @@ avg_cutoff_deg = 2
 min_cutoff_deg = 0.5
 std_cutoff_deg = 10
 print("Marking small angle image pairs for deletion...")
-mark_list = []
+mark_mask = np.zeros(tracks.num_obs(), dtype=bool)
 by_pair = sorted(by_pair, key=lambda fields: fields[4], reverse=False) # by min
 for line in by_pair:
     print(line[0], line[1], 'avg: %.2f' % line[2], 'std: %.2f' % line[3], 'min: %.2f' % line[4])
     if line[2] < avg_cutoff_deg or line[3] > std_cutoff_deg or line[4] < min_cutoff_deg:   # cutoff angles (deg)
         print('  (remove)')
-        for k, match in enumerate(matches_opt):
-            size = len(match[1:])
-            for i, m1 in enumerate(match[1:]):
-                for j, m2 in enumerate(match[1:]):
-                    # this will probably create double markings, but
-                    # that's ok, I want to be sure.
-                    if m1[0] == line[0] and m2[0] == line[1]:
-                        mark_list.append( [k, i] )
-                        mark_list.append( [k, j] )
-                    if m1[0] == line[1] and m2[0] == line[0]:
-                        mark_list.append( [k, i] )
-                        mark_list.append( [k, j] )
+        # mark both observations of every track connecting the pair
+        k = line[5]
+        start, end = pair_index.offsets[k], pair_index.offsets[k+1]
+        mark_mask[pair_index.obs_a[start:end]] = True
+        mark_mask[pair_index.obs_b[start:end]] = True
 result = input('Press enter to continue:')
 
-# mark selection
-cull.mark_using_list(mark_list, matches_orig)
-cull.mark_using_list(mark_list, matches_opt)
-mark_sum = len(mark_list)
-
-def delete_marked_matches(matches):
-    print(" deleting marked items...")
-    for i in reversed(range(len(matches))):
-        match = matches[i]
-        has_bad_elem = False
-        for j in reversed(range(1, len(match))):
-            p = match[j]
-            if p == [-1, -1]:
-                has_bad_elem = True
-                match.pop(j)
-        if len(match) < 3:
-            print("deleting match that is now in less than 2 images:", match)
-            matches.pop(i)
-
-mark_sum = len(mark_list)
+mark_sum = np.count_nonzero(mark_mask)
 if mark_sum > 0:
     print('Outliers to remove from match lists:', mark_sum)
     result = input('Save these changes? (y/n):')
     if result == 'y' or result == 'Y':
-        delete_marked_matches(matches_orig)
-        delete_marked_matches(matches_opt)
+        cull.delete_masked_matches(matches_orig, mark_mask)
+        cull.delete_masked_matches(matches_opt, mark_mask)
         # write out the updated match dictionaries
         print("Writing original matches...")
         pickle.dump(matches_orig, open(os.path.join(args.project, source), "wb"))
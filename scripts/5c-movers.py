@@ -14,6 +14,8 @@ import sys
 sys.path.append('../lib')
 import Groups
 import ProjectMgr
+import Trace
+import Tracks
 
 import match_culling as cull
 
@@ -22,84 +24,75 @@ parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--stddev', type=float, default=3, help='how many stddevs above the mean for auto discarding features')
 parser.add_argument('--strong', action='store_true', help='remove entire match chain, not just the worst offending element.')
 parser.add_argument('--interactive', action='store_true', help='interactively review reprojection errors from worst to best and select for deletion or keep.')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
-proj.load_image_info()
+proj.load_images_info()
 if args.interactive:
     proj.load_features()
     #proj.undistort_keypoints()
 
 print("Loading matches_grouped...")
 matches_grouped = pickle.load( open( os.path.join(args.project, "matches_grouped"), "rb" ) )
-print("Loading matches_sba...")
-matches_sba = pickle.load( open( os.path.join(args.project, "matches_sba"), "rb" ) )
+print("Loading matches_opt...")
+matches_opt = pickle.load( open( os.path.join(args.project, "matches_opt"), "rb" ) )
 
 # load the group connections within the image set
 groups = Groups.load(args.project)
 print('Main group size:', len(groups[0]))
 
+# index of the tracks connecting each image pair (built once)
+tracks = Tracks.pack(matches_opt)
+pair_index = Tracks.PairIndex(tracks, len(proj.image_list))
+print('Image pairs:', len(pair_index))
+
 # find matches that are likely to be 'volatile' because they are
 # paired from nearly colocated camera poses.
-def compute_shakers(matches):
-    by_feature = []
+def compute_shakers():
+    cam_ned = proj.get_poses(opt=True).ned
+
+    # angle subtended by the two cameras seen from the feature, for
+    # every observation pair of every image pair
+    ned1 = cam_ned[tracks.obs_image[pair_index.obs_a]]
+    ned2 = cam_ned[tracks.obs_image[pair_index.obs_b]]
+    avg = (ned1 + ned2) * 0.5
+    y = np.linalg.norm(ned2 - ned1, axis=1)
+    x = np.linalg.norm(avg - tracks.points[pair_index.track], axis=1)
+    angle = np.arctan2(y, x)
+
+    # [ angle, match index, index of the 2nd observation within the match ]
+    pos_b = pair_index.obs_b - tracks.offsets[pair_index.track]
+    by_feature = [ list(line) for line in zip(angle.tolist(),
+                                              pair_index.track.tolist(),
+                                              pos_b.tolist()) ]
+
     by_pair = []
-    
-    pair_angles = []
-    for i in range(len(proj.image_list)):
-        p = [ [] for j in range(len(proj.image_list)) ]
-        pair_angles.append(p)
-        
-    for k, match in enumerate(matches):
-        # compute avg of camera locations
-        sum = np.zeros(3)
-        count = 0
-        size = len(match[1:])
-        for i in range(size):
-            for j in range(i+1,size):
-                p0 = match[i+1]
-                p1 = match[j+1]
-                i1 =  proj.image_list[p0[0]]
-                i2 =  proj.image_list[p1[0]]
-                ned1, ypr1, q1 = i1.get_camera_pose_sba()
-                ned2, ypr2, q2 = i2.get_camera_pose_sba()
-                avg = (np.array(ned1) + np.array(ned2)) * 0.5
-                y = np.linalg.norm(np.array(ned2) - np.array(ned1))
-                x = np.linalg.norm(avg - np.array(match[0]))
-                angle = math.atan2(y, x)
-                pair_angles[p0[0]][p1[0]].append(angle)
-                by_feature.append( [angle, k, j] )
-                # print( [angle, k, j] )
-
-    for i in range(len(proj.image_list)):
-        for j in range(len(proj.image_list)):
-            if len(pair_angles[i][j]):
-                angles = np.array(pair_angles[i][j])
-                avg = np.mean(angles)
-                std = np.std(angles)
-                min = np.amin(angles)
-                #print(i, j, 'avg:', avg, 'std:', std, 'min:', min)
-                by_pair.append( [i, j, avg, std, min] )
+    if len(pair_index):
+        starts = pair_index.offsets[:-1]
+        counts = pair_index.counts()
+        avg = np.add.reduceat(angle, starts) / counts
+        sq = np.add.reduceat(angle * angle, starts) / counts
+        std = np.sqrt(np.maximum(sq - avg * avg, 0.0))
+        min = np.minimum.reduceat(angle, starts)
+        pair_i, pair_j = pair_index.pairs()
+        for k in range(len(pair_index)):
+            by_pair.append( [pair_i[k], pair_j[k], avg[k], std[k], min[k]] )
     
     # smallest angle is worst (do a forward sort)
     by_feature = sorted(by_feature, key=lambda fields: fields[0])
     by_pair = sorted(by_pair, key=lambda fields: fields[2]) # by avg
     return by_feature, by_pair
 
-# make a list of all matches between an image pair (for deletion),
-# records the index of the matches_list and the index of the 2nd pair.
+# mask of all the matches between an image pair (for deletion), marks
+# the 2nd observation of each pair.
 def find_image_pairs(i1, i2):
-    mark_list = []
-    for k, match in enumerate(matches_sba):
-        size = len(match[1:])
-        for i in range(size):
-            for j in range(i+1,size):
-                p0 = match[i+1]
-                p1 = match[j+1]
-                if p0[0] == i1 and p1[0] == i2:
-                    mark_list.append( [k, j] )
-    return mark_list
+    start, end = pair_index.find(i1, i2)
+    mask = np.zeros(tracks.num_obs(), dtype=bool)
+    mask[pair_index.obs_b[start:end]] = True
+    return mask
 
 def mark_outliers(error_list, trim_stddev):
     print("Marking outliers...")
@@ -128,30 +121,12 @@ def mark_outliers(error_list, trim_stddev):
     for line in error_list:
         # print "line:", line
         if line[0] > mre + stddev * trim_stddev:
-            cull.mark_outlier(matches_sba, line[1], line[2], line[0])
+            cull.mark_outlier(matches_opt, line[1], line[2], line[0])
             mark_count += 1
             
     return mark_count
 
-# delete marked matches
-def delete_marked_matches(matches):
-    print(" deleting marked items...")
-    for i in reversed(range(len(matches))):
-        match = matches[i]
-        has_bad_elem = False
-        for j in reversed(range(1, len(match))):
-            p = match[j]
-            if p == [-1, -1]:
-                has_bad_elem = True
-                match.pop(j)
-        if args.strong and has_bad_elem:
-            print("deleting entire match that contains a bad element")
-            matches.pop(i)
-        elif len(match) < 3:
-            print("deleting match that is now in less than 2 images:", match)
-            matches.pop(i)
-
-by_feature, by_pair = compute_shakers(matches_sba)
+by_feature, by_pair = compute_shakers()
 
 for line in by_pair:
     print(line[0], line[1], 'avg:', line[2], 'std:', line[3], 'min:', line[4])
@@ -160,7 +135,7 @@ for line in by_pair:
 mode = 'by_pair'
 
 if args.interactive:
-    mark_list = cull.show_outliers(by_feature, matches_sba, proj.image_list)
+    mark_list = cull.show_outliers(by_feature, matches_opt, proj.image_list)
 elif mode == 'by_feature':
     # trim outliers by some number of standard deviations high
     # (for movers) mark_sum = mark_outliers(error_list, args.stddev)
@@ -172,63 +147,45 @@ elif mode == 'by_feature':
             mark_list.append( [line[1], line[2]] )
 elif mode == 'by_pair':
     mark_list = []
+
+# mark selection (one mask covers matches_grouped and matches_opt)
+mark_mask = cull.mark_mask(matches_opt, mark_list)
+if mode == 'by_pair' and not args.interactive:
     for line in by_pair:
         # 0.087 = 5 degrees
         # 0.175 = 10 degrees
         # 0.262 = 15 degrees
         if line[2] < 0.087:
             print(line)
-            mark_list += find_image_pairs( line[0], line[1] )
-            
-# mark selection
-cull.mark_using_list(mark_list, matches_grouped)
-cull.mark_using_list(mark_list, matches_sba)
-mark_sum = len(mark_list)
+            mark_mask |= find_image_pairs( line[0], line[1] )
+mark_sum = np.count_nonzero(mark_mask)
 
 # after marking the bad matches, now count how many remaining features
 # show up in each image
-for i in proj.image_list:
-    i.feature_count = 0
-for i, match in enumerate(matches_sba):
-    for j, p in enumerate(match[1:]):
-        if p[1] != [-1, -1]:
-            image = proj.image_list[ p[0] ]
-            image.feature_count += 1
+obs_image = cull.obs_images(matches_opt)
+feature_count = np.bincount(obs_image[~mark_mask],
+                            minlength=len(proj.image_list))
+for i, image in enumerate(proj.image_list):
+    image.feature_count = feature_count[i]
 
 purge_weak_images = False
 if purge_weak_images:
-    # make a dict of all images with less than 25 feature matches
-    weak_dict = {}
-    for i, img in enumerate(proj.image_list):
-        # print img.name, img.feature_count
-        if img.feature_count > 0 and img.feature_count < 25:
-            weak_dict[i] = True
-    print('weak images:', weak_dict)
-
-    # mark any features in the weak images list
-    for i, match in enumerate(matches_orig):
-        #print 'before:', match
-        for j, p in enumerate(match[1:]):
-            if p[0] in weak_dict:
-                 match[j+1] = [-1, -1]
-                 mark_sum += 1
-    for i, match in enumerate(matches_sba):
-        #print 'before:', match
-        for j, p in enumerate(match[1:]):
-            if p[0] in weak_dict:
-                 match[j+1] = [-1, -1]
-                 mark_sum += 0      # don't count these in the mark_sum
-        #print 'after:', match
+    # mark any features in images with less than 25 feature matches
+    weak = (feature_count > 0) & (feature_count < 25)
+    print('weak images:', np.nonzero(weak)[0].tolist())
+    weak_obs = weak[obs_image] & ~mark_mask
+    mark_mask |= weak_obs
+    mark_sum += np.count_nonzero(weak_obs)
 
 if mark_sum > 0:
     print('Outliers removed from match lists:', mark_sum)
     result=input('Save these changes? (y/n):')
     if result == 'y' or result == 'Y':
-        delete_marked_matches(matches_grouped)
-        delete_marked_matches(matches_sba)
+        cull.delete_masked_matches(matches_grouped, mark_mask, args.strong)
+        cull.delete_masked_matches(matches_opt, mark_mask, args.strong)
         # write out the updated match dictionaries
         print("Writing grouped matches...")
         pickle.dump(matches_grouped, open(os.path.join(args.project, "matches_grouped"), "wb"))
         print("Writing optimized matches...")
-        pickle.dump(matches_sba, open(os.path.join(args.project, "matches_sba"), "wb"))
+        pickle.dump(matches_opt, open(os.path.join(args.project, "matches_opt"), "wb"))
 
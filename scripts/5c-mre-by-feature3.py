@@ -5,15 +5,16 @@
 
 import argparse
 import pickle
-import math
 import numpy as np
 import os
 
 import sys
 sys.path.append('../lib')
 import Groups
-import Optimizer
 import ProjectMgr
+import Reprojection
+import Trace
+import Tracks
 
 import match_culling as cull
 
@@ -22,8 +23,11 @@ parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--stddev', type=float, default=5, help='how many stddevs above the mean for auto discarding features')
 parser.add_argument('--strong', action='store_true', help='remove entire match chain, not just the worst offending element.')
 parser.add_argument('--interactive', action='store_true', help='interactively review reprojection errors from worst to best and select for deletion or keep.')
+parser.add_argument('--yes', action='store_true', help='save the changes without asking')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -42,12 +46,15 @@ print('Number of optimized features:', len(matches_opt))
 groups = Groups.load(args.project)
 print('Main group size:', len(groups[0]))
 
-opt = Optimizer.Optimizer(args.project)
-opt.setup( proj, groups[0], matches_opt, optimized=True )
-x0 = np.hstack((opt.camera_params.ravel(), opt.points_3d.ravel(),
-                opt.K[0,0], opt.K[0,2], opt.K[1,2],
-                opt.distCoeffs))
-error = opt.fun(x0, opt.n_cameras, opt.n_points, opt.by_camera_point_indices, opt.by_camera_points_2d)
+# reprojection error of every observation that takes part in the
+# optimization of the main group (one vectorized pass)
+tracks = Tracks.pack(matches_opt)
+rvecs, tvecs = Reprojection.camera_params(proj, opt=True)
+K = proj.cam.get_K(optimized=True)
+distCoeffs = proj.cam.get_dist_coeffs(optimized=True)
+residuals = Reprojection.residuals(tracks, rvecs, tvecs, K, distCoeffs)
+obs_mask = Reprojection.placed_mask(tracks, groups[0], len(proj.image_list))
+error = residuals[obs_mask].ravel()
 
 print(len(error))
 mre = np.mean(np.abs(error))
@@ -55,134 +62,71 @@ std = np.std(error)
 max = np.amax(np.abs(error))
 print('mre: %.3f std: %.3f max: %.2f' % (mre, std, max) )
 
-results = []
-count = 0
-for i, cam in enumerate(opt.camera_params.reshape((opt.n_cameras, opt.ncp))):
-    print(i, opt.camera_map_fwd[i])
-    orig_cam_index = opt.camera_map_fwd[i]
-    # print(count, opt.by_camera_point_indices[i])
-    for j in opt.by_camera_point_indices[i]:
-        match = matches_opt[opt.feat_map_rev[j]]
-        match_index = 0
-        #print(orig_cam_index, match)
-        for k, p in enumerate(match[1:]):
-            if p[0] == orig_cam_index:
-                match_index = k
-        # print(match[0], opt.points_3d[j*3:j*3+3])
-        e = error[count*2:count*2+2]
-        #print(count, e, np.linalg.norm(e))
-        #if abs(e[0]) > 5*std or abs(e[1]) > 5*std:
-        #    print("big")
-        results.append( [np.linalg.norm(e), opt.feat_map_rev[j], match_index] )
-        count += 1
-
-error_list = sorted(results, key=lambda fields: fields[0], reverse=True)
-
-
-def mark_outliers(error_list, trim_stddev):
+# [ error, match index, index within the match ] sorted worst first
+obs_error = np.linalg.norm(residuals, axis=1)
+obs_track = tracks.obs_track()
+obs_pos = np.arange(tracks.num_obs()) - tracks.offsets[obs_track]
+sel = np.nonzero(obs_mask)[0]
+order = sel[np.argsort(-obs_error[sel], kind='stable')]
+error_list = [ list(line) for line in zip(obs_error[order].tolist(),
+                                          obs_track[order].tolist(),
+                                          obs_pos[order].tolist()) ]
+
+# marks are held as a mask over the packed observations (matches_orig
+# and matches_opt share the same layout.)
+mark_mask = np.zeros(tracks.num_obs(), dtype=bool)
+
+def mark_outliers(trim_stddev):
     print("Marking outliers...")
-    sum = 0.0
-    count = len(error_list)
-
-    # numerically it is better to sum up a list of floatting point
-    # numbers from smallest to biggest (error_list is sorted from
-    # biggest to smallest)
-    for line in reversed(error_list):
-        sum += line[0]
-        
     # stats on error values
     print(" computing stats...")
-    mre = sum / count
-    stddev_sum = 0.0
-    for line in error_list:
-        error = line[0]
-        stddev_sum += (mre-error)*(mre-error)
-    stddev = math.sqrt(stddev_sum / count)
+    errors = obs_error[sel]
+    mre = np.mean(errors)
+    stddev = np.std(errors)
     print("mre = %.4f stddev = %.4f" % (mre, stddev))
 
     # mark match items to delete
     print(" marking outliers...")
-    mark_count = 0
-    for line in error_list:
-        # print "line:", line
-        if line[0] > mre + stddev * trim_stddev:
-            cull.mark_outlier(matches_orig, line[1], line[2], line[0])
-            cull.mark_outlier(matches_opt, line[1], line[2], line[0])
-            mark_count += 1
-            
-    return mark_count
-
-# delete marked matches
-def delete_marked_matches(matches):
-    print(" deleting marked items...")
-    for i in reversed(range(len(matches))):
-        match = matches[i]
-        has_bad_elem = False
-        for j in reversed(range(1, len(match))):
-            p = match[j]
-            if p == [-1, -1]:
-                has_bad_elem = True
-                match.pop(j)
-        if args.strong and has_bad_elem:
-            print("deleting entire match that contains a bad element")
-            matches.pop(i)
-        elif len(match) < 3:
-            print("deleting match that is now in less than 2 images:", match)
-            matches.pop(i)
+    outliers = sel[errors > mre + stddev * trim_stddev]
+    mark_mask[outliers] = True
+    return len(outliers)
 
 if args.interactive:
     # interactively pick outliers
     mark_list = cull.show_outliers(error_list, matches_opt, proj.image_list)
 
     # mark selection
-    cull.mark_using_list(mark_list, matches_orig)
-    cull.mark_using_list(mark_list, matches_opt)
+    mark_mask |= cull.mark_mask(matches_opt, mark_list)
     mark_sum = len(mark_list)
 else:
     # trim outliers by some # of standard deviations high
-    mark_sum = mark_outliers(error_list, args.stddev)
+    mark_sum = mark_outliers(args.stddev)
 
 # after marking the bad matches, now count how many remaining features
 # show up in each image
-for i in proj.image_list:
-    i.feature_count = 0
-for i, match in enumerate(matches_opt):
-    for j, p in enumerate(match[1:]):
-        if p[1] != [-1, -1]:
-            image = proj.image_list[ p[0] ]
-            image.feature_count += 1
+feature_count = np.bincount(tracks.obs_image[~mark_mask],
+                            minlength=len(proj.image_list))
+for i, image in enumerate(proj.image_list):
+    image.feature_count = feature_count[i]
 
 purge_weak_images = False
 if purge_weak_images:
-    # make a dict of all images with less than 25 feature matches
-    weak_dict = {}
-    for i, img in enumerate(proj.image_list):
-        # print img.name, img.feature_count
-        if img.feature_count > 0 and img.feature_count < 25:
-            weak_dict[i] = True
-    print('weak images:', weak_dict)
-
-    # mark any features in the weak images list
-    for i, match in enumerate(matches_orig):
-        #print 'before:', match
-        for j, p in enumerate(match[1:]):
-            if p[0] in weak_dict:
-                 match[j+1] = [-1, -1]
-                 mark_sum += 1
-    for i, match in enumerate(matches_opt):
-        #print 'before:', match
-        for j, p in enumerate(match[1:]):
-            if p[0] in weak_dict:
-                 match[j+1] = [-1, -1]
-                 mark_sum += 0      # don't count these in the mark_sum
-        #print 'after:', match
+    # mark any features in images with less than 25 feature matches
+    weak = (feature_count > 0) & (feature_count < 25)
+    print('weak images:', np.nonzero(weak)[0].tolist())
+    weak_obs = weak[tracks.obs_image] & ~mark_mask
+    mark_mask |= weak_obs
+    mark_sum += np.count_nonzero(weak_obs)
 
 if mark_sum > 0:
     print('Outliers removed from match lists:', mark_sum)
-    result = input('Save these changes? (y/n):')
+    if args.yes:
+        result = 'y'
+    else:
+        result = input('Save these changes? (y/n):')
     if result == 'y' or result == 'Y':
-        delete_marked_matches(matches_orig)
-        delete_marked_matches(matches_opt)
+        cull.delete_masked_matches(matches_orig, mark_mask, args.strong)
+        cull.delete_masked_matches(matches_opt, mark_mask, args.strong)
         # write out the updated match dictionaries
         print("Writing:", source)
         pickle.dump(matches_orig, open(os.path.join(args.project, source), "wb"))
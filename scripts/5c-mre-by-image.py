@@ -1,124 +1,64 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 # For all the feature matches and camera poses, estimate a mean
-# reprojection error
-
-import sys
-sys.path.insert(0, "/usr/local/opencv-2.4.11/lib/python2.7/site-packages/")
+# reprojection error per image
 
 import argparse
-import cv2
-import json
-import math
 import numpy as np
 
+import sys
 sys.path.append('../lib')
+import Groups
 import ProjectMgr
+import Reprojection
+import Trace
+import Tracks
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--stddev', type=float, default=3, help='report features more than this many stddevs above their image mean')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
-proj.load_image_info()
-proj.load_features()
-
-f = open(args.project + "/Matches.json", 'r')
-matches_dict = json.load(f)
-f.close()
-
-# image mean reprojection error
-def compute_image_mre(image, cam):
-    image_sum = 0.0
-    image_max = 0.0
-    #scale = float(image.width) / float(camw)
-    #K = cam.get_K(scale)
-    K = cam.get_K()
-    rvec, tvec = image.get_proj()
-    R, jac = cv2.Rodrigues(rvec)
-    PROJ = np.concatenate((R, tvec), axis=1)
-    result_list = []
-    for i, pt in enumerate(image.obj_pts):
-        uvh = K.dot( PROJ.dot( np.hstack((pt, 1.0)) ).T )
-        #print uvh
-        uvh /= uvh[2]
-        #print uvh
-        #print "%s -> %s" % ( image.img_pts[i], [ np.squeeze(uvh[0,0]), np.squeeze(uvh[1,0]) ] )
-        uv = np.array( [ np.squeeze(uvh[0,0]), np.squeeze(uvh[1,0]) ] )
-        dist = np.linalg.norm(np.array(image.img_pts[i]) - uv)
-        #print dist
-        image_sum += dist
-        if dist > image_max:
-            image_max = dist
-        result_list.append( (dist, i) )
-    # sort by worst max error first
-    result_list = sorted(result_list, key=lambda fields: fields[0],
-                         reverse=True)
-
-    # meta stats on error values
-    image_avg = image_sum / len(image.obj_pts)
-    stddev_sum = 0.0
-    for line in result_list:
-        error = line[0]
-        stddev_sum += (image_avg-error)*(image_avg-error)
-    stddev = math.sqrt(stddev_sum / len(image.obj_pts))
-    print "   error avg = %.2f stddev = %.2f" % (image_avg, stddev)
+proj.load_images_info()
 
-    for line in result_list:
-        if line[0] > image_avg + 3*stddev:
-            print "feat %d err=%.2f" % (line[1], line[0])
-    return image_avg, image_max
+print("Loading optimized matches: matches_opt")
+tracks = Tracks.read(args.project, 'matches_opt')
+print('Number of optimized features:', len(tracks))
 
-# group mean reprojection error
-def compute_group_mre(image_list, cam):
-    # start with a clean slate
-    for image in image_list:
-        image.img_pts = []
-        image.obj_pts = []
+# load the group connections within the image set
+groups = Groups.load(args.project)
+print('Main group size:', len(groups[0]))
 
-    # iterate through the match dictionary and build a per image list of
-    # obj_pts and img_pts
-    for key in matches_dict:
-        feature_dict = matches_dict[key]
-        points = feature_dict['pts']
-        ned = matches_dict[key]['ned']
-        for p in points:
-            image = image_list[ p[0] ]
-            kp = image.kp_list[ p[1] ]
-            image.img_pts.append( kp.pt )
-            image.obj_pts.append( ned )
+# reprojection error of every optimized observation (one vectorized
+# pass) and the per image statistics
+rvecs, tvecs = Reprojection.camera_params(proj, opt=True)
+K = proj.cam.get_K(optimized=True)
+distCoeffs = proj.cam.get_dist_coeffs(optimized=True)
+residuals = Reprojection.residuals(tracks, rvecs, tvecs, K, distCoeffs)
+obs_mask = Reprojection.placed_mask(tracks, groups[0], len(proj.image_list))
+obs_error = np.linalg.norm(residuals, axis=1)
+count, mean, std, worst = Reprojection.image_stats(tracks, obs_error,
+                                                   len(proj.image_list),
+                                                   obs_mask)
 
-    camw, camh = cam.get_image_params()
-    result_list = []
-    for i, image in enumerate(image_list):
-        print image.name
-        if len(image.img_pts) < 4:
-            continue
-        image_avg, image_max = compute_image_mre(image, cam)
-        result_list.append( (image_avg, image_max, i) )
-    
-    # sort by worst max error first
-    result_list = sorted(result_list, key=lambda fields: fields[0],
-                         reverse=True)
-    sum = 0.0
-    for line in result_list:
-        sum += line[0]
-        print "%s mre avg=%.2f max=%.2f" % (image_list[line[2]].name,
-                                            line[0], line[1])
-    print "Total mean reprojection error = %.4f" % (sum / len(result_list))
-    
-    # meta stats on error values
-    error_avg = math.sqrt(dist2_sum / len(match))
-    stddev_sum = 0.0
-    for line in report_list:
-        error = line[0]
-        stddev_sum += (error_avg-error)*(error_avg-error)
-    stddev = math.sqrt(stddev_sum / len(match))
-    print "   error avg = %.2f stddev = %.2f" % (error_avg, stddev)
+# per image outlier features (error well above the image mean)
+obs_track = tracks.obs_track()
+outlier = obs_mask & (obs_error > (mean + args.stddev * std)[tracks.obs_image])
+outliers = {}
+for k in np.nonzero(outlier)[0]:
+    outliers.setdefault(tracks.obs_image[k], []).append(k)
 
-    print "%s mre = %.2f max = %.2f" % (image.name,
-                                        image_sum / len(image.obj_pts),
-                                        image_max)
-        
-compute_group_mre(proj.image_list, proj.cam)
+# report sorted by worst mean error first
+result_list = [ i for i in range(len(proj.image_list)) if count[i] >= 4 ]
+result_list.sort(key=lambda i: mean[i], reverse=True)
+for i in result_list:
+    print("%s mre avg=%.2f stddev=%.2f max=%.2f (%d features)" %
+          (proj.image_list[i].name, mean[i], std[i], worst[i], count[i]))
+    for k in outliers.get(i, []):
+        print("   feat %d err=%.2f" % (obs_track[k], obs_error[k]))
+if len(result_list):
+    print("Total mean reprojection error = %.4f" % np.mean(mean[result_list]))
@@ -11,7 +11,6 @@ import fnmatch
 import itertools
 #import json
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import os.path
 from progress.bar import Bar
@@ -121,6 +120,7 @@ def compute_surface_outliers():
     # plot results
     do_plot = False
     if do_plot:
+        import matplotlib.pyplot as plt
         x = np.array(x)
         y = np.array(y)
         slope_diff = np.array(slope)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+# Plot the optimizer progress log (optimizer-log.jsonl) written by
+# 5a-optimize.py: cost, mean reprojection error, step norm and
+# time per function evaluation for each solve in the log.
+
+import argparse
+import matplotlib.pyplot as plt
+import os
+
+import sys
+sys.path.append('../lib')
+import SolverLog
+import Trace
+
+parser = argparse.ArgumentParser(description='Plot optimizer progress.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--log', help='log file (default: project/optimizer-log.jsonl)')
+parser.add_argument('--last', action='store_true', help='only plot the most recent solve for each label')
+parser.add_argument('--xaxis', default='time', choices=['time', 'nfev'], help='x axis units')
+parser.add_argument('--output', help='save the plot to this file instead of showing it')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
+
+args = parser.parse_args()
+Trace.start(args.trace)
+
+if args.log:
+    log_file = args.log
+else:
+    log_file = os.path.join(args.project, 'optimizer-log.jsonl')
+runs = SolverLog.load(log_file)
+print('Solves in log:', len(runs))
+for k, run in enumerate(runs):
+    if run[-1]['event'] == 'finish' and run[-1].get('optimality') is not None:
+        print('  %s (%d): cost: %.4e gradient norm: %.3e' %
+              (run[0]['label'], k, run[-1]['cost'], run[-1]['optimality']))
+
+if args.last:
+    last = {}
+    for run in runs:
+        last[run[0]['label']] = run
+    runs = list(last.values())
+
+fig, axes = plt.subplots(2, 2, sharex=True, figsize=(12, 8))
+fields = [ ('cost', 'cost', True), ('mre', 'mean reprojection error (px)', False),
+           ('step_norm', 'step norm', True), ('eval_ms', 'ms / evaluation', False) ]
+for ax, (field, title, log_scale) in zip(axes.ravel(), fields):
+    for k, run in enumerate(runs):
+        x = []
+        y = []
+        for record in run:
+            if field in record and record[field] is not None:
+                x.append(record[args.xaxis])
+                y.append(record[field])
+        if len(x):
+            ax.plot(x, y, '.-', label='%s (%d)' % (run[0]['label'], k))
+    ax.set_title(title)
+    if log_scale:
+        ax.set_yscale('log')
+    ax.grid(True)
+for ax in axes[1]:
+    ax.set_xlabel(args.xaxis)
+axes[0][0].legend(fontsize='small')
+plt.tight_layout()
+if args.output:
+    plt.savefig(args.output)
+else:
+    plt.show()
@@ -26,6 +26,7 @@ import Panda3d
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 import transformations
 
 import match_culling as cull
@@ -39,8 +40,10 @@ parser.add_argument('--texture-resolution', type=int, default=512, help='texture
 parser.add_argument('--srtm', action='store_true', help='use srtm elevation')
 parser.add_argument('--ground', type=float, help='force ground elevation in meters')
 parser.add_argument('--direct', action='store_true', help='use direct pose')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -16,6 +16,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 import transformations
 
 
@@ -112,8 +113,10 @@ def gen_ac3d_object(f, name, raw_tris):
                 
 parser = argparse.ArgumentParser(description='Compute Delauney triangulation of matches.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
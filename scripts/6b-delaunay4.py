@@ -11,7 +11,6 @@ import fnmatch
 import itertools
 #import json
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import os.path
 from progress.bar import Bar
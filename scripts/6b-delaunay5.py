@@ -6,7 +6,6 @@ import cv2
 import fnmatch
 import itertools
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import os.path
 from progress.bar import Bar
@@ -19,11 +18,14 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import Trace
 import transformations
 
 parser = argparse.ArgumentParser(description='Compute Delauney triangulation of matches.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 # project the estimated uv coordinates for the specified image and ned
 # point
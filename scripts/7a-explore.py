@@ -19,10 +19,13 @@ from panda3d.core import LineSegs, NodePath, OrthographicLens, PNMImage, Texture
 
 sys.path.append('../lib')
 import ProjectMgr
+import Trace
 
 parser = argparse.ArgumentParser(description='Set the initial camera poses.')
 parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_images_info()
@@ -10,14 +10,17 @@ import props_json               # from aura-props package
 
 sys.path.append('../lib')
 import Camera
+import Trace
 
 parser = argparse.ArgumentParser(description='New camera configuration.')
 parser.add_argument('--config', default='../cameras', help='camera config directory')
 parser.add_argument('--ccd-width', required=True, type=float)
 parser.add_argument('--image', required=True, help='sample image from this camera with exif tags')
 parser.add_argument('--force', action='store_true', help='force overwrite of an existing config file')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 
 args = parser.parse_args()
+Trace.start(args.trace)
 
 exif = pyexiv2.ImageMetadata(args.image)
 exif.read()
@@ -11,6 +11,7 @@ import os.path
 
 sys.path.append('../lib')
 import ProjectMgr
+import Trace
 
 # this is a one-off script for debugging.  The intention is to strip
 # down a larger data set to something small for testing/debugging.  It
@@ -23,7 +24,9 @@ import ProjectMgr
 parser = argparse.ArgumentParser(description='Load the project\'s images.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--delete-further-than', type=float, help='delete images furhter than this distance from center')
+parser.add_argument('--trace', help='write a timing trace (chrome trace event json) of the run to this file')
 args = parser.parse_args()
+Trace.start(args.trace)
 # print args
 
 proj = ProjectMgr.ProjectMgr(args.project)
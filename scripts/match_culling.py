@@ -3,6 +3,7 @@ sys.path.insert(0, "/usr/local/lib/python2.7/site-packages/")
 
 import cv2
 import math
+import numpy as np
 
 sys.path.append('../lib')
 import ProjectMgr
@@ -117,26 +118,72 @@ def mark_using_list(mark_list, matches):
     for mark in mark_list:
         mark_outlier( matches, mark[0], mark[1], None )
         
-# delete marked matches
-def delete_marked_matches(matches):
+# Marks can also be held as a boolean mask over the packed
+# observations (see Tracks.py): observation j of match i is
+# mask[offsets[i] + j].  One mask covers every match list with the same
+# layout (i.e. matches_grouped and the matching matches_opt.)
+
+# observation offsets of each match in the packed order
+def match_offsets(matches):
+    lengths = np.fromiter((len(match) - 1 for match in matches),
+                          dtype=np.int64, count=len(matches))
+    offsets = np.zeros(len(matches) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+# image index of each observation in the packed order
+def obs_images(matches):
+    return np.fromiter((p[0] for match in matches for p in match[1:]),
+                       dtype=np.int64, count=match_offsets(matches)[-1])
+
+# boolean mask from a list of [match_index, feature_index] marks
+def mark_mask(matches, mark_list):
+    offsets = match_offsets(matches)
+    mask = np.zeros(offsets[-1], dtype=bool)
+    if len(mark_list):
+        marks = np.array(mark_list, dtype=np.int64).reshape(-1, 2)
+        mask[offsets[marks[:,0]] + marks[:,1]] = True
+    return mask
+
+# delete the masked observations in one compaction pass, then drop the
+# matches left in fewer than 2 images (or any match with a masked
+# observation if strong.)  matches is updated in place.
+def delete_masked_matches(matches, mask, strong=False):
     print(" deleting marked items...")
-    for i in reversed(range(len(matches))):
+    offsets = match_offsets(matches)
+    assert len(mask) == offsets[-1], "mask doesn't match the match list layout"
+    lengths = np.diff(offsets)
+    obs_match = np.repeat(np.arange(len(matches)), lengths)
+    bad = np.bincount(obs_match[mask], minlength=len(matches))
+    keep = (lengths - bad) >= 2
+    if strong:
+        keep &= (bad == 0)
+    obs_keep = (~mask).tolist()
+    result = []
+    for i in np.nonzero(keep)[0].tolist():
         match = matches[i]
-        has_bad_elem = False
-        for j in reversed(range(1, len(match))):
-            p = match[j]
-            if p == [-1, -1]:
-                has_bad_elem = True
-                match.pop(j)
-        if False and has_bad_elem: # was 'if args.strong and ...'
-            print("deleting entire match that contains a bad element", i)
-            matches.pop(i)
-        elif len(match) < 3:
-            print("deleting match that is now in less than 2 images:", match, i)
-            matches.pop(i)
-        elif False and len(match) < 4:
-            # this is seeming like less and less of a good idea (Jan 3, 2017)
-            print("deleting match that is now in less than 3 images:", match, i)
-            matches.pop(i)
+        if bad[i]:
+            start = offsets[i]
+            match = [ match[0] ] + [ p for j, p in enumerate(match[1:])
+                                    if obs_keep[start + j] ]
+        result.append(match)
+    print("deleted matches:", len(matches) - len(result),
+          "(%d with a bad element)" % np.count_nonzero(bad))
+    matches[:] = result
     print("final matches size:", len(matches))
 
+# mask of the observations marked by mark_outlier()
+def marked_mask(matches):
+    offsets = match_offsets(matches)
+    mask = np.zeros(offsets[-1], dtype=bool)
+    k = 0
+    for match in matches:
+        for p in match[1:]:
+            if p == [-1, -1]:
+                mask[k] = True
+            k += 1
+    return mask
+
+# delete marked matches
+def delete_marked_matches(matches, strong=False):
+    delete_masked_matches(matches, marked_mask(matches), strong)
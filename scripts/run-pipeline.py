@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+# Run the processing stages (3a detect features ... 5c reports) as a
+# dependency graph, skipping the stages whose inputs, options, config
+# and script are unchanged since their last successful run.  See
+# lib/Pipeline.py for how the stages are declared and compared.  The
+# stage list is the project pipeline.json if it exists (--write-stages
+# creates one from the defaults), each stage's output goes to
+# pipeline-logs/<stage>.log in the project directory.
+
+import argparse
+import json
+import os
+
+import sys
+sys.path.append('../lib')
+import Pipeline
+
+parser = argparse.ArgumentParser(description='Run the processing pipeline.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--stages', help='comma separated list of stages to consider (default: all)')
+parser.add_argument('--force', help='comma separated list of stages to rerun regardless (\'all\' for every stage)')
+parser.add_argument('--dry-run', action='store_true', help='only show which stages would run and why')
+parser.add_argument('--jobs', type=int, default=1, help='number of independent stages to run concurrently')
+parser.add_argument('--content-hash', action='store_true', help='compare files by content instead of size and modification time (slower)')
+parser.add_argument('--write-stages', action='store_true', help='write the default stage list to the project pipeline.json for editing and quit')
+args = parser.parse_args()
+
+if args.write_stages:
+    path = os.path.join(args.project, Pipeline.stages_file)
+    if os.path.exists(path):
+        print('Not overwriting existing:', path)
+        quit()
+    with open(path, 'w') as fd:
+        json.dump(Pipeline.default_stages, fd, indent=4)
+    print('Wrote:', path)
+    quit()
+
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+stages = Pipeline.load_stages(args.project)
+names = [ stage['name'] for stage in stages ]
+for stage in stages:
+    if not os.path.isfile(Pipeline.script_path(scripts_dir, stage)):
+        print('Stage %s: no such script: %s' % (stage['name'], stage['script']))
+        quit()
+selected = names
+if args.stages:
+    selected = args.stages.split(',')
+    for name in selected:
+        if name not in names:
+            print('Unknown stage:', name, ' stages:', ','.join(names))
+            quit()
+force = []
+if args.force == 'all':
+    force = names
+elif args.force:
+    force = args.force.split(',')
+
+state = Pipeline.load_state(args.project)
+steps = Pipeline.plan(args.project, scripts_dir, stages, state, force=force,
+                      selected=selected, content=args.content_hash)
+steps = [ step for step in steps if step[0]['name'] in selected ]
+count = 0
+for [stage, reasons] in steps:
+    if len(reasons):
+        count += 1
+        print('%-16s run:  %s' % (stage['name'], '; '.join(reasons)))
+    else:
+        print('%-16s skip: up to date' % stage['name'])
+print('%d of %d stages to run' % (count, len(steps)))
+if args.dry_run or not count:
+    quit()
+
+failed = Pipeline.run(args.project, scripts_dir, stages, state, steps,
+                      jobs=args.jobs, content=args.content_hash)
+if len(failed):
+    print('Failed stages:', ','.join(failed))
+    sys.exit(1)
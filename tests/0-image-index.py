@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+# check the ProjectMgr image name/path lookups (dict index) against a
+# plain scan of image_list, including after the list is reordered in
+# place, replaced, appended to, and with duplicate / missing names.
+# Replacing a single element in place needs an index_images() call.
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append('../lib')
+import Image
+import ProjectMgr
+
+def scan_index(proj, name):
+    for i, image in enumerate(proj.image_list):
+        if image.name == name:
+            return i
+    return None
+
+def scan_path(proj, path):
+    for i, image in enumerate(proj.image_list):
+        if image.image_file == path:
+            return i
+    return None
+
+def make_image(name):
+    image = Image.Image()
+    image.name = name
+    image.image_file = os.path.join('/data/images', name + '.JPG')
+    return image
+
+def check(proj, label):
+    names = [ image.name for image in proj.image_list ]
+    names += [ 'missing-1', 'missing-2' ]
+    for name in names:
+        i = proj.findIndexByName(name)
+        assert i == scan_index(proj, name), (label, name)
+        image = proj.findImageByName(name)
+        assert (image is None and i is None) or image is proj.image_list[i], (label, name)
+        path = os.path.join('/data/images', name + '.JPG')
+        assert proj.findIndexByPath(path) == scan_path(proj, path), (label, path)
+    print('ok:', label)
+
+project_dir = tempfile.mkdtemp()
+proj = ProjectMgr.ProjectMgr(project_dir, create=True)
+proj.image_list = [ make_image('img%04d' % i) for i in range(500) ]
+check(proj, 'initial')
+
+random.shuffle(proj.image_list)
+check(proj, 'reordered in place')
+
+proj.image_list.sort(key=lambda image: image.name, reverse=True)
+check(proj, 'sorted in place')
+
+proj.image_list = [ make_image('new%04d' % i) for i in range(500) ]
+check(proj, 'replaced')
+
+proj.image_list.append(make_image('extra'))
+check(proj, 'appended')
+
+proj.image_list.append(make_image('new0001'))
+check(proj, 'duplicate name')
+
+# a name new to a current table isn't found until the tables are
+# rebuilt (the old name is a stale hit and falls back to a scan)
+proj.image_list[10] = make_image('swapped')
+assert proj.findIndexByName('swapped') is None
+proj.index_images()
+check(proj, 'element replaced')
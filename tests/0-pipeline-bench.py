@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+
+# End to end pipeline benchmark on synthetic surveys (lib/Synthetic.py)
+# of several sizes: for each scale generate the images, set up the
+# project (1a, 1b, 2a) and time each processing stage (3a detect
+# through 6a render.)  Then compare the direct and the optimized
+# camera poses against the ground truth:
+#
+#   pos rmse:  camera position error (m)
+#   aligned:   position error after a best fit similarity transform
+#              (the solution's shape, independent of its placement)
+#   att:       mean camera orientation error (deg)
+#
+# --results saves the numbers (json), --compare reports the stages and
+# accuracy figures that got worse than a previous results file by more
+# than --threshold (and exits with status 1 if any did.)
+
+import argparse
+import json
+import math
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import sys
+sys.path.append('../lib')
+import Pipeline
+import Synthetic
+
+parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic surveys.')
+parser.add_argument('--scales', default='16,36,64', help='comma separated list of survey sizes (number of images)')
+parser.add_argument('--work', help='work directory (default: a scratch directory, removed afterwards unless a stage failed)')
+parser.add_argument('--relief', type=float, default=0.0, help='scene relief (m), 0 = flat ground')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+parser.add_argument('--detect-scale', type=float, default=0.5, help='3a --scale')
+parser.add_argument('--stages', help='comma separated list of stages to run (default: all)')
+parser.add_argument('--results', help='write the results to this json file')
+parser.add_argument('--compare', help='previous results file to check for regressions')
+parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+args = parser.parse_args()
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scripts_dir = os.path.join(root, 'scripts')
+ground_m = 300.0
+
+def setup_stages(source_dir):
+    return [
+        { 'name': '1a', 'script': '1a-create-project.py',
+          'args': [ '--image-dirs', os.path.join(source_dir, 'images') ] },
+        { 'name': '1b', 'script': '1b-set-camera-config.py',
+          'args': [ '--camera', os.path.join(source_dir, 'camera.json'),
+                    '--yaw-deg', '0', '--pitch-deg', '-90', '--roll-deg', '0' ] },
+        { 'name': '2a', 'script': '2a-set-poses.py',
+          'args': [ '--sentera', os.path.join(source_dir, 'poses.csv') ] },
+    ]
+
+bench_stages = [
+    { 'name': '3a', 'script': '3a-detect-features.py',
+      'args': [ '--scale', str(args.detect_scale) ] },
+    { 'name': '4a', 'script': '4a-matching.py', 'args': [] },
+    { 'name': '4b', 'script': '4b-clean-and-reset-matches.py',
+      'args': [ '--ground', str(ground_m) ] },
+    { 'name': '4d', 'script': '4d-match-grouping.py', 'args': [] },
+    { 'name': '4e', 'script': '4e-image-groups.py', 'args': [] },
+    { 'name': '4g', 'script': '4g-match-culling.py', 'args': [ '--yes' ] },
+    # (4g culls matches_direct only, group again after it)
+    { 'name': '4d+', 'script': '4d-match-grouping.py', 'args': [] },
+    { 'name': '5a', 'script': '5a-optimize.py', 'args': [] },
+    { 'name': '6a', 'script': '6a-render-model2.py',
+      'args': [ '--ground', str(ground_m) ] },
+]
+if args.stages:
+    selected = args.stages.split(',')
+    bench_stages = [ stage for stage in bench_stages if stage['name'] in selected ]
+
+# similarity transform (scale, rotation, translation) best mapping the
+# points src onto dst (umeyama)
+def similarity(src, dst):
+    mu_s = src.mean(axis=0)
+    mu_d = dst.mean(axis=0)
+    s = src - mu_s
+    d = dst - mu_d
+    U, S, Vt = np.linalg.svd(d.T.dot(s) / len(src))
+    D = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        D[2,2] = -1
+    R = U.dot(D).dot(Vt)
+    scale = np.trace(np.diag(S).dot(D)) / max(1e-12, np.mean(np.sum(s * s, axis=1)))
+    return scale, R, mu_d - scale * R.dot(mu_s)
+
+# the image meta info as dicts (from the meta json files, or the
+# single file store if the project has one)
+def load_meta(project_dir):
+    import MetaStore
+    if MetaStore.exists(project_dir):
+        store = MetaStore.MetaStore(project_dir)
+        meta = { name: json.loads(text) for name, text in store.load().items() }
+        store.close()
+        return meta
+    meta = {}
+    meta_dir = os.path.join(project_dir, 'meta')
+    for file in os.listdir(meta_dir):
+        name, ext = os.path.splitext(file)
+        if ext == '.json':
+            with open(os.path.join(meta_dir, file), 'r') as fd:
+                meta[name] = json.load(fd)
+    return meta
+
+# pose errors of the project's direct and optimized camera poses
+# against the truth
+def accuracy(project_dir, truth):
+    import navpy
+    with open(os.path.join(project_dir, 'config.json'), 'r') as fd:
+        ref = json.load(fd)['ned_reference']
+    ref = [ float(ref['lat_deg']), float(ref['lon_deg']), float(ref['alt_m']) ]
+    meta = load_meta(project_dir)
+    result = {}
+    for pose_set in [ 'camera_pose', 'camera_pose_opt' ]:
+        est = []
+        true = []
+        att = []
+        for name in sorted(truth['images']):
+            pose = meta.get(name, {}).get(pose_set)
+            if pose is None or 'ned' not in pose:
+                continue
+            if pose_set == 'camera_pose_opt' \
+               and str(pose.get('valid')).lower() not in [ 'true', '1' ]:
+                continue
+            t = truth['images'][name]
+            true.append(navpy.lla2ned(t['lla'][0], t['lla'][1], t['lla'][2],
+                                      ref[0], ref[1], ref[2]))
+            est.append([ float(x) for x in pose['ned'] ])
+            q = Synthetic.camera_quat(t['ypr'][0], t['ypr'][1], t['ypr'][2],
+                                      truth['mount'])
+            dot = min(1.0, abs(np.dot(q, [ float(x) for x in pose['quat'] ])))
+            att.append(2.0 * math.acos(dot) * 180.0 / math.pi)
+        if len(est) < 3:
+            continue
+        est = np.array(est)
+        true = np.array(true)
+        err = np.linalg.norm(est - true, axis=1)
+        scale, R, t = similarity(est, true)
+        aligned = np.linalg.norm((scale * R.dot(est.T)).T + t - true, axis=1)
+        result[pose_set] = { 'images': len(est),
+                             'pos_rmse_m': float(np.sqrt(np.mean(err**2))),
+                             'aligned_rmse_m': float(np.sqrt(np.mean(aligned**2))),
+                             'att_deg': float(np.mean(att)) }
+    return result
+
+def run_scale(work_dir, images):
+    source_dir = os.path.join(work_dir, 'source')
+    project_dir = os.path.join(work_dir, 'project')
+    t_start = time.time()
+    truth = Synthetic.generate(source_dir, images=images, ground_m=ground_m,
+                               relief_m=args.relief, seed=args.seed)
+    result = { 'generate': time.time() - t_start, 'stages': {},
+               'failed': None }
+    for stage in setup_stages(source_dir) + bench_stages:
+        status, secs, log = Pipeline.run_stage(project_dir, scripts_dir, stage)
+        print('  %-4s %8.2fs%s' % (stage['name'], secs,
+                                   '' if status == 0 else '  FAILED, see ' + log))
+        if status != 0:
+            result['failed'] = stage['name']
+            break
+        result['stages'][stage['name']] = secs
+    path = os.path.join(project_dir, 'matches_opt')
+    if os.path.isfile(path):
+        with open(path, 'rb') as fd:
+            result['points'] = len(pickle.load(fd))
+    if os.path.isfile(os.path.join(project_dir, 'config.json')):
+        result['accuracy'] = accuracy(project_dir, truth)
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=root).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+work = args.work
+if work is None:
+    work = tempfile.mkdtemp()
+results = { 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'revision': git_revision(), 'relief': args.relief,
+            'seed': args.seed, 'scales': {} }
+for images in [ int(n) for n in args.scales.split(',') ]:
+    print('Scale: %d images' % images)
+    work_dir = os.path.join(work, 'synthetic-%d' % images)
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    results['scales'][str(images)] = run_scale(work_dir, images)
+if args.work is None:
+    if [ r for r in results['scales'].values() if r['failed'] ]:
+        print('Keeping the work directory (for the stage logs):', work)
+    else:
+        shutil.rmtree(work)
+
+# report
+names = [ stage['name'] for stage in bench_stages ]
+print()
+print('%-8s' % 'images' + ''.join([ '%8s' % name for name in names ]) + '%9s' % 'total')
+for scale, result in sorted(results['scales'].items(), key=lambda item: int(item[0])):
+    times = [ result['stages'].get(name) for name in names ]
+    print('%-8s' % scale + ''.join([ '%8s' % ('-' if t is None else '%.1f' % t) for t in times ])
+          + '%9.1f' % sum([ t for t in times if t is not None ]))
+print()
+print('%-8s %-16s %7s %10s %10s %8s' % ('images', 'poses', 'n', 'pos rmse', 'aligned', 'att'))
+for scale, result in sorted(results['scales'].items(), key=lambda item: int(item[0])):
+    for pose_set, acc in sorted(result.get('accuracy', {}).items()):
+        print('%-8s %-16s %7d %9.3fm %9.3fm %7.3fd'
+              % (scale, pose_set, acc['images'], acc['pos_rmse_m'],
+                 acc['aligned_rmse_m'], acc['att_deg']))
+
+if args.results:
+    with open(args.results, 'w') as fd:
+        json.dump(results, fd, indent=1, sort_keys=True)
+    print('Wrote:', args.results)
+
+if args.compare:
+    with open(args.compare, 'r') as fd:
+        previous = json.load(fd)
+    print()
+    print('Compared to', args.compare, '(revision %s, %s):' % (previous.get('revision'), previous.get('date')))
+    regressions = 0
+    for scale, result in sorted(results['scales'].items(), key=lambda item: int(item[0])):
+        prev = previous['scales'].get(scale)
+        if prev is None:
+            continue
+        checks = []
+        for name, secs in sorted(result['stages'].items()):
+            if name in prev['stages']:
+                # (ignore sub second changes, that is noise)
+                checks.append( [ 'stage ' + name, prev['stages'][name], secs, 1.0 ] )
+        for pose_set, acc in sorted(result.get('accuracy', {}).items()):
+            prev_acc = prev.get('accuracy', {}).get(pose_set)
+            if prev_acc:
+                for key in [ 'pos_rmse_m', 'aligned_rmse_m', 'att_deg' ]:
+                    checks.append( [ pose_set + ' ' + key, prev_acc[key], acc[key], 0.01 ] )
+        if result['failed'] and not prev['failed']:
+            print('  %s images: REGRESSION: stage %s failed' % (scale, result['failed']))
+            regressions += 1
+        for [label, old, new, floor] in checks:
+            change = (new - old) / max(abs(old), 1e-9)
+            flag = ''
+            if change > args.threshold and new - old > floor:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('  %s images: %-30s %10.3f -> %10.3f %+7.1f%%%s'
+                  % (scale, label, old, new, 100.0 * change, flag))
+    print('%d regressions' % regressions)
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# check the PoseTable pose arrays (ProjectMgr.get_poses()) against the
+# per image getters (get_camera_pose(), get_body2ned(), get_proj()) for
+# random direct and optimized poses, and that the cached tables follow
+# pose changes and image list changes.
+
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append('../lib')
+import Image
+import ProjectMgr
+
+random.seed(0)
+
+def random_pose(image, opt=False):
+    ned = [ random.uniform(-500, 500), random.uniform(-500, 500),
+            random.uniform(-150, -50) ]
+    image.set_camera_pose(ned, random.uniform(-180, 180),
+                          random.uniform(-90, 90), random.uniform(-180, 180),
+                          opt=opt)
+
+def check(proj, opt, label):
+    poses = proj.get_poses(opt)
+    assert len(poses) == len(proj.image_list), label
+    for i, image in enumerate(proj.image_list):
+        ned, ypr, quat = image.get_camera_pose(opt)
+        assert np.allclose(poses.ned[i], ned), (label, i)
+        assert np.allclose(poses.ypr[i], ypr), (label, i)
+        assert np.allclose(poses.quat[i], quat), (label, i)
+        assert np.allclose(poses.body2ned[i], image.get_body2ned(opt)), (label, i)
+        rvec, tvec = image.get_proj(opt)
+        assert np.allclose(poses.rvec[i], np.ravel(rvec)), (label, i)
+        assert np.allclose(poses.tvec[i], np.ravel(tvec)), (label, i)
+        R = poses.R[i]
+        assert np.allclose(poses.P[i][:,:3], R) and np.allclose(poses.P[i][:,3], poses.tvec[i]), (label, i)
+        if opt:
+            valid = image.node.getChild('camera_pose_opt', True).getBool('valid')
+            assert poses.valid[i] == valid, (label, i)
+    print('ok:', label)
+
+project_dir = tempfile.mkdtemp()
+proj = ProjectMgr.ProjectMgr(project_dir, create=True)
+proj.image_list = [ Image.Image(None, 'img%04d' % i) for i in range(300) ]
+for image in proj.image_list:
+    random_pose(image)
+    random_pose(image, opt=True)
+check(proj, False, 'direct poses')
+check(proj, True, 'optimized poses')
+
+# the cached table follows set_camera_pose()
+table = proj.get_poses()
+assert proj.get_poses() is table
+for image in random.sample(proj.image_list, 30):
+    random_pose(image)
+assert proj.get_poses() is not table
+check(proj, False, 'after set_camera_pose()')
+
+# ... the valid flags (with poses_changed())
+for image in random.sample(proj.image_list, 50):
+    image.node.getChild('camera_pose_opt', True).setBool('valid', False)
+Image.poses_changed()
+check(proj, True, 'after clearing valid flags')
+
+# ... and image list changes
+proj.image_list = proj.image_list[:200]
+check(proj, False, 'image list replaced')
+extra = Image.Image(None, 'extra')
+random_pose(extra)
+proj.get_poses()
+proj.image_list.append(extra)
+check(proj, False, 'image appended')
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# check the vectorized reprojection engine (lib/Reprojection.py):
+# batched rodrigues against cv2.Rodrigues, projection and residuals
+# against cv2.projectPoints (with radial and tangential distortion),
+# and the per track / per image statistics against python loops.
+
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.append('../lib')
+import Reprojection
+import Tracks
+
+rng = np.random.RandomState(0)
+K = np.array( [[1500.0, 0, 1000], [0, 1500.0, 750], [0, 0, 1]] )
+dist = np.array( [-0.08, 0.02, 0.002, -0.001, 0.005] )
+
+n_images = 30
+rvecs = rng.normal(0, 0.3, (n_images, 3))
+rvecs[0] = 0.0                  # identity rotation
+tvecs = rng.normal(0, 5, (n_images, 3))
+tvecs[:,2] += 100.0
+
+R = Reprojection.rotation_matrices(rvecs)
+for i in range(n_images):
+    Rcv, jac = cv2.Rodrigues(rvecs[i])
+    assert np.allclose(R[i], Rcv, atol=1e-12), i
+print('ok: rotation matrices')
+
+# random tracks in front of the cameras, observed with noise
+matches = []
+for k in range(1000):
+    point = rng.uniform(-30, 30, 3)
+    images = rng.choice(n_images, rng.randint(2, 7), replace=False)
+    match = [ point.tolist() ]
+    for i in images:
+        uv = rng.uniform(0, 2000, 2)
+        match.append( [int(i), uv.tolist()] )
+    matches.append(match)
+tracks = Tracks.pack(matches)
+
+error = Reprojection.residuals(tracks, rvecs, tvecs, K, dist)
+k = 0
+for match in matches:
+    for p in match[1:]:
+        i = p[0]
+        uv, jac = cv2.projectPoints(np.array([match[0]]), rvecs[i], tvecs[i], K, dist)
+        expected = np.array(p[1]) - uv.ravel()
+        assert np.allclose(error[k], expected, atol=1e-6), k
+        k += 1
+print('ok: residuals vs cv2.projectPoints (%d observations)' % k)
+
+# statistics vs python loops
+dist_err = np.linalg.norm(error, axis=1)
+obs_mask = rng.uniform(size=len(dist_err)) > 0.2
+mean, worst = Reprojection.track_stats(tracks, dist_err, obs_mask)
+count, image_mean, image_std, image_worst = \
+    Reprojection.image_stats(tracks, dist_err, n_images, obs_mask)
+per_image = [ [] for i in range(n_images) ]
+for t in range(len(tracks)):
+    a, b = tracks.obs_range(t)
+    e = [ dist_err[j] for j in range(a, b) if obs_mask[j] ]
+    if len(e):
+        assert abs(mean[t] - np.mean(e)) < 1e-9 and worst[t] == max(e), t
+    else:
+        assert mean[t] == 0.0 and worst[t] == 0.0, t
+    for j in range(a, b):
+        if obs_mask[j]:
+            per_image[tracks.obs_image[j]].append(dist_err[j])
+for i in range(n_images):
+    e = per_image[i]
+    assert count[i] == len(e), i
+    if len(e):
+        assert abs(image_mean[i] - np.mean(e)) < 1e-9, i
+        assert abs(image_std[i] - np.std(e)) < 1e-6, i
+        assert image_worst[i] == max(e), i
+print('ok: track and image statistics')
+
+# placed_mask vs the Optimizer.setup() selection
+placed = set(rng.choice(n_images, 20, replace=False).tolist())
+mask = Reprojection.placed_mask(tracks, placed, n_images)
+k = 0
+for match in matches:
+    n_placed = len([ p for p in match[1:] if p[0] in placed ])
+    for p in match[1:]:
+        assert mask[k] == (p[0] in placed and n_placed >= 3), k
+        k += 1
+print('ok: placed mask')
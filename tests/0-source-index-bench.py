@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+# Compare finding the image source files with a stat per directory and
+# extension (the old Image.__init__ search) against the one pass
+# SourceIndex listing, on a simulated slow (network) file system: each
+# stat or directory listing call sleeps for --latency ms.  Also checks
+# both find the same files.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import sys
+sys.path.append('../lib')
+import SourceIndex
+
+parser = argparse.ArgumentParser(description='Benchmark the image source index.')
+parser.add_argument('--images', type=int, default=2000, help='number of images')
+parser.add_argument('--dirs', type=int, default=5, help='number of source dirs')
+parser.add_argument('--latency', type=float, default=1.0, help='simulated latency per file system call (ms)')
+args = parser.parse_args()
+
+# fake source dirs (the images spread over the dirs, a few in none)
+root = tempfile.mkdtemp()
+dirs = []
+for d in range(args.dirs):
+    dirs.append(os.path.join(root, 'src%d' % d))
+    os.makedirs(dirs[-1])
+names = [ 'IMG_%05d' % i for i in range(args.images) ]
+for i, name in enumerate(names[:-10]):
+    ext = '.JPG' if i % 2 else '.jpg'
+    open(os.path.join(dirs[i % args.dirs], name + ext), 'w').close()
+
+latency = args.latency / 1000.0
+calls = [0]
+def slow(func):
+    def wrapper(*func_args, **func_kwargs):
+        calls[0] += 1
+        time.sleep(latency)
+        return func(*func_args, **func_kwargs)
+    return wrapper
+real_isfile = os.path.isfile
+real_scandir = os.scandir
+os.path.isfile = slow(real_isfile)
+os.scandir = slow(real_scandir)
+
+def old_search(image_base):
+    image_file = None
+    for dir in dirs:
+        dir = os.path.normpath(dir)
+        tmp1 = os.path.join(dir, image_base + '.JPG')
+        tmp2 = os.path.join(dir, image_base + '.jpg')
+        if os.path.isfile(tmp1):
+            image_file = tmp1
+        elif os.path.isfile(tmp2):
+            image_file = tmp2
+    return image_file
+
+t_start = time.time()
+old = [ old_search(name) for name in names ]
+t_old = time.time() - t_start
+calls_old = calls[0]
+
+calls[0] = 0
+t_start = time.time()
+index = SourceIndex.build(dirs)
+new = [ SourceIndex.find_image(index, name) for name in names ]
+t_new = time.time() - t_start
+calls_new = calls[0]
+
+os.path.isfile = real_isfile
+os.scandir = real_scandir
+shutil.rmtree(root)
+
+assert old == new
+print('images: %d  source dirs: %d  latency: %.1f ms' % (args.images, args.dirs, args.latency))
+print('stat search:  %6d calls %8.2f sec' % (calls_old, t_old))
+print('source index: %6d calls %8.2f sec' % (calls_new, t_new))
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+# Time the startup (imports + argument parsing) of the numbered
+# scripts: each is run with --help, the best of --runs is reported.
+# With --baseline <git revision> the scripts and lib of that revision
+# (extracted to a scratch directory) are timed too, for a before/after
+# comparison.  Scripts that fail to start (python 2 syntax, missing
+# modules) are reported as such.
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark the script startup times.')
+parser.add_argument('--runs', type=int, default=3, help='runs per script (the best is reported)')
+parser.add_argument('--baseline', help='git revision to compare against (e.g. HEAD~1)')
+parser.add_argument('--scripts', help='comma separated list of scripts (default: all numbered scripts)')
+args = parser.parse_args()
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_script(scripts_dir, script):
+    best = None
+    for i in range(args.runs):
+        t_start = time.perf_counter()
+        result = subprocess.run([sys.executable, script, '--help'],
+                                cwd=scripts_dir, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        secs = time.perf_counter() - t_start
+        if result.returncode != 0:
+            return None
+        if best is None or secs < best:
+            best = secs
+    return best
+
+if args.scripts:
+    scripts = args.scripts.split(',')
+else:
+    scripts = sorted([ os.path.basename(f) for f in
+                       glob.glob(os.path.join(root, 'scripts', '[0-9]*.py')) ])
+
+trees = [ ['current', os.path.join(root, 'scripts')] ]
+tmp_dir = None
+if args.baseline:
+    tmp_dir = tempfile.mkdtemp()
+    archive = subprocess.run(['git', 'archive', args.baseline, 'lib', 'scripts'],
+                             cwd=root, stdout=subprocess.PIPE, check=True)
+    subprocess.run(['tar', '-x', '-C', tmp_dir], input=archive.stdout,
+                   check=True)
+    trees.insert(0, [args.baseline, os.path.join(tmp_dir, 'scripts')])
+
+def fmt(secs):
+    if secs is None:
+        return '%10s' % 'fails'
+    return '%9.3fs' % secs
+
+print('%-28s' % 'script' + ''.join([ '%10s' % name[:10] for [name, d] in trees ]))
+totals = [ 0.0 for tree in trees ]
+for script in scripts:
+    times = []
+    for [name, scripts_dir] in trees:
+        if os.path.isfile(os.path.join(scripts_dir, script)):
+            times.append(time_script(scripts_dir, script))
+        else:
+            times.append(None)
+    line = '%-28s' % script[:28] + ''.join([ fmt(t) for t in times ])
+    if len(times) == 2 and None not in times:
+        line += '  %5.1fx' % (times[0] / times[1])
+        totals[0] += times[0]
+        totals[1] += times[1]
+    print(line)
+if len(trees) == 2:
+    print('%-28s' % 'total (both start)' + fmt(totals[0]) + fmt(totals[1]))
+
+if tmp_dir:
+    shutil.rmtree(tmp_dir)
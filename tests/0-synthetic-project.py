@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+# Generate a synthetic survey (rendered nadir images of a textured
+# ground plane or heightfield along a lawnmower pattern, camera config,
+# pose csv and ground truth, see lib/Synthetic.py.)  To turn it into a
+# project:
+#
+#   1a-create-project.py --project P --image-dirs OUT/images
+#   1b-set-camera-config.py --project P --camera OUT/camera.json \
+#       --yaw-deg 0 --pitch-deg -90 --roll-deg 0
+#   2a-set-poses.py --project P --sentera OUT/poses.csv
+#
+# (tests/0-pipeline-bench.py does this and runs the pipeline.)
+
+import argparse
+
+import sys
+sys.path.append('../lib')
+import Synthetic
+
+parser = argparse.ArgumentParser(description='Generate a synthetic survey.')
+parser.add_argument('--output', required=True, help='output directory')
+parser.add_argument('--images', type=int, default=16, help='number of images')
+parser.add_argument('--width', type=int, default=1024, help='image width (pixels)')
+parser.add_argument('--height', type=int, default=768, help='image height (pixels)')
+parser.add_argument('--focal', type=float, default=1000.0, help='focal length (pixels)')
+parser.add_argument('--agl', type=float, default=60.0, help='flight altitude above ground (m)')
+parser.add_argument('--ground', type=float, default=300.0, help='mean ground elevation (m)')
+parser.add_argument('--relief', type=float, default=0.0, help='heightfield relief (m), 0 = flat ground')
+parser.add_argument('--forward-overlap', type=float, default=0.7, help='image overlap along track')
+parser.add_argument('--side-overlap', type=float, default=0.6, help='image overlap across track')
+parser.add_argument('--gps-sigma', type=float, default=1.0, help='simulated gps position noise (m)')
+parser.add_argument('--att-sigma', type=float, default=1.0, help='simulated attitude noise (deg)')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+args = parser.parse_args()
+
+Synthetic.generate(args.output, images=args.images, width_px=args.width,
+                   height_px=args.height, focal_px=args.focal,
+                   agl_m=args.agl, forward_overlap=args.forward_overlap,
+                   side_overlap=args.side_overlap, ground_m=args.ground,
+                   relief_m=args.relief, gps_sigma_m=args.gps_sigma,
+                   att_sigma_deg=args.att_sigma, seed=args.seed)
+print('Wrote:', args.output)
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+# check the packed track arrays (lib/Tracks.py): pack/unpack round
+# trips of pixel and keypoint index match lists, compact() against a
+# plain python filter, save/load of the columnar copy, and the
+# read()/is_current()/read_list() choice between the copy and the
+# pickle as either one is rewritten.
+
+import os
+import pickle
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append('../lib')
+import Tracks
+
+random.seed(0)
+
+def random_matches(n_tracks, n_images, kp=False):
+    matches = []
+    for i in range(n_tracks):
+        match = [ [ random.uniform(-100, 100), random.uniform(-100, 100),
+                    random.uniform(-10, 0) ] ]
+        for image in random.sample(range(n_images), random.randint(1, 6)):
+            if kp:
+                match.append( [image, random.randint(0, 5000)] )
+            else:
+                match.append( [image, [random.uniform(0, 4000),
+                                       random.uniform(0, 3000)]] )
+        matches.append(match)
+    return matches
+
+def check_round_trip(matches, label):
+    tracks = Tracks.pack(matches)
+    assert len(tracks) == len(matches), label
+    assert tracks.num_obs() == sum([ len(m) - 1 for m in matches ]), label
+    assert Tracks.unpack(tracks) == matches, label
+    print('ok:', label)
+
+uv_matches = random_matches(2000, 50)
+kp_matches = random_matches(2000, 50, kp=True)
+check_round_trip(uv_matches, 'pack/unpack pixel coordinates')
+check_round_trip(kp_matches, 'pack/unpack keypoint indices')
+check_round_trip([], 'pack/unpack empty list')
+
+# compact() against filtering the python list
+tracks = Tracks.pack(uv_matches)
+obs_keep = np.random.RandomState(0).uniform(size=tracks.num_obs()) > 0.3
+track_keep = np.random.RandomState(1).uniform(size=len(tracks)) > 0.2
+expected = []
+k = 0
+for i, match in enumerate(uv_matches):
+    kept = [ match[0] ]
+    for p in match[1:]:
+        if obs_keep[k]:
+            kept.append(p)
+        k += 1
+    if track_keep[i]:
+        expected.append(kept)
+assert Tracks.unpack(Tracks.compact(tracks, obs_keep, track_keep)) == expected
+assert Tracks.unpack(Tracks.compact(tracks)) == uv_matches
+print('ok: compact')
+
+# save/load (memory mapped and not)
+project_dir = tempfile.mkdtemp()
+path = Tracks.tracks_dir(project_dir, 'matches_test')
+Tracks.save(path, tracks)
+for mmap in [ True, False ]:
+    loaded = Tracks.load(path, mmap)
+    assert Tracks.unpack(loaded) == uv_matches
+    assert np.array_equal(loaded.obs_track(), tracks.obs_track())
+print('ok: save/load')
+
+# the columnar copy vs the pickle
+name = 'matches_grouped'
+pickle.dump(uv_matches, open(os.path.join(project_dir, name), 'wb'))
+assert not Tracks.is_current(project_dir, name)
+assert Tracks.unpack(Tracks.read(project_dir, name)) == uv_matches
+assert Tracks.is_current(project_dir, name)
+assert Tracks.read_list(project_dir, name) == uv_matches
+print('ok: read() caches the pickle')
+
+# pickle rewritten with the same time stamp (coarse time stamps)
+st = os.stat(os.path.join(project_dir, name))
+changed = uv_matches[:1000]
+pickle.dump(changed, open(os.path.join(project_dir, name), 'wb'))
+os.utime(os.path.join(project_dir, name), ns=(st.st_atime_ns, st.st_mtime_ns))
+assert not Tracks.is_current(project_dir, name)
+assert Tracks.unpack(Tracks.read(project_dir, name)) == changed
+assert Tracks.read_list(project_dir, name) == changed
+print('ok: pickle rewritten within the same time stamp')
+
+# columnar copy written after the pickle supersedes it ...
+Tracks.write(project_dir, name, Tracks.pack(kp_matches))
+assert Tracks.is_current(project_dir, name)
+assert Tracks.read_list(project_dir, name) == kp_matches
+# ... until the pickle is rewritten
+pickle.dump(uv_matches, open(os.path.join(project_dir, name), 'wb'))
+assert not Tracks.is_current(project_dir, name)
+assert Tracks.read_list(project_dir, name) == uv_matches
+print('ok: write() and a later pickle')
+
+# columnar copy without a pickle
+Tracks.write(project_dir, 'matches_only', tracks)
+assert Tracks.is_current(project_dir, 'matches_only')
+assert Tracks.read_list(project_dir, 'matches_only') == uv_matches
+print('ok: columnar copy only')
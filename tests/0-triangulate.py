@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+# check the batched DLT triangulation (lib/Triangulate.py) against
+# cv2.triangulatePoints for two view tracks and against the true
+# points for longer tracks, plus the cheirality and angle masks, on a
+# random nadir camera layout with lens distortion.
+
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.append('../lib')
+import Tracks
+import Triangulate
+
+rng = np.random.RandomState(0)
+K = np.array( [[1200.0, 0, 960], [0, 1200.0, 720], [0, 0, 1]] )
+dist = np.array( [-0.05, 0.01, 0.001, -0.001, 0.0] )
+
+# cameras looking down (ned) from about 100m
+n_images = 20
+P = np.zeros((n_images, 3, 4))
+for i in range(n_images):
+    rvec = np.array([0.0, 0.0, rng.uniform(-np.pi, np.pi)]) + rng.normal(0, 0.05, 3)
+    R, jac = cv2.Rodrigues(rvec)
+    # camera z axis points down (+d): lens frame x = east, y = south
+    R = R.dot(np.array( [[0, 1, 0], [-1, 0, 0], [0, 0, 1]], dtype=float ))
+    center = np.array( [rng.uniform(-40, 40), rng.uniform(-40, 40),
+                        rng.uniform(-110, -90)] )
+    P[i,:,:3] = R
+    P[i,:,3] = -R.dot(center)
+
+def project(point, i):
+    rvec, jac = cv2.Rodrigues(P[i,:,:3])
+    uv, jac = cv2.projectPoints(point.reshape(1, 3), rvec, P[i,:,3], K, dist)
+    return uv.ravel().tolist()
+
+points = np.column_stack( (rng.uniform(-30, 30, 500), rng.uniform(-30, 30, 500),
+                           rng.uniform(-5, 5, 500)) )
+matches = []
+for k, point in enumerate(points):
+    n = 2 if k < 250 else rng.randint(3, 8)
+    images = rng.choice(n_images, n, replace=False)
+    matches.append( [ point.tolist() ] + [ [int(i), project(point, i)] for i in images ] )
+matches.append( [ [0.0, 0.0, 0.0], [0, project(points[0], 0)] ] ) # one view
+tracks = Tracks.pack(matches)
+
+result, valid, angle = Triangulate.triangulate(tracks, P, K, dist)
+assert np.all(np.isnan(result[-1])) and not valid[-1]
+err = np.linalg.norm(result[:-1] - points, axis=1)
+print('max error vs truth: %.2e m' % np.max(err))
+assert np.max(err) < 1e-4
+assert np.all(valid[:-1])
+print('ok: dlt vs truth')
+
+# two view tracks vs cv2.triangulatePoints on the normalized points
+xy = Triangulate.normalize(tracks, K, dist)
+for k in range(250):
+    a, b = tracks.obs_range(k)
+    X = cv2.triangulatePoints(P[tracks.obs_image[a]], P[tracks.obs_image[a+1]],
+                              xy[a].reshape(2, 1), xy[a+1].reshape(2, 1))
+    X = X[:3,0] / X[3,0]
+    assert np.linalg.norm(X - result[k]) < 1e-6, k
+print('ok: dlt vs cv2.triangulatePoints')
+
+# angles vs a pairwise python loop
+centers = Triangulate.camera_centers(P)
+for k in range(0, len(points), 37):
+    a, b = tracks.obs_range(k)
+    rays = [ points[k] - centers[i] for i in tracks.obs_image[a:b] ]
+    rays = [ r / np.linalg.norm(r) for r in rays ]
+    worst = 0.0
+    for i in range(len(rays)):
+        for j in range(i + 1, len(rays)):
+            worst = max(worst, np.degrees(np.arccos(np.clip(np.dot(rays[i], rays[j]), -1, 1))))
+    assert abs(worst - angle[k]) < 1e-6, k
+print('ok: triangulation angles')
+
+# points moved behind (above) the cameras fail the cheirality test
+behind = result.copy()
+behind[:10,2] = -500.0
+ok = Triangulate.cheirality(tracks, np.nan_to_num(behind), P)
+assert not np.any(ok[:10]) and np.all(ok[10:-1])
+valid = Triangulate.triangulate(tracks, P, K, dist, min_angle=np.median(angle[:-1]))[1]
+assert np.array_equal(valid[:-1], angle[:-1] >= np.median(angle[:-1]))
+print('ok: cheirality and min_angle masks')